@@ -0,0 +1,55 @@
+"""
+Compare two results files from run.py, e.g. from before and after a change:
+
+    python compare.py old.json new.json [--threshold 10]
+
+Prints each scenario's p50/p95/p99 latency and throughput in both, and exits with
+status 1 if any got worse by more than --threshold percent (latency up, throughput
+down) - mind the noise of a busy machine, and that the settings should match.
+"""
+import argparse
+import json
+from typing import List
+
+# Metric, and whether higher is better
+METRICS = [("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("throughput_per_s", True)]
+
+
+def compare_results(old: dict, new: dict, threshold: float = 10.0) -> List[str]:
+    """
+    :return: The regressions beyond `threshold` percent, as "scenario metric".
+    """
+    if old.get("settings") != new.get("settings"):
+        print("Warning: the results were measured with different settings")
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print("%-22s %-17s %10s %10s %8s" % ("scenario", "metric", "old", "new", "change"))
+    regressions = []
+    for scenario, new_row in new["results"].items():
+        old_row = old["results"].get(scenario)
+        if old_row is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            before, after = old_row[metric], new_row[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                regressions.append(f"{scenario} {metric}")
+                flag = " !"
+            print("%-22s %-17s %10.2f %10.2f %+7.1f%%%s" % (scenario, metric, before, after, change, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent")
+    args = parser.parse_args()
+    with open(args.old) as f:
+        old_results = json.load(f)
+    with open(args.new) as f:
+        new_results = json.load(f)
+    regressions = compare_results(old_results, new_results, args.threshold)
+    if regressions:
+        raise SystemExit(f"{len(regressions)} regression(s): {', '.join(regressions)}")
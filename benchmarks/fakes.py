@@ -0,0 +1,175 @@
+"""
+Local stand-ins for the services that run on the GPU laptop, so the rest of the
+system can be benchmarked anywhere:
+
+    uvicorn fakes:embedding_gen --port 5000
+    uvicorn fakes:ollama --port 11434
+
+Both are deterministic: an embedding is a unit vector seeded by a hash of the text
+(so the same text always gets the same vector, but similar texts don't get similar
+ones), and an answer is a sequence of words seeded by a hash of the prompt. Their
+latency is simulated from the FAKE_* environment variables below, with requests
+served FAKE_*_PARALLEL at a time like one GPU would.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+from fastapi import FastAPI, Header, Response
+from fastapi.responses import StreamingResponse
+from typing_extensions import TypedDict
+
+
+EMBEDDING_DIMENSION = int(os.getenv("FAKE_EMBED_DIMENSION", "768"))
+# Per request, plus per sentence in it
+EMBED_LATENCY_MS = float(os.getenv("FAKE_EMBED_LATENCY_MS", "10"))
+EMBED_MS_PER_SENTENCE = float(os.getenv("FAKE_EMBED_MS_PER_SENTENCE", "0.5"))
+EMBED_PARALLEL = int(os.getenv("FAKE_EMBED_PARALLEL", "1"))
+
+OLLAMA_MODEL = os.getenv("FAKE_OLLAMA_MODEL", "phi3")
+OLLAMA_LOAD_MS = float(os.getenv("FAKE_OLLAMA_LOAD_MS", "5"))
+OLLAMA_PROMPT_MS_PER_TOKEN = float(os.getenv("FAKE_OLLAMA_PROMPT_MS_PER_TOKEN", "0.2"))
+OLLAMA_TOKENS_PER_SECOND = float(os.getenv("FAKE_OLLAMA_TOKENS_PER_SECOND", "50"))
+OLLAMA_ANSWER_TOKENS = int(os.getenv("FAKE_OLLAMA_ANSWER_TOKENS", "40"))
+OLLAMA_PARALLEL = int(os.getenv("FAKE_OLLAMA_PARALLEL", "1"))
+
+ANSWER_WORDS = (
+    "the energy of a system is conserved while entropy increases so heat flows from hot to cold "
+    "because the model predicts that this state is more likely than the other one").split()
+
+
+def text_seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+def hash_embeddings(sentences: List[str]) -> np.ndarray:
+    embeddings = np.empty((len(sentences), EMBEDDING_DIMENSION), dtype=np.float32)
+    for i, sentence in enumerate(sentences):
+        vector = np.random.default_rng(text_seed(sentence)).standard_normal(EMBEDDING_DIMENSION)
+        embeddings[i] = vector / np.linalg.norm(vector)
+    return embeddings
+
+
+embedding_gen = FastAPI(title="Fake embedding generation service")
+# Created on first use, on the server's event loop
+_embed_slots: Optional[asyncio.Semaphore] = None
+
+
+class EmbeddingsGenerationRequest(TypedDict):
+    sentences: List[str]
+
+
+# As in embedding-gen-service/app.py
+BINARY_EMBEDDING_DTYPES = {
+    "application/x-float32": np.dtype("<f4"),
+    "application/x-float16": np.dtype("<f2"),
+}
+
+
+@embedding_gen.get("/ping")
+def embed_ping():
+    return "pong"
+
+
+@embedding_gen.post("/generate-embeddings")
+async def generate_embeddings(request: EmbeddingsGenerationRequest, accept: Optional[str] = Header(None)):
+    global _embed_slots
+    if _embed_slots is None:
+        _embed_slots = asyncio.Semaphore(EMBED_PARALLEL)
+    sentences = request["sentences"]
+    async with _embed_slots:
+        await asyncio.sleep((EMBED_LATENCY_MS + EMBED_MS_PER_SENTENCE * len(sentences)) / 1000)
+    embeddings = hash_embeddings(sentences)
+    media_type = next((t for t in BINARY_EMBEDDING_DTYPES if accept and t in accept), None)
+    if media_type is None:
+        return {"embeddings": embeddings.tolist()}
+    dtype = BINARY_EMBEDDING_DTYPES[media_type]
+    return Response(
+        content=embeddings.astype(dtype).tobytes(), media_type=media_type,
+        headers={"X-Embedding-Shape": f"{len(sentences)},{EMBEDDING_DIMENSION}", "X-Embedding-Dtype": dtype.name})
+
+
+ollama = FastAPI(title="Fake Ollama")
+_ollama_slots: Optional[asyncio.Semaphore] = None
+_model_loaded = False
+
+
+class GenerateRequest(TypedDict):
+    model: str
+    prompt: str
+    stream: bool
+
+
+def answer_tokens(prompt: str) -> List[str]:
+    rng = np.random.default_rng(text_seed(prompt))
+    return [ANSWER_WORDS[i] + " " for i in rng.integers(len(ANSWER_WORDS), size=OLLAMA_ANSWER_TOKENS)]
+
+
+def ollama_chunk(response: str, done: bool, **fields) -> dict:
+    return {
+        "model": OLLAMA_MODEL,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "response": response,
+        "done": done,
+        **fields,
+    }
+
+
+@ollama.get("/")
+def ollama_ping():
+    return Response("Ollama is running")
+
+
+@ollama.post("/api/generate")
+async def generate(request: GenerateRequest):
+    """
+    Like Ollama's /api/generate: a JSON response, or with `stream` newline-delimited
+    JSON chunks ending with one that has "done" and the timing fields (nanoseconds).
+    """
+    global _ollama_slots
+    if _ollama_slots is None:
+        _ollama_slots = asyncio.Semaphore(OLLAMA_PARALLEL)
+    tokens = answer_tokens(request["prompt"])
+    prompt_eval_count = len(request["prompt"].split())
+
+    async def generation():
+        global _model_loaded
+        async with _ollama_slots:
+            start = time.perf_counter()
+            load_seconds = 0.0 if _model_loaded else OLLAMA_LOAD_MS / 1000
+            _model_loaded = True
+            prompt_eval_seconds = OLLAMA_PROMPT_MS_PER_TOKEN * prompt_eval_count / 1000
+            await asyncio.sleep(load_seconds + prompt_eval_seconds)
+            eval_start = time.perf_counter()
+            for token in tokens:
+                await asyncio.sleep(1 / OLLAMA_TOKENS_PER_SECOND)
+                yield token
+            eval_seconds = time.perf_counter() - eval_start
+            yield {
+                "done_reason": "stop",
+                "context": [],
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "load_duration": int(load_seconds * 1e9),
+                "prompt_eval_count": prompt_eval_count,
+                "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(eval_seconds * 1e9),
+            }
+
+    if not request.get("stream", True):
+        parts = [part async for part in generation()]
+        return ollama_chunk("".join(parts[:-1]), True, **parts[-1])
+
+    async def chunks():
+        async for part in generation():
+            if isinstance(part, str):
+                yield json.dumps(ollama_chunk(part, False)) + "\n"
+            else:
+                yield json.dumps(ollama_chunk("", True, **part)) + "\n"
+
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
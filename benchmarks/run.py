@@ -0,0 +1,357 @@
+"""
+Load tests of the whole system, with the services on the GPU laptop replaced by
+fakes.py's stand-ins, so they run anywhere and give the same answers every time:
+
+    python run.py [seed] [search] [rounds] [users] [--out results.json] [--baseline old.json]
+
+Writes a synthetic corpus and notes (synthetic.py) to a temporary directory, then
+starts the transcript, notes, embedding index and question answerer services on it,
+each in its own uvicorn process as in docker-compose, plus the fakes. The services'
+requirements and uvicorn must be installed, and the generated clients built (`make
+service-client-gen`) into --clients-dir.
+
+`seed` times the embedding index's first sync of the corpus (embedding every chunk
+through the fake). It always runs, as the other scenarios need the index.
+
+`search` sends one query at a time to the embedding index: a vector search (/search,
+with the query embedded here), a hybrid search (/search:hybrid, embedded by the
+index) and a lexical one.
+
+`rounds` asks for question rounds over notes files with 1, 5 and 20 questions (see
+--round-sizes), one at a time, regenerating every answer; then again, answered from
+the answer cache.
+
+`users` has 1, 4 and 16 users (see --users) asking for rounds at once, each of its
+own notes files.
+
+Each scenario's latency percentiles and throughput are printed and written to --out
+as JSON, with the commit and settings they were measured with. --baseline prints
+the change from an earlier results file (see compare.py).
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+import synthetic
+from compare import compare_results
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Upstream name (as service_http knows it), app directory, ASGI app, readiness path;
+# in start order
+SERVICES = [
+    ("EMBEDDING_GEN_SERVICE", BENCH_DIR, "fakes:embedding_gen", "/ping"),
+    ("OLLAMA_SERVICE", BENCH_DIR, "fakes:ollama", "/"),
+    ("TRANSCRIPT_SERVICE", os.path.join(REPO_DIR, "script-stuff"), "app:app", "/ping"),
+    ("NOTES_SERVICE", os.path.join(REPO_DIR, "notes-service"), "app:app", "/ping"),
+    ("EMBEDDING_INDEX_SERVICE", os.path.join(REPO_DIR, "embedding-index"), "app:app", "/ping"),
+    ("QA_SERVICE", os.path.join(REPO_DIR, "question-answerer"), "app:app", "/ping"),
+]
+# As in docker-compose
+CLIENT_PACKAGES = ["embedding_service", "transcript_service", "notes_service", "embedding_index_service"]
+FAKE_SETTINGS = [
+    "FAKE_EMBED_DIMENSION", "FAKE_EMBED_LATENCY_MS", "FAKE_EMBED_MS_PER_SENTENCE", "FAKE_EMBED_PARALLEL",
+    "FAKE_OLLAMA_LOAD_MS", "FAKE_OLLAMA_PROMPT_MS_PER_TOKEN", "FAKE_OLLAMA_TOKENS_PER_SECOND",
+    "FAKE_OLLAMA_ANSWER_TOKENS", "FAKE_OLLAMA_PARALLEL",
+]
+READY_TIMEOUT = 120.0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def log_tail(path: str, lines: int = 30) -> str:
+    with open(path, errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+class Stack:
+    """
+    The services, each a uvicorn process working in its own directory under
+    `work_dir` (where their index, chunk store, etc. go) and logging to a file there.
+    """
+    def __init__(self, work_dir: str, clients_dir: str):
+        self.work_dir = work_dir
+        self.urls = {name: f"http://127.0.0.1:{free_port()}" for name, *_ in SERVICES}
+        self.env = {
+            **os.environ,
+            **{f"{name}_URL": url for name, url in self.urls.items()},
+            "PYTHONPATH": os.pathsep.join(
+                [os.path.join(clients_dir, p) for p in CLIENT_PACKAGES] + [os.path.join(REPO_DIR, "shared")]),
+            "TRANSCRIPTS_DIR": os.path.join(work_dir, "transcripts"),
+            "NOTES_DIR": os.path.join(work_dir, "notes"),
+        }
+        self.processes: List[subprocess.Popen] = []
+
+    def start(self, name: str) -> float:
+        """
+        Start a service and wait for it to answer.
+        :return: When it started answering (time.perf_counter).
+        """
+        _, app_dir, app, ready_path = next(s for s in SERVICES if s[0] == name)
+        service_dir = os.path.join(self.work_dir, name.lower())
+        os.makedirs(service_dir, exist_ok=True)
+        log_path = os.path.join(service_dir, "log.txt")
+        port = self.urls[name].rsplit(":", 1)[1]
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "--app-dir", app_dir, app, "--port", port, "--log-level", "warning"],
+                cwd=service_dir, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        deadline = time.monotonic() + READY_TIMEOUT
+        while True:
+            if process.poll() is not None:
+                raise SystemExit(f"{name} exited with {process.returncode}:\n{log_tail(log_path)}")
+            try:
+                if httpx.get(self.urls[name] + ready_path, timeout=1).status_code == 200:
+                    return time.perf_counter()
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"{name} didn't start within {READY_TIMEOUT}s:\n{log_tail(log_path)}")
+            time.sleep(0.1)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def summarize(latencies: List[float], seconds: float, errors: int, **extra: float) -> Dict[str, float]:
+    """
+    Latency percentiles (ms) of the successful requests, and requests/s over `seconds`.
+    """
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "throughput_per_s": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        **extra,
+    }
+
+
+def print_row(name: str, row: Dict[str, float]):
+    print("%-22s %8d %6d %9.1f %9.1f %9.1f %10.2f" % (
+        name, row["requests"], row["errors"], row["p50_ms"], row["p95_ms"], row["p99_ms"], row["throughput_per_s"]))
+
+
+async def timed(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> Tuple[float, bool]:
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code == 200
+        if not ok:
+            print(f"{method} {url}: {response.status_code} {response.text[:200]}")
+    except httpx.HTTPError as e:
+        print(f"{method} {url}: {e!r}")
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def run_sequentially(requests: List[Tuple[str, str, dict]], warmup: int = 0) -> Dict[str, float]:
+    async with httpx.AsyncClient(timeout=None) as client:
+        for method, url, kwargs in requests[:warmup]:
+            await timed(client, method, url, **kwargs)
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for method, url, kwargs in requests:
+            seconds, ok = await timed(client, method, url, **kwargs)
+            if ok:
+                latencies.append(seconds)
+            else:
+                errors += 1
+        return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def bench_seed(stack: Stack) -> Dict[str, float]:
+    """
+    The index syncs on startup; POST /sync waits for that sync and returns its count.
+    """
+    started = stack.start("EMBEDDING_INDEX_SERVICE")
+    response = httpx.post(stack.urls["EMBEDDING_INDEX_SERVICE"] + "/sync", timeout=None)
+    response.raise_for_status()
+    seconds = time.perf_counter() - started
+    vectors = response.json()["vector_count"]
+    return summarize([seconds], seconds, 0, vectors=vectors, vectors_per_s=vectors / seconds)
+
+
+def bench_search(stack: Stack, queries: List[str], nb_searches: int) -> Dict[str, Dict[str, float]]:
+    from fakes import hash_embeddings
+    index_url = stack.urls["EMBEDDING_INDEX_SERVICE"]
+    queries = [queries[i % len(queries)] for i in range(nb_searches)]
+    embeddings = hash_embeddings(queries)
+    requests = {
+        "vector": [("POST", index_url + "/search", {"json": {"query_embedding": e.tolist(), "top_k": 5}})
+                   for e in embeddings],
+        "hybrid": [("POST", index_url + "/search:hybrid", {"json": {"queries": [q], "top_k": 5}}) for q in queries],
+        "lexical": [("POST", index_url + "/search:hybrid", {"json": {"queries": [q], "top_k": 5, "mode": "lexical"}})
+                    for q in queries],
+    }
+    return {f"search.{mode}": asyncio.run(run_sequentially(r, warmup=5)) for mode, r in requests.items()}
+
+
+def round_request(stack: Stack, rel_path: str, regenerate: Optional[List[str]]) -> Tuple[str, str, dict]:
+    body: dict = {"filePath": rel_path}
+    if regenerate is not None:
+        body["regenerate"] = regenerate
+    return "POST", stack.urls["QA_SERVICE"] + "/question-rounds", {"json": body}
+
+
+def bench_rounds(
+        stack: Stack, notes: Dict[str, List[str]], round_sizes: List[int], nb_rounds: int) -> Dict[str, Dict[str, float]]:
+    rows = {}
+    for size in round_sizes:
+        paths = [f"round-n{size}-{i}.txt" for i in range(nb_rounds)]
+        fresh = asyncio.run(run_sequentially([round_request(stack, p, notes[p]) for p in paths]))
+        rows[f"round.n{size}"] = {**fresh, "questions_per_s": fresh["throughput_per_s"] * size}
+        cached = asyncio.run(run_sequentially([round_request(stack, p, None) for p in paths]))
+        rows[f"round_cached.n{size}"] = {**cached, "questions_per_s": cached["throughput_per_s"] * size}
+    return rows
+
+
+async def concurrent_users(stack: Stack, notes: Dict[str, List[str]], paths: List[List[str]]) -> Dict[str, float]:
+    """
+    :param paths: Each user's notes files, asked about one after another.
+    """
+    latencies, errors = [], 0
+
+    async def user(user_paths: List[str]):
+        nonlocal errors
+        async with httpx.AsyncClient(timeout=None) as client:
+            for rel_path in user_paths:
+                method, url, kwargs = round_request(stack, rel_path, notes[rel_path])
+                seconds, ok = await timed(client, method, url, **kwargs)
+                if ok:
+                    latencies.append(seconds)
+                else:
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(p) for p in paths))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def bench_users(
+        stack: Stack,
+        notes: Dict[str, List[str]],
+        nb_users: List[int],
+        user_rounds: int,
+        user_questions: int) -> Dict[str, Dict[str, float]]:
+    rows = {}
+    for users in nb_users:
+        paths = [[f"round-n{user_questions}-{u * user_rounds + r}.txt" for r in range(user_rounds)] for u in range(users)]
+        row = asyncio.run(concurrent_users(stack, notes, paths))
+        rows[f"users.u{users}"] = {**row, "questions_per_s": row["throughput_per_s"] * user_questions}
+    return rows
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty.strip() else "")
+
+
+def run(args: argparse.Namespace) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="sb-bench-")
+    round_sizes = [int(n) for n in args.round_sizes.split(",")]
+    nb_users = [int(n) for n in args.users.split(",")]
+    notes_files = {size: args.rounds for size in round_sizes}
+    notes_files[args.user_questions] = max(notes_files.get(args.user_questions, 0), max(nb_users) * args.user_rounds)
+    corpus = synthetic.write_corpus(work_dir, args.transcripts, args.lines, args.seed)
+    notes = synthetic.write_notes(work_dir, corpus, notes_files, args.seed)
+    stack = Stack(work_dir, args.clients_dir)
+    results: Dict[str, Dict[str, float]] = {}
+    print("%-22s %8s %6s %9s %9s %9s %10s" % ("scenario", "requests", "errors", "p50 ms", "p95 ms", "p99 ms", "per s"))
+    try:
+        for name in ["EMBEDDING_GEN_SERVICE", "OLLAMA_SERVICE", "TRANSCRIPT_SERVICE", "NOTES_SERVICE"]:
+            stack.start(name)
+        results["seed"] = bench_seed(stack)
+        print_row("seed", results["seed"])
+        stack.start("QA_SERVICE")
+        queries = [q for questions in notes.values() for q in questions]
+        for scenario in args.scenarios:
+            if scenario == "seed":
+                continue
+            elif scenario == "search":
+                rows = bench_search(stack, queries, args.searches)
+            elif scenario == "rounds":
+                rows = bench_rounds(stack, notes, round_sizes, args.rounds)
+            elif scenario == "users":
+                rows = bench_users(stack, notes, nb_users, args.user_rounds, args.user_questions)
+            else:
+                raise SystemExit(f"Unknown scenario: {scenario}")
+            for name, row in rows.items():
+                print_row(name, row)
+            results.update(rows)
+    finally:
+        stack.stop()
+        if args.keep:
+            print(f"Services' data and logs kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {
+            **{k: v for k, v in vars(args).items() if k not in ("out", "baseline", "keep", "clients_dir")},
+            **{k: os.environ[k] for k in FAKE_SETTINGS if k in os.environ},
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=["seed", "search", "rounds", "users"])
+    parser.add_argument("--out", default="results.json")
+    parser.add_argument("--baseline", help="Earlier results to compare with")
+    parser.add_argument("--clients-dir", default=os.path.join(REPO_DIR, "clients", "python"))
+    parser.add_argument("--keep", action="store_true", help="Keep the services' data and logs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--transcripts", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=120, help="Lines per transcript")
+    parser.add_argument("--searches", type=int, default=200, help="Queries per search mode")
+    parser.add_argument("--round-sizes", default="1,5,20", help="Questions per round")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per size")
+    parser.add_argument("--users", default="1,4,16", help="Concurrent users")
+    parser.add_argument("--user-rounds", type=int, default=3, help="Rounds per user")
+    parser.add_argument("--user-questions", type=int, default=5, help="Questions per user round")
+    args = parser.parse_args()
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare_results(json.load(f), report)
@@ -0,0 +1,107 @@
+"""
+Synthetic transcripts and notes for the benchmarks, the same for a given seed:
+
+    python synthetic.py out/ [--transcripts N] [--lines N] [--seed N]
+
+writes out/transcripts/*.json (the transcript service's format) and out/notes/,
+whose files are named for the question rounds they're made for, e.g.
+"round-n5-0.txt" for the first of the files with 5 questions. Questions are built
+from the transcripts' own sentences, so keyword search finds their sources.
+"""
+import argparse
+import json
+import os
+import random
+from typing import Dict, List
+
+# Few enough words (Zipf-distributed, like speech) that searches match many chunks
+VOCABULARY = (
+    "energy entropy heat temperature system state model particle field wave force mass "
+    "charge current voltage circuit signal frequency spectrum gradient vector matrix "
+    "network layer weight loss function data sample prior posterior probability "
+    "evidence theory experiment measure result error rate value process reaction "
+    "molecule cell protein gene pressure volume density flow rotation orbit").split()
+FILLER = "so and then basically like the a of to in is that it this we you".split()
+ZIPF_WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+TAGS = ["physics", "chemistry", "biology", "machine-learning", "electronics"]
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    picked = [
+        rng.choice(FILLER) if rng.random() < 0.4 else rng.choices(VOCABULARY, ZIPF_WEIGHTS)[0]
+        for _ in range(words)]
+    return " ".join(picked).capitalize() + "."
+
+
+def transcript(rng: random.Random, index: int, nb_lines: int) -> dict:
+    """
+    A transcript in the transcript service's JSON format: caption lines of a few
+    words, with sentences running across them.
+    """
+    words = " ".join(sentence(rng, rng.randint(8, 20)) for _ in range(nb_lines // 2 + 1)).split()
+    per_line = len(words) // nb_lines
+    starts = [i * per_line for i in range(nb_lines)] + [len(words)]
+    return {
+        "id": f"synth{index:06d}",
+        "name": f"Synthetic lecture {index}",
+        "lines": [{"timeStamp": i * 3000, "text": " ".join(words[starts[i]:starts[i + 1]])} for i in range(nb_lines)],
+        "tags": [TAGS[index % len(TAGS)]],
+    }
+
+
+def question(rng: random.Random, transcripts: List[dict]) -> str:
+    line = rng.choice(rng.choice(transcripts)["lines"])["text"].replace(".", "").lower()
+    return f"Why does {line} {rng.choice(['matter', 'happen', 'hold', 'follow'])}?"
+
+
+def notes_file(rng: random.Random, transcripts: List[dict], nb_questions: int) -> str:
+    """
+    A notes file with `nb_questions` "* " question lines among other notes.
+    """
+    lines = ["Notes on the synthetic lectures", ""]
+    for _ in range(nb_questions):
+        lines += [sentence(rng, 12), "- " + sentence(rng, 6), "* " + question(rng, transcripts), ""]
+    return "\n".join(lines)
+
+
+def write_corpus(out_dir: str, nb_transcripts: int, nb_lines: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    transcripts_dir = os.path.join(out_dir, "transcripts")
+    os.makedirs(transcripts_dir, exist_ok=True)
+    transcripts = [transcript(rng, i, nb_lines) for i in range(nb_transcripts)]
+    for t in transcripts:
+        with open(os.path.join(transcripts_dir, f"{t['id']}.json"), "w") as f:
+            json.dump(t, f)
+    return transcripts
+
+
+def write_notes(out_dir: str, transcripts: List[dict], files: Dict[int, int], seed: int = 0) -> Dict[str, List[str]]:
+    """
+    :param files: How many notes files to write with each number of questions.
+    :return: Each notes file's questions, by path relative to out/notes/, as the
+        notes service gives them (with their "* ", which `regenerate` must match).
+    """
+    rng = random.Random(seed + 1)
+    notes_dir = os.path.join(out_dir, "notes")
+    os.makedirs(notes_dir, exist_ok=True)
+    questions: Dict[str, List[str]] = {}
+    for nb_questions, nb_files in sorted(files.items()):
+        for i in range(nb_files):
+            rel_path = f"round-n{nb_questions}-{i}.txt"
+            text = notes_file(rng, transcripts, nb_questions)
+            with open(os.path.join(notes_dir, rel_path), "w") as f:
+                f.write(text)
+            questions[rel_path] = [line for line in text.splitlines() if line.startswith("* ")]
+    return questions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("out_dir")
+    parser.add_argument("--transcripts", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    corpus = write_corpus(args.out_dir, args.transcripts, args.lines, args.seed)
+    written = write_notes(args.out_dir, corpus, {1: 4, 5: 4, 20: 4}, args.seed)
+    print(f"Wrote {len(corpus)} transcripts and {len(written)} notes files to {args.out_dir}")
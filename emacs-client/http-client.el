@@ -22,4 +22,36 @@
 		(message "Server response: %s" response-body)
 		(funcall error-cb error-thrown))))))
 
+;; Uses curl rather than `request', which only hands over the response once it's
+;; complete.
+(defun stream-qa-round (file-name event-cb done-cb &optional regenerate)
+  "Start a streaming QA round for FILE-NAME.
+Calls EVENT-CB with each newline-delimited JSON event (as an alist) as it
+arrives, then DONE-CB with curl's exit status once the stream ends.
+REGENERATE is a list of question texts to answer afresh rather than from
+the answer cache."
+  (message "in stream-qa-round")
+  (let ((pending ""))
+    (make-process
+     :name "study-buddy-qa-stream"
+     :command (list "curl" "--silent" "--no-buffer" "--fail"
+		    "-X" "POST"
+		    "-H" "Content-Type: application/json"
+		    "--data" (json-encode `(("filePath" . ,file-name)
+					    ("regenerate" . ,(vconcat regenerate))))
+		    (concat api-base-url "/question-rounds:stream"))
+     :coding 'utf-8
+     :connection-type 'pipe
+     :noquery t
+     :filter (lambda (_proc output)
+	       ;; Output arrives in arbitrary pieces; only parse complete lines
+	       (let ((lines (split-string (concat pending output) "\n")))
+		 (setq pending (car (last lines)))
+		 (dolist (line (butlast lines))
+		   (unless (equal line "")
+		     (funcall event-cb (json-read-from-string line))))))
+     :sentinel (lambda (proc _event)
+		 (unless (process-live-p proc)
+		   (funcall done-cb (process-exit-status proc)))))))
+
 (provide 'http-client)
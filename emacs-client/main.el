@@ -1,6 +1,7 @@
 ;;; -*- lexical-binding: t -*-
 
 (require 'http-client)
+(require 'seq)
 
 
 (define-minor-mode study-buddy-mode
@@ -12,19 +13,58 @@
 
 
 
+(defvar-local study-buddy-answer-markers nil
+  "Vector of (START . END) markers around each question's answer.")
+
+(defvar-local study-buddy-answer-started nil
+  "Vector saying whether each question's answer has started arriving.")
+
+(defvar-local study-buddy-qa-notes-file nil
+  "Name of the notes file the QA buffer's round is for.")
+
+
 (defun study-buddy-qa-current-file ()
   (interactive)
   (message (format "gonna do study buddy qa on file %s" (buffer-name)))
-  (let ((notes-file-name (buffer-name)))
+  (let ((notes-file-name (buffer-name))
+	qa-buffer)
     (select-window (split-window-right))
     (switch-to-buffer "*Study Buddy QA*")
+    (setq qa-buffer (current-buffer))
     (study-buddy-render-loading)
-    (create-qa-round
-     notes-file-name
-     #'study-buddy-render-success
-     #'study-buddy-render-error))
+    (study-buddy-start-qa-round notes-file-name qa-buffer))
   )
 
+(defun study-buddy-regenerate-question-at-point ()
+  "Re-run the QA round, generating a new answer for the question at point.
+The other questions' answers come from the answer cache."
+  (interactive)
+  (let ((question (get-text-property (point) 'study-buddy-question))
+	(qa-buffer (current-buffer)))
+    (unless question
+      (user-error "No question at point"))
+    (message "Regenerating the answer to: %s" question)
+    (study-buddy-start-qa-round study-buddy-qa-notes-file qa-buffer (list question))))
+
+(defun study-buddy-start-qa-round (notes-file-name qa-buffer &optional regenerate)
+  "Stream a QA round for NOTES-FILE-NAME into QA-BUFFER.
+REGENERATE lists questions whose cached answers should be replaced."
+  (with-current-buffer qa-buffer
+    (setq study-buddy-qa-notes-file notes-file-name))
+  ;; Answers are rendered as their tokens arrive, so the first words show up
+  ;; as soon as the LLM produces them
+  (stream-qa-round
+   notes-file-name
+   (lambda (event)
+     (when (buffer-live-p qa-buffer)
+       (with-current-buffer qa-buffer
+	 (study-buddy-render-event event))))
+   (lambda (exit-status)
+     (when (and (buffer-live-p qa-buffer) (/= exit-status 0))
+       (with-current-buffer qa-buffer
+	 (study-buddy-render-error (format "QA stream failed (curl exit status %d)" exit-status)))))
+   regenerate))
+
 (defun study-buddy-render-loading ()
   "Render a loading message in the current buffer."
   (let ((inhibit-read-only t))
@@ -33,17 +73,64 @@
     (read-only-mode 1)))
 
 
-(defun study-buddy-render-success (data)
-  (let ((inhibit-read-only t))
-    (erase-buffer)
-    (insert "QA Data Loaded Successfully:\n\n")
-    (mapcar (lambda (qaAttempt)
-	      (let ((llmAnswer (alist-get 'llmAnswer qaAttempt))
-		    (questionText (alist-get 'questionText qaAttempt)))
-		(insert (format "Question:\n%s\n\nLLM Answer:\n%s\n\n" questionText llmAnswer))
-		(insert "\n\n\n"))
-	      ) (alist-get 'qaAttempts data))
-    (read-only-mode 1)))
+(defun study-buddy-render-event (event)
+  "Render one event of a streaming QA round in the current buffer."
+  (let ((inhibit-read-only t)
+	(index (alist-get 'questionIndex event)))
+    (pcase (alist-get 'type event)
+      ("round" (study-buddy-render-round (alist-get 'questions event)))
+      ("token" (study-buddy-append-answer index (alist-get 'text event)))
+      ;; The finished answer replaces whatever tokens were streamed for it
+      ("qaAttempt" (study-buddy-set-answer
+		    index (alist-get 'llmAnswer (alist-get 'qaAttempt event))))
+      ("error" (if index
+		   (study-buddy-set-answer index (format "[Error: %s]" (alist-get 'detail event)))
+		 (study-buddy-render-error (alist-get 'detail event))))
+      ("done" (message "Study Buddy QA round done")))))
+
+
+(defun study-buddy-render-round (questions)
+  "Lay out QUESTIONS, each with a placeholder for its answer."
+  (erase-buffer)
+  (insert "QA Round:\n\n")
+  (setq study-buddy-answer-markers (make-vector (length questions) nil))
+  (setq study-buddy-answer-started (make-vector (length questions) nil))
+  (seq-do-indexed
+   (lambda (questionText i)
+     (let ((block-start (point)))
+       (insert (format "Question:\n%s\n\nLLM Answer:\n" questionText))
+       (let ((start (point-marker)))
+	 (insert "...")
+	 (let ((end (point-marker)))
+	   ;; END moves past text inserted at it, START stays put
+	   (set-marker-insertion-type end t)
+	   (aset study-buddy-answer-markers i (cons start end))))
+       (insert "\n\n\n\n")
+       ;; For `study-buddy-regenerate-question-at-point'. Answers are inserted
+       ;; with `insert-and-inherit' so they carry it too
+       (put-text-property block-start (point) 'study-buddy-question questionText)))
+   questions)
+  (read-only-mode 1))
+
+
+(defun study-buddy-set-answer (index text)
+  "Replace the answer to question INDEX with TEXT."
+  (let ((markers (aref study-buddy-answer-markers index)))
+    (save-excursion
+      (delete-region (car markers) (cdr markers))
+      (goto-char (car markers))
+      (insert-and-inherit text))
+    (aset study-buddy-answer-started index t)))
+
+
+(defun study-buddy-append-answer (index text)
+  "Add TEXT to the end of the answer to question INDEX."
+  (if (aref study-buddy-answer-started index)
+      (save-excursion
+	(goto-char (cdr (aref study-buddy-answer-markers index)))
+	(insert-and-inherit text))
+    ;; First token: replace the placeholder
+    (study-buddy-set-answer index text)))
 
 (defun study-buddy-render-error (error-info)
   "Render the error message in the current buffer.
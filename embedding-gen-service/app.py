@@ -1,19 +1,39 @@
 import json
 import traceback
-from fastapi import FastAPI, HTTPException
-from typing_extensions import List, TypedDict
+from fastapi import FastAPI, Header, HTTPException, Response
+from typing_extensions import List, Optional, TypedDict
+import numpy as np
 import requests
 import os
 from sentence_transformers import SentenceTransformer
 
+from batcher import MicroBatcher
+from embedding_cache import EmbeddingCache
+
 app = FastAPI(
     title="Embedding generation service",
     description="Service for generating embeddings")
 # model = SentenceTransformer("all-MiniLM-L6-v2")  # 384
 # model = SentenceTransformer("all-MiniLM-L12-v2")  # 384
-model = SentenceTransformer("all-distilroberta-v1") # 768
+MODEL_NAME = "all-distilroberta-v1" # 768
+model = SentenceTransformer(MODEL_NAME)
 # model = SentenceTransformer("msmarco-distilbert-base-v4") # 768
 
+# Concurrent requests are encoded together: up to EMBED_MAX_BATCH_SIZE sentences, waiting
+# at most EMBED_MAX_WAIT_MS for a batch to fill while the model is busy
+batcher = MicroBatcher(
+    model.encode,
+    max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", "128")),
+    max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "5")))
+
+# Embeddings of texts seen before are served from memory, or from EMBEDDING_CACHE_DIR
+# if set, instead of being re-encoded
+embedding_cache = EmbeddingCache(
+    MODEL_NAME,
+    dimension=model.get_sentence_embedding_dimension(),
+    capacity=int(os.getenv("EMBEDDING_CACHE_SIZE", "20000")),
+    disk_dir=os.getenv("EMBEDDING_CACHE_DIR"))
+
 
 class EmbeddingsGenerationRequest(TypedDict):
     sentences: List[str]
@@ -23,13 +43,33 @@ class EmbeddingsGenerationResponse(TypedDict):
     embeddings: List[List[float]]
 
 
+# Binary alternatives to the JSON response, picked with the Accept header: the raw
+# little-endian rows of the embeddings matrix, with its shape in X-Embedding-Shape
+BINARY_EMBEDDING_DTYPES = {
+    "application/x-float32": np.dtype("<f4"),
+    "application/x-float16": np.dtype("<f2"),
+}
+
+
+def binary_embeddings_response(embeddings: np.ndarray, media_type: str) -> Response:
+    rows, dimension = embeddings.shape
+    dtype = BINARY_EMBEDDING_DTYPES[media_type]
+    return Response(
+        content=np.ascontiguousarray(embeddings, dtype=dtype).tobytes(),
+        media_type=media_type,
+        headers={"X-Embedding-Shape": f"{rows},{dimension}", "X-Embedding-Dtype": dtype.name})
+
+
 @app.get("/ping")
 def ping_pong():
     return "pongggggggggg"
 
 
-@app.post("/generate-embeddings", response_model=EmbeddingsGenerationResponse)
-def generate_embeddings(request: EmbeddingsGenerationRequest) -> EmbeddingsGenerationResponse:
+@app.post(
+    "/generate-embeddings",
+    response_model=EmbeddingsGenerationResponse,
+    responses={200: {"content": {t: {} for t in BINARY_EMBEDDING_DTYPES}}})
+def generate_embeddings(request: EmbeddingsGenerationRequest, accept: Optional[str] = Header(None)):
     if "sentences" not in request:
         raise HTTPException(status_code=400, detail="Missing 'sentences' field in request")
 
@@ -37,8 +77,30 @@ def generate_embeddings(request: EmbeddingsGenerationRequest) -> EmbeddingsGener
     if not isinstance(sentences, list):
         raise HTTPException(status_code=400, detail="'sentences' must be a list of strings")
 
-    embeddings = model.encode(sentences).tolist()  # Convert to list for JSON serialization
-    return {"embeddings": embeddings}
+    if sentences:
+        embeddings = embedding_cache.get_or_compute(sentences, batcher.encode)
+    else:
+        embeddings = np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    media_type = next((t for t in BINARY_EMBEDDING_DTYPES if accept and t in accept), None)
+    if media_type is not None:
+        return binary_embeddings_response(embeddings, media_type)
+    return {"embeddings": embeddings.tolist()}  # Convert to list for JSON serialization
+
+
+@app.get("/batching-stats", response_model=dict)
+def batching_stats():
+    """
+    Queue depth, batch sizes and latencies of the micro-batcher in front of the model.
+    """
+    return batcher.stats_snapshot()
+
+
+@app.get("/cache-stats", response_model=dict)
+def cache_stats():
+    """
+    Hit rates and sizes of the embedding cache tiers.
+    """
+    return embedding_cache.stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List
+import numpy as np
+
+
+class EncodeRequest:
+    def __init__(self, sentences: List[str]):
+        self.sentences = sentences
+        self.future: "Future[np.ndarray]" = Future()
+        self.enqueued_at = time.monotonic()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class BatchingStats:
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.batches = 0
+        self.sentences = 0
+        # Most recent batches/requests, for distributions
+        self.batch_sizes: Deque[int] = deque(maxlen=window)
+        self.batch_requests: Deque[int] = deque(maxlen=window)
+        self.encode_ms: Deque[float] = deque(maxlen=window)
+        self.request_latency_ms: Deque[float] = deque(maxlen=window)
+
+    def record_batch(self, batch: List[EncodeRequest], nb_sentences: int, started_at: float, ended_at: float):
+        self.batches += 1
+        self.requests += len(batch)
+        self.sentences += nb_sentences
+        self.batch_sizes.append(nb_sentences)
+        self.batch_requests.append(len(batch))
+        self.encode_ms.append((ended_at - started_at) * 1000)
+        for request in batch:
+            self.request_latency_ms.append((ended_at - request.enqueued_at) * 1000)
+
+
+class MicroBatcher:
+    """
+    Runs `encode` over the sentences of several concurrent requests at once.
+
+    Requests queue up and a single worker thread takes as many as fit in
+    `max_batch_size` sentences, encodes them in one call and hands each caller its
+    rows back. When the model has been idle for longer than `max_wait_ms` a lone
+    request is encoded straight away; while requests keep arriving, the worker waits
+    up to `max_wait_ms` after the oldest queued one for others to join its batch.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int = 128, max_wait_ms: float = 5.0):
+        self.encode_fn = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = BatchingStats()
+        self._queue: Deque[EncodeRequest] = deque()
+        self._queued_sentences = 0
+        self._cond = threading.Condition()
+        self._last_batch_end = 0.0
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def encode(self, sentences: List[str]) -> np.ndarray:
+        request = EncodeRequest(sentences)
+        with self._cond:
+            self._queue.append(request)
+            self._queued_sentences += len(sentences)
+            self._cond.notify()
+        return request.future.result()
+
+    def queue_depth(self) -> Dict[str, int]:
+        with self._cond:
+            return {"requests": len(self._queue), "sentences": self._queued_sentences}
+
+    def _take_batch(self) -> List[EncodeRequest]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            batch = [self._queue.popleft()]
+            size = len(batch[0].sentences)
+            idle = time.monotonic() - self._last_batch_end > self.max_wait
+            deadline = batch[0].enqueued_at + self.max_wait
+            while size < self.max_batch_size:
+                if self._queue:
+                    if size + len(self._queue[0].sentences) > self.max_batch_size:
+                        break
+                    request = self._queue.popleft()
+                    batch.append(request)
+                    size += len(request.sentences)
+                    continue
+                remaining = deadline - time.monotonic()
+                if idle or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._queued_sentences -= size
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            sentences = [s for request in batch for s in request.sentences]
+            started_at = time.monotonic()
+            try:
+                embeddings = self.encode_fn(sentences)
+            except BaseException as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                self._last_batch_end = time.monotonic()
+            offset = 0
+            for request in batch:
+                request.future.set_result(embeddings[offset:offset + len(request.sentences)])
+                offset += len(request.sentences)
+            self.stats.record_batch(batch, len(sentences), started_at, self._last_batch_end)
+
+    def stats_snapshot(self) -> dict:
+        stats = self.stats
+        batch_sizes = list(stats.batch_sizes)
+        encode_ms = list(stats.encode_ms)
+        latency_ms = list(stats.request_latency_ms)
+        return {
+            "queue_depth": self.queue_depth(),
+            "requests": stats.requests,
+            "batches": stats.batches,
+            "sentences": stats.sentences,
+            "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            "mean_requests_per_batch": (
+                sum(stats.batch_requests) / len(stats.batch_requests) if stats.batch_requests else 0.0),
+            "max_batch_size": max(batch_sizes, default=0),
+            "encode_ms": {"p50": percentile(encode_ms, 0.5), "p95": percentile(encode_ms, 0.95)},
+            "request_latency_ms": {"p50": percentile(latency_ms, 0.5), "p95": percentile(latency_ms, 0.95)},
+        }
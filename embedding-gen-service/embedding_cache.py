@@ -0,0 +1,177 @@
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+
+KEY_BYTES = 32
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class MemoryTier:
+    """
+    LRU of embedding rows keyed by cache key.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self._entries.move_to_end(key)
+        return embedding
+
+    def put(self, key: bytes, embedding: np.ndarray):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+
+class DiskTier:
+    """
+    Append-only on-disk tier: `vectors.f32` holds the embedding rows (little-endian
+    float32) and is read through a memory map; `keys.bin` holds the 32-byte cache key
+    of each row. Keys are appended after their rows, so a crash mid-write leaves at
+    most some unreferenced trailing rows, which are trimmed on the next open.
+    """
+    def __init__(self, directory: str, dimension: int):
+        os.makedirs(directory, exist_ok=True)
+        self.dimension = dimension
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.row_bytes = dimension * 4
+        self._rows: Dict[bytes, int] = {}
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                keys = f.read()
+        vector_rows = os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+        nb_rows = min(len(keys) // KEY_BYTES, vector_rows)
+        for row in range(nb_rows):
+            self._rows[keys[row * KEY_BYTES:(row + 1) * KEY_BYTES]] = row
+        for path, size in ((self.keys_path, nb_rows * KEY_BYTES), (self.vectors_path, nb_rows * self.row_bytes)):
+            with open(path, "ab") as f:
+                f.truncate(size)
+        self._nb_rows = nb_rows
+        self._map: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return self._nb_rows
+
+    def _vectors(self) -> np.ndarray:
+        if self._map is None or len(self._map) < self._nb_rows:
+            self._map = np.memmap(self.vectors_path, dtype="<f4", mode="r", shape=(self._nb_rows, self.dimension))
+        return self._map
+
+    def get_many(self, keys: List[bytes]) -> Dict[int, np.ndarray]:
+        """
+        :return: Embedding rows for the keys that are stored, by position in `keys`.
+        """
+        positions = [(i, self._rows[k]) for i, k in enumerate(keys) if k in self._rows]
+        if not positions:
+            return {}
+        rows = self._vectors()[[row for _, row in positions]]
+        return {i: rows[j] for j, (i, _) in enumerate(positions)}
+
+    def put_many(self, keys: List[bytes], embeddings: np.ndarray):
+        new = [i for i, k in enumerate(keys) if k not in self._rows]
+        if not new:
+            return
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(embeddings[new], dtype="<f4").tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(keys[i] for i in new))
+        for i in new:
+            self._rows[keys[i]] = self._nb_rows
+            self._nb_rows += 1
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache, keyed by model name and a hash of the
+    whitespace/unicode-normalized text, with an in-memory LRU in front of an optional
+    on-disk tier.
+    """
+    def __init__(self, model_name: str, dimension: int, capacity: int, disk_dir: Optional[str] = None):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.memory = MemoryTier(capacity)
+        self.disk = DiskTier(os.path.join(disk_dir, model_name), dimension) if disk_dir else None
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    def get_or_compute(self, sentences: List[str], compute: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Return embeddings for `sentences`, calling `compute` once with only the
+        (deduplicated) sentences that aren't cached.
+        """
+        keys = [cache_key(self.model_name, s) for s in sentences]
+        embeddings = np.empty((len(sentences), self.dimension), dtype=np.float32)
+        missing: List[int] = []
+        with self._lock:
+            self.lookups += len(keys)
+            for i, key in enumerate(keys):
+                cached = self.memory.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    embeddings[i] = cached
+            self.memory_hits += len(keys) - len(missing)
+            if missing and self.disk is not None:
+                on_disk = self.disk.get_many([keys[i] for i in missing])
+                for j, row in on_disk.items():
+                    i = missing[j]
+                    embeddings[i] = row
+                    self.memory.put(keys[i], embeddings[i].copy())
+                self.disk_hits += len(on_disk)
+                missing = [i for j, i in enumerate(missing) if j not in on_disk]
+        if not missing:
+            return embeddings
+
+        # Encode each distinct missing text once
+        first_by_key: Dict[bytes, int] = {}
+        for i in missing:
+            first_by_key.setdefault(keys[i], i)
+        to_compute = list(first_by_key.values())
+        computed = np.asarray(compute([sentences[i] for i in to_compute]), dtype=np.float32)
+        row_by_key = {keys[i]: row for row, i in enumerate(to_compute)}
+        for i in missing:
+            embeddings[i] = computed[row_by_key[keys[i]]]
+        with self._lock:
+            for row, i in enumerate(to_compute):
+                self.memory.put(keys[i], computed[row].copy())
+            if self.disk is not None:
+                self.disk.put_many([keys[i] for i in to_compute], computed)
+        return embeddings
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "model": self.model_name,
+                "lookups": self.lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.lookups - hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_capacity": self.memory.capacity,
+                "disk_entries": len(self.disk) if self.disk is not None else None,
+            }
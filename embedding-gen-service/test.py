@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from batcher import MicroBatcher
+from embedding_cache import EmbeddingCache, MemoryTier, cache_key
+
+
+def fake_encode(sentences: List[str]) -> np.ndarray:
+    # Row i is [len(sentence i), ...], so callers can check they got their own rows
+    return np.array([[len(s), 0.0] for s in sentences], dtype=np.float32)
+
+
+class RecordingEncoder:
+    """
+    fake_encode that records its batches, and can be held up until released.
+    """
+    def __init__(self):
+        self.batches: List[List[str]] = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def __call__(self, sentences: List[str]) -> np.ndarray:
+        self.batches.append(sentences)
+        self.started.set()
+        self.release.wait()
+        return fake_encode(sentences)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_queued_requests_flush_once_batch_is_full(self):
+        encoder = RecordingEncoder()
+        batcher = MicroBatcher(encoder, max_batch_size=4, max_wait_ms=2000)
+        encoder.release.clear()
+        with ThreadPoolExecutor(6) as pool:
+            first = pool.submit(batcher.encode, ["busy"])
+            encoder.started.wait()
+            queued = [pool.submit(batcher.encode, ["s" * (i + 1)]) for i in range(5)]
+            while batcher.queue_depth()["requests"] < 5:
+                time.sleep(0.001)
+            encoder.release.set()
+            # A full batch doesn't wait out max_wait_ms...
+            full_batch = [f.result(timeout=1) for f in queued[:4]]
+            # ...but the request left over does, for others to join it
+            leftover = queued[4].result(timeout=5)
+            first.result(timeout=5)
+        self.assertEqual([len(b) for b in encoder.batches], [1, 4, 1])
+        self.assertEqual([r.tolist() for r in full_batch + [leftover]], [[[i + 1, 0.0]] for i in range(5)])
+
+    def test_partial_batch_flushes_after_max_wait_when_busy(self):
+        encoder = RecordingEncoder()
+        batcher = MicroBatcher(encoder, max_batch_size=64, max_wait_ms=200)
+        batcher.encode(["warm up"])
+        # Right after a batch the model isn't idle, so a lone request waits for company
+        start = time.monotonic()
+        batcher.encode(["alone"])
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        # After max_wait_ms without requests it is, and one is encoded straight away
+        time.sleep(0.3)
+        start = time.monotonic()
+        batcher.encode(["alone again"])
+        self.assertLess(time.monotonic() - start, 0.15)
+        self.assertEqual(encoder.batches, [["warm up"], ["alone"], ["alone again"]])
+
+    def test_encode_error_reaches_every_request_in_batch(self):
+        def failing_encode(sentences: List[str]) -> np.ndarray:
+            raise RuntimeError("CUDA out of memory")
+
+        batcher = MicroBatcher(failing_encode, max_batch_size=8, max_wait_ms=50)
+        with ThreadPoolExecutor(3) as pool:
+            futures = [pool.submit(batcher.encode, [f"s{i}"]) for i in range(3)]
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result(timeout=5)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_memory_tier_evicts_least_recently_used(self):
+        tier = MemoryTier(capacity=2)
+        tier.put(b"a", np.zeros(2))
+        tier.put(b"b", np.zeros(2))
+        tier.get(b"a")
+        tier.put(b"c", np.zeros(2))
+        self.assertIsNone(tier.get(b"b"))
+        self.assertIsNotNone(tier.get(b"a"))
+        self.assertIsNotNone(tier.get(b"c"))
+        self.assertEqual(len(tier), 2)
+
+    def test_computes_each_missing_text_once(self):
+        cache = EmbeddingCache("model", dimension=2, capacity=10)
+        computed: List[List[str]] = []
+
+        def compute(sentences: List[str]) -> np.ndarray:
+            computed.append(sentences)
+            return fake_encode(sentences)
+
+        first = cache.get_or_compute(["heat", "heat ", "entropy"], compute)
+        second = cache.get_or_compute(["entropy", " heat", "work"], compute)
+        self.assertEqual(computed, [["heat", "entropy"], ["work"]])
+        self.assertEqual(first[:, 0].tolist(), [4, 4, 7])
+        self.assertEqual(second[:, 0].tolist(), [7, 4, 4])
+        self.assertEqual(cache.stats()["memory_hits"], 2)
+
+    def test_evicted_entries_come_back_from_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EmbeddingCache("model", dimension=2, capacity=1, disk_dir=directory)
+            cache.get_or_compute(["heat", "entropy"], fake_encode)
+
+            def fail(sentences: List[str]) -> np.ndarray:
+                raise AssertionError(f"recomputed {sentences}")
+
+            self.assertEqual(cache.get_or_compute(["heat"], fail)[:, 0].tolist(), [4])
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            # And after a restart
+            reopened = EmbeddingCache("model", dimension=2, capacity=1, disk_dir=directory)
+            self.assertEqual(reopened.get_or_compute(["entropy", "heat"], fail)[:, 0].tolist(), [7, 4])
+
+    def test_disk_tier_trims_rows_without_keys(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EmbeddingCache("model", dimension=2, capacity=1, disk_dir=directory)
+            cache.get_or_compute(["heat"], fake_encode)
+            # A crash between writing a row and its key
+            with open(os.path.join(directory, "model", "vectors.f32"), "ab") as f:
+                f.write(np.zeros(2, dtype="<f4").tobytes())
+            reopened = EmbeddingCache("model", dimension=2, capacity=1, disk_dir=directory)
+            self.assertEqual(len(reopened.disk), 1)
+            self.assertEqual(os.path.getsize(os.path.join(directory, "model", "vectors.f32")), 8)
+
+    def test_keys_depend_on_model(self):
+        self.assertNotEqual(cache_key("model-a", "heat"), cache_key("model-b", "heat"))
+        self.assertEqual(cache_key("model-a", "heat  flow"), cache_key("model-a", " heat flow"))
+
+
+if __name__ == "__main__":
+    unittest.main()
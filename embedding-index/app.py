@@ -1,71 +1,120 @@
+import asyncio
+import contextvars
+import fcntl
 import json
+import time
 import traceback
-from fastapi import FastAPI, HTTPException
-from models import AddEmbeddingsRequest, SearchRequest, SearchResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from models import AddEmbeddingsRequest, HybridSearchBatchRequest, HybridSearchBatchResponse, SearchBatchRequest, \
+    SearchBatchResponse, SearchFilter, SearchRequest, SearchResponse, SyncResponse
 import faiss
-from faiss_utils import FAISSIndex
-from typing import List, Optional, TypedDict
+from faiss_utils import DEFAULT_INDEX_CONFIG, INDEX_STRUCTURE_FIELDS, FAISSIndex, IndexConfig, TranscriptFilter
+from transcript_table import IndexedTranscript, TranscriptTable
+from seeding import embed_transcripts
+from sharding import owns, parse_shard_spec
+from snapshots import current_version, load_snapshot, write_snapshot
+from embedding_transport import BINARY_EMBEDDING_MEDIA_TYPES, decode_embeddings, fetch_embeddings
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypedDict
 import os
+import threading
 import numpy as np
 import sys
 sys.stdout.reconfigure(line_buffering=True)
 
 from transcript_service_client import TranscriptChunk, TranscriptDetailsRest
 import transcript_service_client 
-transcript_config = transcript_service_client.Configuration(host=os.getenv("TRANSCRIPT_SERVICE_URL"))
-transcript_api_client = transcript_service_client.ApiClient(configuration=transcript_config)
-transcript_api = transcript_service_client.DefaultApi(transcript_api_client)
+import service_http
+import tracing
+transcript_api = service_http.openapi_api(transcript_service_client, "TRANSCRIPT_SERVICE")
 
+# Binary transport dtype for seeding embeddings: float32, or float16 to halve the payload
+EMBEDDING_TRANSPORT_DTYPE = os.getenv("EMBEDDING_TRANSPORT_DTYPE", "float32")
 
-import embedding_gen_service_client 
-embedding_gen_client = embedding_gen_service_client.ApiClient(
-    configuration=embedding_gen_service_client.Configuration(host=os.getenv("EMBEDDING_GEN_SERVICE_URL")))
-embedding_gen_api = embedding_gen_service_client.DefaultApi(embedding_gen_client)
+# Index type (flat, ivf_flat, ivf_pq or hnsw) and its tuning. Changing a structural
+# setting (type, nlist, PQ m, HNSW M) rebuilds the index on the next startup
+INDEX_CONFIG: IndexConfig = {
+    "type": os.getenv("INDEX_TYPE", DEFAULT_INDEX_CONFIG["type"]),
+    "nlist": int(os.getenv("IVF_NLIST", DEFAULT_INDEX_CONFIG["nlist"])),
+    "pq_m": int(os.getenv("PQ_M", DEFAULT_INDEX_CONFIG["pq_m"])),
+    "hnsw_m": int(os.getenv("HNSW_M", DEFAULT_INDEX_CONFIG["hnsw_m"])),
+    "nprobe": int(os.getenv("IVF_NPROBE", DEFAULT_INDEX_CONFIG["nprobe"])),
+    "ef_search": int(os.getenv("HNSW_EF_SEARCH", DEFAULT_INDEX_CONFIG["ef_search"])),
+    "train_sample_size": int(os.getenv("INDEX_TRAIN_SAMPLE_SIZE", DEFAULT_INDEX_CONFIG["train_sample_size"])),
+}
 
 
 
 app = FastAPI(
     title="Index embedding service",
     description="Service for managing and querying embeddings using FAISS")
-
-
-faiss_index: FAISSIndex = FAISSIndex(dimension=768)
-index_ids_to_chunks_ids: List[str] = []
+tracing.instrument(app, "embedding-index", gauges=lambda: {
+    "embedding_index_vectors": faiss_index.index.ntotal,
+    "embedding_index_transcripts": faiss_index.transcript_count(),
+})
+
+
+# The index being served. It's never modified in place: syncs update a private copy,
+# snapshot it, and swap the new snapshot in with a single assignment, so each search
+# (which reads this once) sees one whole snapshot and needs no lock
+faiss_index: FAISSIndex = FAISSIndex(dimension=768, config=INDEX_CONFIG)
+# Held while swapping in a new snapshot, not while syncing
+sync_lock = threading.Lock()
+# FAISS releases the GIL while searching, so searches run on their own pool
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", str(os.cpu_count() or 4)))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
+# Seconds between checks for a snapshot written by another worker
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "5"))
+# Hybrid search: chunks taken from each of the BM25 and vector rankings, and the
+# reciprocal rank fusion constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+if os.getenv("FAISS_OMP_THREADS"):
+    # Cap FAISS's own per-search parallelism, e.g. when running several workers
+    faiss.omp_set_num_threads(int(os.environ["FAISS_OMP_THREADS"]))
 
 @app.on_event("startup")
 async def on_startup():
     global faiss_index
-    global index_ids_to_chunks_ids
     print("Initializing FAISS index...")
-    index_and_mapping  = initialize_index()
-    faiss_index, index_ids_to_chunks_ids  = index_and_mapping
-    # SNIPPET - checking for dupes
-    if len(index_ids_to_chunks_ids) != len(list(set(index_ids_to_chunks_ids))):
-        raise Exception("There are dupes in mapping!")
-    print("FAISS index ready.")
-
-
-INDEX_DIR = "index_dumps/"
-INDEX_FILE_PATH = os.path.join(INDEX_DIR, "index.faiss")
-INDEX_ID_MAP_FILE_PATH = os.path.join(INDEX_DIR, "index_id_map.json")
+    faiss_index = load_index()
+    print(f"FAISS index ready: serving {faiss_index.index.ntotal} vectors.")
+    # Syncing can take a while (embedding new transcripts), so serve the loaded index
+    # in the meantime; only one worker syncs, the others pick up its snapshot
+    threading.Thread(target=initial_sync, name="initial-sync", daemon=True).start()
+    threading.Thread(target=watch_snapshots, name="snapshot-watcher", daemon=True).start()
+
+
+# Serve one shard of the corpus, e.g. INDEX_SHARD=0/4 for the transcripts whose IDs
+# hash to the first of four shards; shard_router.py searches all of them
+INDEX_SHARD = parse_shard_spec(os.getenv("INDEX_SHARD"))
+# Each shard has its own index directory, numbered but not by shard count, so changing
+# the count rebalances by syncing: shards drop what they no longer own and seed what
+# they now do
+INDEX_DIR = "index_dumps/" if INDEX_SHARD is None else f"index_dumps/shard-{INDEX_SHARD['index']}/"
+# Index files from before versioned snapshots, migrated to a snapshot on startup
+LEGACY_INDEX_FILE_PATH = os.path.join(INDEX_DIR, "index.faiss")
+LEGACY_INDEX_MANIFEST_FILE_PATH = os.path.join(INDEX_DIR, "index_manifest.json")
+# Memory-map snapshots rather than reading them into RAM
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") == "1"
+# Hash every snapshot file against its manifest on load (sizes are always checked)
+INDEX_VERIFY_CHECKSUMS = os.getenv("INDEX_VERIFY_CHECKSUMS", "0") == "1"
+INDEX_SNAPSHOTS_KEPT = int(os.getenv("INDEX_SNAPSHOTS_KEPT", "2"))
+SYNC_LOCK_FILE = "sync.lock"
+SNAPSHOT_LOCK_FILE = "snapshot.lock"
+
+# Seeding pipeline: chunks per embedding request, transcripts fetched ahead, and
+# embedding requests kept in flight against the GPU box
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+TRANSCRIPT_PREFETCH = int(os.getenv("TRANSCRIPT_PREFETCH", "4"))
+EMBED_REQUESTS_IN_FLIGHT = int(os.getenv("EMBED_REQUESTS_IN_FLIGHT", "2"))
 
 
 print("**** we in embedding-index service!!!!!!!!!!!!")
-def save_faiss_index(index, file_path=INDEX_FILE_PATH):
-    """
-    Save the FAISS index to disk.
+def load_legacy_index(file_path=LEGACY_INDEX_FILE_PATH):
     """
-    if not os.path.exists(INDEX_DIR):
-        print("Making index dir")
-        os.makedirs(INDEX_DIR)
-    print(f"Saving FAISS index to {file_path}...")
-    faiss.write_index(index, file_path)
-    print("FAISS index saved successfully.")
-
-
-def load_faiss_index(file_path=INDEX_FILE_PATH):
-    """
-    Load the FAISS index from disk if it exists.
+    Load a FAISS index saved before versioned snapshots, if there is one.
     """
     if os.path.exists(file_path):
         print(f"Loading FAISS index from {file_path}...")
@@ -77,71 +126,239 @@ def load_faiss_index(file_path=INDEX_FILE_PATH):
         return None
 
 
-def load_index_id_map(file_path=INDEX_ID_MAP_FILE_PATH):
+class IndexManifest(TypedDict):
+    indexConfig: IndexConfig
+    table: TranscriptTable
+
+
+def load_legacy_index_manifest(file_path=LEGACY_INDEX_MANIFEST_FILE_PATH) -> Optional[IndexManifest]:
     """
-    Load the FAISS index from disk if it exists.
+    Load the index config and the table of indexed transcripts saved before
+    versioned snapshots, if they exist. The oldest manifests listed the transcripts
+    inline.
     """
     if os.path.exists(file_path):
-        print(f"Loading index map from {file_path}...")
+        print(f"Loading index manifest from {file_path}...")
         with open(file_path, "r") as f:
-            mapping = json.load(f)
-        print(f"FAISS index loaded successfully.")
-        return mapping
+            manifest = json.load(f)
+        transcripts: Optional[Dict[str, IndexedTranscript]] = manifest.get("transcripts")
+        table = TranscriptTable.from_transcripts(transcripts) if transcripts is not None \
+            else TranscriptTable.load(INDEX_DIR)
+        if table is None:
+            print(f"No transcript table found in {INDEX_DIR}. Starting fresh.")
+            return None
+        print(f"Index manifest loaded successfully. {len(table)} transcripts found.")
+        return {"indexConfig": manifest.get("indexConfig", DEFAULT_INDEX_CONFIG), "table": table}
     else:
-        print(f"No mapping found at {file_path}. Starting fresh.")
+        print(f"No index manifest found at {file_path}. Starting fresh.")
         return None
 
 
-def write_index_id_map(ids:List[str], file_path=INDEX_ID_MAP_FILE_PATH):
-    if not os.path.exists(INDEX_DIR):
-        print("Making index dir")
-        os.makedirs(INDEX_DIR)
-    print(f"Writing index map from {file_path}: {len(ids)} ids being written")
-    with open(file_path, "w") as f:
-        json.dump(ids, f)
+def structure_matches(config: IndexConfig) -> bool:
+    return all(config[f] == INDEX_CONFIG[f] for f in INDEX_STRUCTURE_FIELDS)
 
 
-def initialize_index():
+def load_current_snapshot() -> Optional[FAISSIndex]:
+    snapshot = load_snapshot(INDEX_DIR, mmap=INDEX_MMAP, verify_checksums=INDEX_VERIFY_CHECKSUMS)
+    if snapshot is None:
+        return None
+    if not structure_matches(snapshot["manifest"]["indexConfig"]):
+        print(f"Index snapshot {snapshot['manifest']['version']} has a different index structure, ignoring it.")
+        return None
+    return FAISSIndex(
+        dimension=snapshot["index"].d, index=snapshot["index"], table=snapshot["table"], config=INDEX_CONFIG,
+        mapped_from=snapshot["indexPath"] if INDEX_MMAP else None, snapshot_version=snapshot["manifest"]["version"],
+        lexical=snapshot["lexical"])
+
+
+def load_index() -> FAISSIndex:
     """
-    Initialize the FAISS index. Load from disk if it exists; otherwise, seed it.
+    Load the current snapshot (or a pre-snapshot dump) if there is one, or else an
+    empty index.
     """
-    # Step 1: Try to load the FAISS index
-    index = load_faiss_index()
-    index_id_mapping = load_index_id_map()
-    if index is not None and index_id_mapping is not None:
-        return index, index_id_mapping
+    if current_version(INDEX_DIR) is not None:
+        faiss_index = load_current_snapshot()
+        if faiss_index is not None:
+            return faiss_index
+    else:
+        index = load_legacy_index()
+        manifest = load_legacy_index_manifest()
+        if index is not None and manifest is not None and structure_matches(manifest["indexConfig"]):
+            return FAISSIndex(dimension=index.d, index=index, table=manifest["table"], config=INDEX_CONFIG)
+    # Nothing saved, a dump from before the manifest existed (positional IDs that
+    # can't be updated incrementally), or a different index type - build it up from nothing
+    return FAISSIndex(dimension=768, config=INDEX_CONFIG)
 
-    # Step 2: If no index exists, seed the index
-    print("Seeding FAISS index...")
 
-    all_ids = []
-    index = faiss.IndexFlatL2(768)  # Replace with the appropriate FAISS index type and dimension
-    # Fetch all script metadata
-    scripts = transcript_api.list_scripts_scripts_get()
-    print("***scripts returned be:", scripts)
-    for script_meta in scripts:
-        script_id = script_meta.id
-        print(f"Fetching details for script ID: {script_id}")
+def serve_index(index: FAISSIndex):
+    global faiss_index
+    faiss_index = index
+    print(f"Serving index snapshot {index.snapshot_version}: {index.index.ntotal} vectors.")
+
+
+def initial_sync():
+    try:
+        # An index that isn't from a snapshot (empty, migrated or rebuilt) gets one
+        # even if the sync finds nothing to change
+        sync_index(wait=False, snapshot_if_unchanged=faiss_index.snapshot_version is None)
+    except Exception:
+        traceback.print_exc()
+
+
+def watch_snapshots():
+    """
+    Swap in snapshots written by other workers' syncs.
+    """
+    while True:
+        time.sleep(INDEX_RELOAD_INTERVAL)
+        try:
+            version = current_version(INDEX_DIR)
+            if version is not None and version != faiss_index.snapshot_version:
+                with sync_lock:
+                    if current_version(INDEX_DIR) != faiss_index.snapshot_version:
+                        index = load_current_snapshot()
+                        if index is not None:
+                            serve_index(index)
+        except Exception:
+            traceback.print_exc()
+
+
+@contextmanager
+def index_dir_lock(file_name: str, wait: bool = True) -> Iterator[bool]:
+    """
+    Hold one of the index directory's locks across worker processes: SYNC_LOCK_FILE
+    while syncing, so that startup syncs don't all embed the same transcripts, and
+    SNAPSHOT_LOCK_FILE while writing a snapshot.
+    :return: Whether the lock was acquired (always, if `wait`).
+    """
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    with open(os.path.join(INDEX_DIR, file_name), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-        # Fetch full transcript details
-        script = transcript_api.fetch_script_by_id_scripts_id_get(script_id)
 
-        chunk_texts = [c.text for c in script.chunks]
-        print(f"Found {len(chunk_texts)} chunks in script ID: {script_id}")
+def embed_chunk_texts(chunk_texts: List[str]) -> np.ndarray:
+    return fetch_embeddings(chunk_texts, dtype=EMBEDDING_TRANSPORT_DTYPE)
 
-        # embeddings = generate_embeddings(chunk_texts)
-        print("about to hit embedding api!!!")
-        embeddings = embedding_gen_api\
-            .generate_embeddings_generate_embeddings_post({"sentences":chunk_texts}).embeddings
-        # print("got emebddings!:", embeddings)
-        ids: List[str] = [f"{script_id}-{i}" for i in range(len(chunk_texts))]
-        index.add(np.array(embeddings, dtype=np.float32))
-        all_ids = all_ids + ids
 
-    # Step 3: Save the newly created index
-    save_faiss_index(index)
-    write_index_id_map(all_ids)
-    return index, all_ids
+def backfill_lexical(index: FAISSIndex, transcript_ids: List[str]) -> int:
+    """
+    Add already-embedded transcripts' chunk texts to the index's BM25 index.
+    :return: How many were added; a transcript whose chunks have changed since it
+        was embedded is left for the next sync to re-embed.
+    """
+    added = 0
+    with ThreadPoolExecutor(TRANSCRIPT_PREFETCH, thread_name_prefix="lexical-fetch") as pool:
+        for script in pool.map(transcript_api.fetch_script_by_id_scripts_id_get, transcript_ids):
+            if script.chunks_version == index.transcripts[script.id]["chunksVersion"]:
+                index.add_lexical(script.id, [c.text for c in script.chunks])
+                added += 1
+    return added
+
+
+def newest_index() -> FAISSIndex:
+    """
+    The index served, or the newest snapshot if another worker has just written one.
+    """
+    if current_version(INDEX_DIR) not in (None, faiss_index.snapshot_version):
+        return load_current_snapshot() or faiss_index
+    return faiss_index
+
+
+def build_synced_index(base: FAISSIndex, snapshot_if_unchanged: bool) -> Tuple[Optional[FAISSIndex], SyncResponse]:
+    """
+    Diff the transcript service's transcripts (IDs and chunks versions; just the
+    shard's own if this is a shard) against `base`, and build a private copy of it
+    with new or changed transcripts embedded and added and deleted ones dropped.
+    :return: The copy, or None if nothing changed.
+    """
+    scripts = transcript_api.list_scripts_scripts_get()
+    listed = {s.id: s.chunks_version for s in scripts if owns(INDEX_SHARD, s.id)}
+    listed_tags = {s.id: s.tags for s in scripts if s.id in listed}
+    removed = [tid for tid in base.transcripts if tid not in listed]
+    added = [tid for tid in listed if tid not in base.transcripts]
+    updated = [tid for tid, version in listed.items()
+               if tid in base.transcripts and base.transcripts[tid]["chunksVersion"] != version]
+    # Tags are only metadata: changing them doesn't need re-embedding
+    retagged = [tid for tid, version in listed.items()
+                if tid in base.transcripts and base.transcripts[tid]["chunksVersion"] == version
+                and base.transcripts[tid]["tags"] != listed_tags[tid]]
+    # Transcripts indexed before the BM25 index existed only need their texts
+    # fetched, not re-embedding
+    stale = set(removed) | set(updated)
+    missing_lexical = [tid for tid in base.transcripts_missing_lexical() if tid not in stale]
+    print(f"Syncing FAISS index: {len(added)} new, {len(updated)} changed, {len(removed)} deleted, "
+          f"{len(retagged)} retagged transcripts, {len(missing_lexical)} to add to the BM25 index")
+    if not (added or updated or removed or retagged or missing_lexical or snapshot_if_unchanged):
+        return None, SyncResponse(added=0, updated=0, removed=0, vector_count=base.index.ntotal)
+
+    index = base.writable_copy()
+    # Changed transcripts are dropped up front too, so the index is only rebuilt
+    # once for index types that can't delete in place
+    index.remove_transcripts(removed + updated)
+    for tid in retagged:
+        index.set_tags(tid, listed_tags[tid])
+
+    def add_embedded_transcript(
+            script_id: str, chunks_version: str, embeddings: np.ndarray, chunk_texts: List[str]):
+        # Vectors are keyed by chunk position, matching the transcript service's
+        # "{script_id}-{i}" chunk IDs
+        index.add_transcript(script_id, chunks_version, embeddings, chunk_texts, listed_tags[script_id])
+
+    embed_transcripts(
+        added + updated,
+        fetch_script=transcript_api.fetch_script_by_id_scripts_id_get,
+        embed_texts=embed_chunk_texts,
+        on_transcript_embedded=add_embedded_transcript,
+        dimension=index.dimension,
+        batch_size=EMBED_BATCH_SIZE,
+        prefetch=TRANSCRIPT_PREFETCH,
+        requests_in_flight=EMBED_REQUESTS_IN_FLIGHT)
+
+    lexical_backfilled = backfill_lexical(index, missing_lexical)
+    index.train_pending()
+    index.lexical.commit()
+    return index, SyncResponse(
+        added=len(added), updated=len(updated), removed=len(removed), lexical_backfilled=lexical_backfilled,
+        retagged=len(retagged), vector_count=index.index.ntotal)
+
+
+def sync_index(wait: bool = True, snapshot_if_unchanged: bool = False) -> Optional[SyncResponse]:
+    """
+    Bring the index in line with the transcript service, and snapshot and serve the
+    result if anything changed. Fetching and embedding happen without any lock held;
+    only writing and swapping in the snapshot is serialized, and if another worker
+    wrote one in the meantime the sync is redone on top of it (embedding just what
+    that one didn't).
+    :param wait: Sync even if another worker is already syncing, rather than
+        skipping this one (returning None).
+    """
+    with index_dir_lock(SYNC_LOCK_FILE, wait=False) as syncing:
+        if not (syncing or wait):
+            print("Another worker is syncing the index, skipping.")
+            return None
+        base = newest_index()
+        index, response = build_synced_index(base, snapshot_if_unchanged)
+        with sync_lock, index_dir_lock(SNAPSHOT_LOCK_FILE):
+            if current_version(INDEX_DIR) != base.snapshot_version:
+                base = newest_index()
+                index, response = build_synced_index(base, snapshot_if_unchanged and base.snapshot_version is None)
+            if index is None:
+                if base is not faiss_index:
+                    serve_index(base)
+                return response
+            write_snapshot(INDEX_DIR, index, keep=INDEX_SNAPSHOTS_KEPT)
+            # Serve the snapshot memory-mapped like the other workers do, rather than
+            # this private copy
+            serve_index(load_current_snapshot() or index)
+            return response
 
 
 @app.get("/ping", response_model=str)
@@ -149,20 +366,32 @@ def ping_pong():
     return "pong"
 
 
+async def run_search(fn: Callable[..., Any], *args) -> Any:
+    """
+    Run a search on the search pool, in the request's trace.
+    """
+    queued_at = time.perf_counter()
+
+    def run() -> Any:
+        tracing.record("search_queue", time.perf_counter() - queued_at)
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(search_executor, contextvars.copy_context().run, run)
+
+
+def transcript_filter(search_filter: Optional[SearchFilter]) -> Optional[TranscriptFilter]:
+    return TranscriptFilter(**search_filter.dict()) if search_filter is not None else None
+
+
 @app.post("/search", response_model=SearchResponse)
-def search_embeddings(request: SearchRequest):
+async def search_embeddings(request: SearchRequest):
     """
     Search for nearest neighbors using a query embedding.
     """
     try:
-        query_embedding = np.array(request.query_embedding, dtype=np.float32).reshape(1, -1)
-        # TODO: this typing ignore
-        results: Tuple[List[float], List[int]] = faiss_index.search(query_embedding, request.top_k)  # type: ignore
-        distances, ids = results
-        # print("ids of neighbors from faiss index: %s" % (ids))
-        return {"results": [
-            {"id": index_ids_to_chunks_ids[id], "distance":d}
-            for id, d in zip(ids.flatten().tolist(), distances.flatten().tolist())]}
+        results = await run_search(
+            faiss_index.search, request.query_embedding, request.top_k, request.nprobe, request.ef_search,
+            transcript_filter(request.filter))
+        return {"results": results}
     # SNIPPET
     except Exception as e:
         print("um hola???: %s" % (e))
@@ -170,26 +399,164 @@ def search_embeddings(request: SearchRequest):
         raise HTTPException(status_code=500, detail=f"Error searching embeddings: {str(e)}")
 
 
+def search_batch(
+        query_embeddings: np.ndarray,
+        top_k: List[int],
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        search_filter: Optional[TranscriptFilter] = None) -> dict:
+    if any(k < 1 for k in top_k):
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    if len(query_embeddings) == 0:
+        return {"results": []}
+    try:
+        with tracing.span("search"):
+            results = faiss_index.search_batch(
+                query_embeddings, top_k, nprobe=nprobe, ef_search=ef_search, transcript_filter=search_filter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error searching embeddings: {str(e)}")
+    return {"results": results}
+
+
+@app.post("/search:batch", response_model=SearchBatchResponse)
+async def search_embeddings_batch(request: SearchBatchRequest):
+    """
+    Search for the nearest neighbors of several query embeddings in one FAISS call.
+    """
+    top_k = request.top_k if isinstance(request.top_k, list) else [request.top_k]
+    if not request.query_embeddings:
+        return {"results": []}
+    try:
+        query_embeddings = np.array(request.query_embeddings, dtype=np.float32).reshape(
+            len(request.query_embeddings), -1)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Bad query embeddings: {str(e)}")
+    return await run_search(
+        search_batch, query_embeddings, top_k, request.nprobe, request.ef_search, transcript_filter(request.filter))
+
+
+@app.post(
+    "/search:batch-binary",
+    response_model=SearchBatchResponse,
+    openapi_extra={"requestBody": {"content": {t: {} for t in BINARY_EMBEDDING_MEDIA_TYPES.values()}}})
+async def search_embeddings_batch_binary(
+        request: Request,
+        x_embedding_shape: str = Header(...),
+        top_k: List[int] = Query([5]),
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        transcript_id: Optional[List[str]] = Query(None),
+        tag: Optional[List[str]] = Query(None),
+        exclude_transcript_id: Optional[List[str]] = Query(None),
+        exclude_tag: Optional[List[str]] = Query(None)):
+    """
+    Like /search:batch, but the queries are sent as a raw little-endian float32 (or
+    float16) matrix, with its shape in X-Embedding-Shape - the same format
+    /generate-embeddings returns. The filter's fields are repeatable query
+    parameters, e.g. ?tag=physics&exclude_transcript_id=abc.
+    """
+    media_type = request.headers.get("Content-Type", "").split(";")[0]
+    dtype = next((d for d, t in BINARY_EMBEDDING_MEDIA_TYPES.items() if t == media_type), None)
+    if dtype is None:
+        raise HTTPException(status_code=415, detail=f"Expected one of {', '.join(BINARY_EMBEDDING_MEDIA_TYPES.values())}")
+    try:
+        query_embeddings = decode_embeddings(await request.body(), x_embedding_shape, dtype)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Bad embeddings matrix: {str(e)}")
+    search_filter = None
+    if transcript_id is not None or tag is not None or exclude_transcript_id is not None or exclude_tag is not None:
+        search_filter = TranscriptFilter(
+            transcript_ids=transcript_id, tags=tag, exclude_transcript_ids=exclude_transcript_id,
+            exclude_tags=exclude_tag)
+    return await run_search(search_batch, query_embeddings, top_k, nprobe, ef_search, search_filter)
+
+
+def search_hybrid_batch(request: HybridSearchBatchRequest) -> dict:
+    top_k = request.top_k if isinstance(request.top_k, list) else [request.top_k]
+    query_embeddings = None
+    if request.mode == "hybrid" and request.query_embeddings is None and request.queries:
+        # Not the caller's fault if this fails, so not a 400
+        try:
+            with tracing.span("embed"):
+                query_embeddings = fetch_embeddings(request.queries)
+            if len(query_embeddings) != len(request.queries):
+                raise ValueError(f"Got {len(query_embeddings)} embeddings for {len(request.queries)} queries")
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(status_code=502, detail=f"Error embedding queries: {str(e)}")
+    try:
+        if request.mode == "hybrid" and request.query_embeddings is not None:
+            query_embeddings = np.array(request.query_embeddings, dtype=np.float32).reshape(len(request.queries), -1)
+        index = faiss_index
+        with tracing.span("search"):
+            results = index.search_hybrid_batch(
+                request.queries, query_embeddings, top_k, candidates=HYBRID_CANDIDATES, rrf_k=RRF_K,
+                nprobe=request.nprobe, ef_search=request.ef_search, transcript_filter=transcript_filter(request.filter))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error searching: {str(e)}")
+    return {"results": results}
+
+
+@app.post("/search:hybrid", response_model=HybridSearchBatchResponse)
+async def search_hybrid(request: HybridSearchBatchRequest):
+    """
+    Search by query text: BM25 over the chunks' words (which catches exact names and
+    terms) fused with vector search over their embeddings by reciprocal rank
+    fusion, or BM25 alone with mode "lexical". The queries are embedded here, so
+    this is the only request a caller needs.
+    """
+    return await run_search(search_hybrid_batch, request)
+
+
+@app.post("/sync", response_model=SyncResponse)
+def sync_embeddings():
+    """
+    Bring the index in line with the transcript service without restarting: embeds
+    new and changed transcripts and removes deleted ones.
+    """
+    try:
+        return sync_index()
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error syncing index: {str(e)}")
+
+
 @app.get("/index-info", response_model=dict)
 def index_info():
     """
     Returns information about the current state of the FAISS index.
     """
     try:
+        index = faiss_index
         # Get the number of vectors in the index
-        vector_count = faiss_index.index.ntotal
+        vector_count = index.index.ntotal
+        transcript_count = index.transcript_count()
 
         # Check if the index is trained
-        is_trained = faiss_index.index.is_trained
+        is_trained = index.index.is_trained
 
         # Get the dimensionality of the vectors
-        dimension = faiss_index.dimension
+        dimension = index.dimension
 
         # Return index information
         return {
             "status": "healthy",
             "index_trained": is_trained,
             "vector_count": vector_count,
+            "transcript_count": transcript_count,
+            "lexical_document_count": len(index.lexical),
+            "lexical_term_count": len(index.lexical.terms),
+            "index_config": index.config,
+            "snapshot_version": index.snapshot_version,
+            "memory_mapped": index.mapped_from is not None,
+            "worker_pid": os.getpid(),
+            "shard": INDEX_SHARD,
             "dimension": dimension
         }
     except Exception as e:
@@ -0,0 +1,374 @@
+"""
+Benchmarks for the embedding index, run against synthetic clustered embeddings:
+
+    python bench.py [ann] [batch-search] [startup] [lexical] [shards] [filter] [--vectors N] [--queries N] [--top-k K]
+
+`ann` builds each index configuration, then reports build time, recall@k against
+the flat index as ground truth, and single-query latency, for a range of nprobe /
+efSearch values.
+
+`batch-search` compares queries/sec of one search_batch call per batch against one
+search call per query, for batch sizes 1 to 256.
+
+`startup` saves a flat index in the old layout (IndexIDMap2 plus a JSON list of
+"{script_id}-{i}" chunk ID strings, checked for duplicates with a set) and as a
+snapshot (IndexIDMap plus the transcript table), then loads each in a fresh process -
+the snapshot both read into RAM and memory-mapped - and reports load time, RSS and
+private (non-shared) memory.
+
+`lexical` builds the BM25 index over synthetic chunk texts (Zipf-distributed words,
+added as transcripts of 100 chunks and committed once, like a sync) and reports
+the time to add and to commit them, size on disk and query latency percentiles.
+
+`shards` splits a flat index over 1, 2, 4 and 8 worker processes by transcript ID
+hash, as INDEX_SHARD does, and reports single-query latency (scatter to every
+shard, gather, heap-merge) and batched throughput, checking that the merged top k
+matches the unsharded index. Each worker searches with one thread, so the speedup
+is bounded by the number of cores.
+
+`filter` restricts searches of a flat index to 1%, 10% and 50% of its transcripts,
+picked as one run of consecutive ones (a range selector) and scattered (a set of
+IDs), and reports batched query latency against an unfiltered search.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+import faiss
+import numpy as np
+
+from faiss_utils import DEFAULT_INDEX_CONFIG, FAISSIndex, IndexConfig, make_vector_ids, search_parameters
+from lexical_index import BM25Index
+from sharding import merge_nearest, owns
+from snapshots import load_snapshot, write_snapshot
+
+
+DIMENSION = 768
+
+
+def synthetic_embeddings(nb_vectors: int, nb_clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Gaussian clusters, roughly how sentence embeddings of a topical corpus look.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((nb_clusters, DIMENSION)).astype(np.float32)
+    assignments = rng.integers(nb_clusters, size=nb_vectors)
+    return centers[assignments] + 0.6 * rng.standard_normal((nb_vectors, DIMENSION)).astype(np.float32)
+
+
+def build_index(config: IndexConfig, embeddings: np.ndarray) -> Tuple[FAISSIndex, float]:
+    start = time.perf_counter()
+    index = FAISSIndex(DIMENSION, config=config)
+    # One synthetic "transcript" per 500 vectors, as the service would add them
+    for i, offset in enumerate(range(0, len(embeddings), 500)):
+        index.add_transcript(f"t{i}", "v1", embeddings[offset:offset + 500])
+    index.train_pending()
+    return index, time.perf_counter() - start
+
+
+def run_queries(
+        index: FAISSIndex,
+        queries: np.ndarray,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    params = search_parameters(index.config, nprobe=nprobe, ef_search=ef_search)
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        _, ids = index.index.search(query.reshape(1, -1), top_k, params=params)
+        results.append(ids[0])
+    return np.stack(results), (time.perf_counter() - start) / len(queries)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(np.intersect1d(f, t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def bench_ann(nb_vectors: int, nb_queries: int, top_k: int) -> List[Dict]:
+    embeddings = synthetic_embeddings(nb_vectors)
+    queries = synthetic_embeddings(nb_queries, seed=1)
+    nlist = max(16, int(4 * np.sqrt(nb_vectors)))
+    configs: List[Tuple[IndexConfig, str, List[int]]] = [
+        ({**DEFAULT_INDEX_CONFIG, "type": "flat"}, "", [0]),
+        ({**DEFAULT_INDEX_CONFIG, "type": "ivf_flat", "nlist": nlist}, "nprobe", [1, 4, 16, 64]),
+        ({**DEFAULT_INDEX_CONFIG, "type": "ivf_pq", "nlist": nlist}, "nprobe", [1, 4, 16, 64]),
+        ({**DEFAULT_INDEX_CONFIG, "type": "hnsw"}, "ef_search", [16, 64, 256]),
+    ]
+    print(f"{nb_vectors} vectors, {nb_queries} queries, recall@{top_k} vs flat (ivf nlist={nlist})")
+    print(f"{'index':<10} {'param':<14} {'build s':>8} {'recall':>7} {'ms/query':>9}")
+    truth: Optional[np.ndarray] = None
+    rows = []
+    for config, param, values in configs:
+        index, build_seconds = build_index(config, embeddings)
+        for value in values:
+            kwargs = {param: value} if param else {}
+            found, seconds_per_query = run_queries(index, queries, top_k, **kwargs)
+            if truth is None:
+                truth = found
+            row = {
+                "index": config["type"],
+                "param": f"{param}={value}" if param else "-",
+                "build_seconds": build_seconds,
+                "recall": recall(found, truth),
+                "ms_per_query": seconds_per_query * 1000,
+            }
+            rows.append(row)
+            print("%(index)-10s %(param)-14s %(build_seconds)8.2f %(recall)7.3f %(ms_per_query)9.3f" % row)
+    return rows
+
+
+def bench_batch_search(nb_vectors: int, top_k: int) -> List[Dict]:
+    index, _ = build_index({**DEFAULT_INDEX_CONFIG, "type": "flat"}, synthetic_embeddings(nb_vectors))
+    queries = synthetic_embeddings(256, seed=1)
+    print(f"{nb_vectors} vectors (flat), top_k={top_k}")
+    print(f"{'batch':>6} {'batched q/s':>12} {'one-by-one q/s':>15} {'speedup':>8}")
+    rows = []
+    for batch_size in (1, 2, 4, 8, 16, 32, 64, 128, 256):
+        batch = queries[:batch_size]
+        nb_rounds = max(1, 256 // batch_size)
+        start = time.perf_counter()
+        for _ in range(nb_rounds):
+            index.search_batch(batch, [top_k])
+        batched_qps = nb_rounds * batch_size / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(nb_rounds):
+            for query in batch:
+                index.search(query, top_k)
+        single_qps = nb_rounds * batch_size / (time.perf_counter() - start)
+        row = {"batch_size": batch_size, "batched_qps": batched_qps, "single_qps": single_qps,
+               "speedup": batched_qps / single_qps}
+        rows.append(row)
+        print("%(batch_size)6d %(batched_qps)12.1f %(single_qps)15.1f %(speedup)7.1fx" % row)
+    return rows
+
+
+def synthetic_chunk_texts(nb_chunks: int, vocabulary_size: int = 50_000, seed: int = 0) -> Tuple[List[str], np.ndarray]:
+    """
+    Chunks of 40-120 words drawn from a Zipf distribution, like natural language.
+    :return: The texts and the word frequencies.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(vocabulary_size)])
+    frequencies = 1 / np.arange(1, vocabulary_size + 1)
+    frequencies /= frequencies.sum()
+    lengths = rng.integers(40, 120, size=nb_chunks)
+    words = vocabulary[rng.choice(vocabulary_size, size=int(lengths.sum()), p=frequencies)]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(words[offsets[i]:offsets[i + 1]]) for i in range(nb_chunks)], frequencies
+
+
+def bench_lexical(nb_chunks: int, nb_queries: int, top_k: int) -> Dict:
+    texts, frequencies = synthetic_chunk_texts(nb_chunks)
+    lexical = BM25Index()
+    start = time.perf_counter()
+    for slot, offset in enumerate(range(0, nb_chunks, 100)):
+        lexical.add(make_vector_ids(slot, len(texts[offset:offset + 100])), texts[offset:offset + 100])
+    add_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    lexical.commit()
+    commit_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        lexical.save(directory)
+        size_mb = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)) / 1e6
+        lexical = BM25Index.load(directory)
+        # Queries of 2-5 words, mostly mid-frequency terms like names would be
+        rng = np.random.default_rng(1)
+        queries = [" ".join(f"w{w}" for w in rng.integers(20, 5000, size=rng.integers(2, 6)))
+                   for _ in range(nb_queries)]
+        lexical.search(queries[0], top_k)  # Builds the term dict
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            lexical.search(query, top_k)
+            latencies.append(time.perf_counter() - start)
+    row = {
+        "chunks": nb_chunks, "terms": len(lexical.terms), "add_seconds": add_seconds,
+        "commit_seconds": commit_seconds, "size_mb": size_mb,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000, "p99_ms": float(np.percentile(latencies, 99)) * 1000}
+    print(f"{'chunks':>8} {'terms':>7} {'add s':>7} {'commit s':>9} {'MB':>7} {'p50 ms':>7} {'p99 ms':>7}")
+    print("%(chunks)8d %(terms)7d %(add_seconds)7.2f %(commit_seconds)9.2f %(size_mb)7.1f %(p50_ms)7.3f %(p99_ms)7.3f"
+          % row)
+    return row
+
+
+def save_layouts(directory: str, nb_vectors: int, chunks_per_transcript: int = 100):
+    index, _ = build_index({**DEFAULT_INDEX_CONFIG, "type": "flat"}, np.zeros((0, DIMENSION), dtype=np.float32))
+    embeddings = synthetic_embeddings(nb_vectors)
+    for i, offset in enumerate(range(0, nb_vectors, chunks_per_transcript)):
+        index.add_transcript(f"transcript{i:08d}", f"{i:064x}", embeddings[offset:offset + chunks_per_transcript])
+    write_snapshot(os.path.join(directory, "snapshot"), index)
+
+    old_index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIMENSION))
+    old_index.add_with_ids(embeddings, np.arange(nb_vectors, dtype=np.int64))
+    os.makedirs(os.path.join(directory, "old"))
+    faiss.write_index(old_index, os.path.join(directory, "old", "index.faiss"))
+    chunk_ids = [f"transcript{i // chunks_per_transcript:08d}-{i % chunks_per_transcript}" for i in range(nb_vectors)]
+    with open(os.path.join(directory, "old", "index_id_map.json"), "w") as f:
+        json.dump(chunk_ids, f)
+
+
+def rss_mb(field: str = "VmRSS") -> float:
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(f"{field}:")) / 1024
+
+
+def load_layout(directory: str, layout: str):
+    """
+    Runs in its own process: load one saved layout, print load seconds and RSS.
+    """
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if layout == "old":
+        index = faiss.read_index(os.path.join(directory, layout, "index.faiss"))
+        with open(os.path.join(directory, layout, "index_id_map.json"), "r") as f:
+            chunk_ids = json.load(f)
+        assert len(set(chunk_ids)) == len(chunk_ids)
+    else:
+        snapshot = load_snapshot(os.path.join(directory, "snapshot"), mmap=layout == "snapshot-mmap")
+        assert snapshot is not None
+        index = FAISSIndex(snapshot["index"].d, index=snapshot["index"], table=snapshot["table"])
+        index.search(np.zeros(index.dimension, dtype=np.float32), 1)
+    seconds = time.perf_counter() - start
+    rss = rss_mb()
+    # Private memory; a memory-mapped snapshot's pages are page cache shared between processes
+    anon = rss_mb("RssAnon")
+    print(json.dumps({"seconds": seconds, "rss_mb": rss, "load_rss_mb": rss - rss_before, "anon_mb": anon}))
+
+
+def bench_startup(nb_vectors: int) -> List[Dict]:
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        save_layouts(directory, nb_vectors)
+        print(f"{nb_vectors} vectors, 100 chunks per transcript")
+        print(f"{'layout':<14} {'load s':>8} {'RSS MB':>12} {'load RSS MB':>12} {'private MB':>11}")
+        for layout in ("old", "snapshot", "snapshot-mmap"):
+            output = subprocess.run(
+                [sys.executable, __file__, "_load", "--layout-dir", directory, "--layout", layout],
+                check=True, capture_output=True, text=True).stdout
+            row = {"layout": layout, **json.loads(output.strip().splitlines()[-1])}
+            rows.append(row)
+            print("%(layout)-14s %(seconds)8.2f %(rss_mb)12.1f %(load_rss_mb)12.1f %(anon_mb)11.1f" % row)
+    return rows
+
+
+def bench_filter(nb_vectors: int, nb_queries: int, top_k: int) -> List[Dict]:
+    index, _ = build_index({**DEFAULT_INDEX_CONFIG, "type": "flat"}, synthetic_embeddings(nb_vectors))
+    queries = synthetic_embeddings(nb_queries, seed=1)
+    transcript_ids = list(index.transcripts)
+    print(f"{nb_vectors} vectors (flat), {len(transcript_ids)} transcripts, top_k={top_k}")
+    print(f"{'filter':<10} {'fraction':>8} {'ms/query':>9}")
+    rows = []
+    cases = [("none", 1.0, None)]
+    for fraction in (0.01, 0.1, 0.5):
+        nb_selected = max(1, int(fraction * len(transcript_ids)))
+        cases.append(("range", fraction, {"transcript_ids": transcript_ids[:nb_selected]}))
+        cases.append(("scattered", fraction, {"transcript_ids": transcript_ids[::len(transcript_ids) // nb_selected]}))
+    for name, fraction, transcript_filter in cases:
+        start = time.perf_counter()
+        results = index.search_batch(queries, [top_k], transcript_filter=transcript_filter)
+        row = {"filter": name, "fraction": fraction, "ms_per_query": 1000 * (time.perf_counter() - start) / nb_queries}
+        if transcript_filter is not None:
+            allowed = set(transcript_filter["transcript_ids"])
+            assert all(r["id"].rsplit("-", 1)[0] in allowed for query_results in results for r in query_results)
+        rows.append(row)
+        print("%(filter)-10s %(fraction)8.2f %(ms_per_query)9.3f" % row)
+    return rows
+
+
+def shard_worker(shard_index: int, nb_shards: int, nb_vectors: int, connection):
+    faiss.omp_set_num_threads(1)
+    embeddings = synthetic_embeddings(nb_vectors)
+    index = FAISSIndex(DIMENSION, config={**DEFAULT_INDEX_CONFIG, "type": "flat"})
+    shard = {"index": shard_index, "count": nb_shards}
+    for i, offset in enumerate(range(0, len(embeddings), 500)):
+        if owns(shard, f"t{i}"):
+            index.add_transcript(f"t{i}", "v1", embeddings[offset:offset + 500])
+    connection.send(index.index.ntotal)
+    while True:
+        request = connection.recv()
+        if request is None:
+            return
+        queries, top_k = request
+        connection.send(index.search_batch(queries, [top_k]))
+
+
+def bench_shards(nb_vectors: int, nb_queries: int, top_k: int) -> List[Dict]:
+    queries = synthetic_embeddings(max(nb_queries, 256), seed=1)
+    faiss.omp_set_num_threads(1)
+    reference, _ = build_index({**DEFAULT_INDEX_CONFIG, "type": "flat"}, synthetic_embeddings(nb_vectors))
+    expected = reference.search_batch(queries[:nb_queries], [top_k])
+    print(f"{nb_vectors} vectors (flat), top_k={top_k}, {os.cpu_count()} CPUs")
+    print(f"{'shards':>6} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} {'same top k':>11}")
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for nb_shards in (1, 2, 4, 8):
+        connections, workers = [], []
+        for shard_index in range(nb_shards):
+            parent_end, worker_end = context.Pipe()
+            worker = context.Process(target=shard_worker, args=(shard_index, nb_shards, nb_vectors, worker_end))
+            worker.start()
+            connections.append(parent_end)
+            workers.append(worker)
+        for connection in connections:
+            connection.recv()
+
+        def scatter_gather(batch: np.ndarray) -> List[List[dict]]:
+            for connection in connections:
+                connection.send((batch, top_k))
+            shard_batches = [connection.recv() for connection in connections]
+            return [merge_nearest([b[i] for b in shard_batches], top_k) for i in range(len(batch))]
+
+        latencies, merged = [], []
+        for query in queries[:nb_queries]:
+            start = time.perf_counter()
+            merged.extend(scatter_gather(query.reshape(1, -1)))
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for offset in range(0, len(queries), 64):
+            scatter_gather(queries[offset:offset + 64])
+        batch_qps = len(queries) / (time.perf_counter() - start)
+        for connection in connections:
+            connection.send(None)
+        for worker in workers:
+            worker.join()
+        same = np.mean([[r["id"] for r in m] == [r["id"] for r in e] for m, e in zip(merged, expected)])
+        row = {"shards": nb_shards, "p50_ms": 1000 * np.percentile(latencies, 50),
+               "p95_ms": 1000 * np.percentile(latencies, 95), "batch_qps": batch_qps, "same": same}
+        rows.append(row)
+        print("%(shards)6d %(p50_ms)8.2f %(p95_ms)8.2f %(batch_qps)10.1f %(same)11.3f" % row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=["ann"])
+    parser.add_argument("--vectors", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--layout-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--layout", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.scenarios == ["_load"]:
+        load_layout(args.layout_dir, args.layout)
+        raise SystemExit
+    for scenario in args.scenarios:
+        if scenario == "ann":
+            bench_ann(args.vectors, args.queries, args.top_k)
+        elif scenario == "batch-search":
+            bench_batch_search(args.vectors, args.top_k)
+        elif scenario == "startup":
+            bench_startup(args.vectors)
+        elif scenario == "lexical":
+            bench_lexical(args.vectors, args.queries, args.top_k)
+        elif scenario == "shards":
+            bench_shards(args.vectors, args.queries, args.top_k)
+        elif scenario == "filter":
+            bench_filter(args.vectors, args.queries, args.top_k)
+        else:
+            raise SystemExit(f"Unknown scenario: {scenario}")
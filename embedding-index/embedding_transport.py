@@ -0,0 +1,46 @@
+from typing import List, Optional
+import numpy as np
+
+import service_http
+
+
+# Must match BINARY_EMBEDDING_DTYPES in embedding-gen-service/app.py
+BINARY_EMBEDDING_MEDIA_TYPES = {
+    "float32": "application/x-float32",
+    "float16": "application/x-float16",
+}
+
+
+def decode_embeddings(content: bytes, shape_header: str, dtype: str) -> np.ndarray:
+    """
+    Turn a binary /generate-embeddings response body into a float32 matrix. float32
+    bodies are wrapped without copying (the result is read-only); float16 ones are
+    widened.
+    """
+    rows, dimension = (int(n) for n in shape_header.split(","))
+    embeddings = np.frombuffer(content, dtype=np.dtype(dtype).newbyteorder("<")).reshape(rows, dimension)
+    if embeddings.dtype != np.float32:
+        embeddings = embeddings.astype(np.float32)
+    return embeddings
+
+
+def fetch_embeddings(
+        sentences: List[str],
+        dtype: str = "float32",
+        timeout: Optional[float] = None) -> np.ndarray:
+    """
+    Embed sentences with the embedding generation service using its binary response
+    mode, skipping the JSON encode/decode of every float.
+    :param timeout: Read timeout, overriding EMBEDDING_GEN_SERVICE_READ_TIMEOUT.
+    """
+    media_type = BINARY_EMBEDDING_MEDIA_TYPES[dtype]
+    session = service_http.session("EMBEDDING_GEN_SERVICE")
+    response = session.post(
+        "/generate-embeddings",
+        json={"sentences": sentences},
+        headers={"Accept": media_type},
+        **({"timeout": (session.config["connect_timeout"], timeout)} if timeout is not None else {}))
+    response.raise_for_status()
+    if response.headers.get("Content-Type", "").split(";")[0] != media_type:
+        raise ValueError(f"Expected a {media_type} response, got {response.headers.get('Content-Type')}")
+    return decode_embeddings(response.content, response.headers["X-Embedding-Shape"], dtype)
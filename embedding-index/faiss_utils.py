@@ -1,43 +1,565 @@
 import faiss
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple, TypedDict
 import numpy as np
 
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from transcript_table import IndexedTranscript, TranscriptTable
+
+
+# FAISS IDs pack (transcript slot, chunk index) into one int64, so all of a transcript's
+# vectors live in one contiguous ID range and can be removed with a single range selector
+CHUNK_INDEX_BITS = 32
+CHUNK_INDEX_MASK = (1 << CHUNK_INDEX_BITS) - 1
+
+
+def make_vector_ids(slot: int, nb_chunks: int) -> np.ndarray:
+    return (np.int64(slot) << CHUNK_INDEX_BITS) | np.arange(nb_chunks, dtype=np.int64)
+
+
+def slot_range(slot: int) -> Tuple[int, int]:
+    return slot << CHUNK_INDEX_BITS, (slot + 1) << CHUNK_INDEX_BITS
+
+
+def slot_id_range(slot: int) -> faiss.IDSelectorRange:
+    return faiss.IDSelectorRange(*slot_range(slot))
+
+
+class TranscriptFilter(TypedDict, total=False):
+    transcript_ids: Optional[List[str]]  # Only these transcripts...
+    tags: Optional[List[str]]  # ...and/or those with any of these tags
+    exclude_transcript_ids: Optional[List[str]]
+    exclude_tags: Optional[List[str]]
+
+
+class SlotSelection(TypedDict):
+    slots: np.ndarray  # Sorted transcript slots...
+    chunk_counts: np.ndarray  # ...their vector counts...
+    exclude: bool  # ...and whether they're the ones to leave out rather than keep
+
+
+# Past this many runs of consecutive slots, a selection's IDs go in a hash set
+# instead of being matched against each run's range
+MAX_RANGE_SELECTORS = 16
+
+
+def slots_selector(selection: SlotSelection) -> faiss.IDSelector:
+    """
+    FAISS selector for the vectors of a selection of transcripts, so only they are
+    scored. Consecutive slots are one contiguous ID range, so a selection that's a
+    few runs of them is a few range checks per vector; otherwise its vector IDs go
+    in an IDSelectorBatch (a hash set with a bloom filter in front), whose size is
+    that of the selection rather than the index.
+    """
+    slots = selection["slots"]
+    runs = np.split(slots, np.flatnonzero(np.diff(slots) != 1) + 1) if len(slots) else []
+    if len(runs) <= MAX_RANGE_SELECTORS:
+        selector: faiss.IDSelector = faiss.IDSelectorRange(0, 0)
+        for run in runs:
+            run_range = faiss.IDSelectorRange(slot_range(int(run[0]))[0], slot_range(int(run[-1]))[1])
+            combined = faiss.IDSelectorOr(selector, run_range)
+            # The C++ selectors only point at each other
+            combined.referenced_objects = [selector, run_range]
+            selector = combined
+    else:
+        selector = faiss.IDSelectorBatch(np.concatenate([
+            make_vector_ids(int(slot), int(count)) for slot, count in zip(slots, selection["chunk_counts"])]))
+    if selection["exclude"]:
+        inverted = faiss.IDSelectorNot(selector)
+        inverted.referenced_objects = [selector]
+        selector = inverted
+    return selector
+
+
+class IndexConfig(TypedDict):
+    type: str  # One of INDEX_TYPES
+    nlist: int  # IVF: number of clusters
+    pq_m: int  # IVF-PQ: sub-quantizers per vector (must divide the dimension)
+    hnsw_m: int  # HNSW: neighbours per node
+    nprobe: int  # IVF: default clusters visited per search
+    ef_search: int  # HNSW: default search beam width
+    train_sample_size: int  # IVF: max vectors sampled for training
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# Fields that change the index structure; the rest are search/training knobs
+INDEX_STRUCTURE_FIELDS = ("type", "nlist", "pq_m", "hnsw_m")
+
+DEFAULT_INDEX_CONFIG: IndexConfig = {
+    "type": "flat",
+    "nlist": 1024,
+    "pq_m": 64,
+    "hnsw_m": 32,
+    "nprobe": 16,
+    "ef_search": 64,
+    "train_sample_size": 100_000,
+}
+
+
+def build_faiss_index(dimension: int, config: IndexConfig) -> faiss.Index:
+    """
+    Create an empty index of the configured type that accepts our own int64 IDs.
+    Plain IndexIDMap rather than IndexIDMap2: we never look vectors up by ID, so the
+    per-vector reverse hash map would only cost memory.
+    """
+    index_type = config["type"]
+    if index_type == "flat":
+        return faiss.IndexIDMap(faiss.IndexFlatL2(dimension))  # L2 distance (Euclidean)
+    if index_type == "ivf_flat":
+        index = faiss.index_factory(dimension, f"IVF{config['nlist']},Flat")
+    elif index_type == "ivf_pq":
+        index = faiss.index_factory(dimension, f"IVF{config['nlist']},PQ{config['pq_m']}")
+    elif index_type == "hnsw":
+        index = faiss.IndexIDMap(faiss.IndexHNSWFlat(dimension, config["hnsw_m"]))
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+    apply_search_defaults(index, config)
+    return index
+
+
+def apply_search_defaults(index: faiss.Index, config: IndexConfig):
+    """
+    Set the index's default nprobe/efSearch from the config. FAISS saves them with
+    the index, so this is needed for a loaded index too, or it would keep the ones it
+    was built with.
+    """
+    if config["type"] in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = config["nprobe"]
+    elif config["type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = config["ef_search"]
+
+
+def search_parameters(
+        config: IndexConfig,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        selector: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Per-search overrides of the index's default nprobe/efSearch, and the vectors to
+    restrict the search to, if any apply.
+    """
+    if config["type"] in ("ivf_flat", "ivf_pq") and (nprobe is not None or selector is not None):
+        return faiss.SearchParametersIVF(nprobe=nprobe if nprobe is not None else config["nprobe"], sel=selector)
+    if config["type"] == "hnsw" and (ef_search is not None or selector is not None):
+        return faiss.SearchParametersHNSW(
+            efSearch=ef_search if ef_search is not None else config["ef_search"], sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
 class FAISSIndex:
-    def __init__(self, dimension: int, use_gpu: bool = False):
+    def __init__(
+            self,
+            dimension: int,
+            use_gpu: bool = False,
+            index: Optional[faiss.Index] = None,
+            transcripts: Optional[Dict[str, IndexedTranscript]] = None,
+            config: IndexConfig = DEFAULT_INDEX_CONFIG,
+            table: Optional[TranscriptTable] = None,
+            mapped_from: Optional[str] = None,
+            snapshot_version: Optional[str] = None,
+            lexical: Optional[BM25Index] = None):
         """
         Initialize FAISS index.
         :param dimension: Dimensionality of embeddings.
         :param use_gpu: Whether to use GPU for FAISS.
+        :param index: Existing ID-mapped index to wrap, e.g. one loaded from disk.
+        :param transcripts: Which transcripts `index` holds, keyed by transcript ID.
+        :param config: Index type and tuning; must describe `index` if one is given.
+        :param table: Like `transcripts`, in the compact form it is saved in.
+        :param mapped_from: File `index` was memory-mapped from, if it was.
+        :param snapshot_version: Snapshot `index` was loaded from, if any.
+        :param lexical: BM25 index over the chunks' texts, keyed by the same IDs.
         """
         self.dimension = dimension
-        self.index = faiss.IndexFlatL2(dimension)  # L2 distance (Euclidean)
-        self.ids = []  # List of IDs for added embeddings
+        self.config = config
+        if index is None:
+            index = build_faiss_index(dimension, config)
+        else:
+            apply_search_defaults(index, config)
+        self.index = index
+        self.mapped_from = mapped_from
+        self.snapshot_version = snapshot_version
+        self.lexical = lexical if lexical is not None else BM25Index()
+        # Vectors added before an IVF index is trained wait here until train_pending()
+        self._pending_ids: List[np.ndarray] = []
+        self._pending_embeddings: List[np.ndarray] = []
+        # Transcripts are kept in their compact table form until something needs the
+        # dicts (sync); slot -> transcript ID is all search needs
+        self._table: Optional[TranscriptTable] = table
+        self._transcripts: Optional[Dict[str, IndexedTranscript]] = None
+        self._slots: Dict[int, str] = {}
+        self._slot_ids: Optional[np.ndarray] = None
+        # Transcript ID -> chunks version, for search results
+        self._versions: Optional[Dict[str, str]] = None
+        # Transcript ID and tag -> slots, for filtered searches
+        self._slot_lookup: Optional[Tuple[Dict[str, int], Dict[str, List[int]]]] = None
+        if table is None:
+            self._set_transcripts(dict(transcripts or {}))
         if use_gpu:
             res = faiss.StandardGpuResources()
             self.index = faiss.index_cpu_to_gpu(res, 0, self.index)
+            self.mapped_from = None
+
+    def _ensure_writable(self):
+        """
+        A memory-mapped index is a read-only view of its snapshot file, and FAISS
+        aborts the process on writes to it - so read a private in-memory copy first.
+        """
+        if self.mapped_from is not None:
+            print(f"Reading {self.mapped_from} into memory before modifying it...")
+            self.index = faiss.read_index(self.mapped_from)
+            self.mapped_from = None
 
-    def add_embeddings(self, ids: List[str], embeddings: List[List[float]]):
+    def writable_copy(self) -> "FAISSIndex":
         """
-        Add embeddings to the FAISS index.
-        :param ids: List of unique IDs for embeddings.
-        :param embeddings: List of embedding vectors.
+        A private copy of this index to update, so this one can keep serving searches
+        unchanged in the meantime.
         """
-        assert len(ids) == len(embeddings), "IDs and embeddings must have the same length."
-        self.ids.extend(ids)
-        embeddings_np = np.array(embeddings, dtype="float32")
-        self.index.add(embeddings_np)
+        index = faiss.read_index(self.mapped_from) if self.mapped_from is not None else faiss.clone_index(self.index)
+        copy = FAISSIndex(
+            self.dimension, index=index, transcripts=self.transcripts, config=self.config, lexical=self.lexical.copy())
+        copy._pending_ids = list(self._pending_ids)
+        copy._pending_embeddings = list(self._pending_embeddings)
+        return copy
+
+    def _set_transcripts(self, transcripts: Dict[str, IndexedTranscript]):
+        self._transcripts = transcripts
+        self._slots = {t["slot"]: tid for tid, t in transcripts.items()}
+
+    @property
+    def transcripts(self) -> Dict[str, IndexedTranscript]:
+        if self._transcripts is None:
+            assert self._table is not None
+            self._set_transcripts(self._table.to_transcripts())
+        assert self._transcripts is not None
+        return self._transcripts
+
+    def table(self) -> TranscriptTable:
+        if self._table is None:
+            self._table = TranscriptTable.from_transcripts(self.transcripts)
+        return self._table
 
-    def search(self, query_embedding: List[float], top_k: int = 5):
+    def transcript_count(self) -> int:
+        return len(self._transcripts) if self._transcripts is not None else len(self.table())
+
+    def _transcripts_changed(self):
+        self._table = None
+        self._slot_ids = None
+        self._versions = None
+        self._slot_lookup = None
+
+    def add_transcript(
+            self,
+            transcript_id: str,
+            chunks_version: str,
+            embeddings: np.ndarray,
+            chunk_texts: Optional[List[str]] = None,
+            tags: Optional[List[str]] = None):
+        """
+        Add (or replace) all of a transcript's chunk embeddings.
+        :param transcript_id: ID of the transcript the chunks belong to.
+        :param chunks_version: The transcript service's version of these chunks.
+        :param embeddings: One embedding per chunk, in chunk order.
+        :param chunk_texts: The chunks' texts, to add to the BM25 index (pending
+            until `lexical.commit()`).
+        :param tags: The transcript's tags, for filtered searches.
+        """
+        self.remove_transcript(transcript_id)
+        transcripts = self.transcripts
+        slot = max(self._slots, default=-1) + 1
+        if len(embeddings):
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            ids = make_vector_ids(slot, len(embeddings))
+            if self.index.is_trained:
+                self._ensure_writable()
+                self.index.add_with_ids(embeddings, ids)
+            else:
+                self._pending_ids.append(ids)
+                self._pending_embeddings.append(embeddings)
+        if chunk_texts is not None:
+            self.lexical.add(make_vector_ids(slot, len(chunk_texts)), chunk_texts)
+        transcripts[transcript_id] = {
+            "slot": slot, "chunksVersion": chunks_version, "chunkCount": len(embeddings), "tags": list(tags or [])}
+        self._slots[slot] = transcript_id
+        self._transcripts_changed()
+
+    def set_tags(self, transcript_id: str, tags: List[str]):
+        self.transcripts[transcript_id]["tags"] = list(tags)
+        self._transcripts_changed()
+
+    def add_lexical(self, transcript_id: str, chunk_texts: List[str]):
+        """
+        Add an indexed transcript's chunk texts to the BM25 index, e.g. for indexes
+        built before there was one.
+        """
+        slot = self.transcripts[transcript_id]["slot"]
+        self.lexical.remove_range(*slot_range(slot))
+        self.lexical.add(make_vector_ids(slot, len(chunk_texts)), chunk_texts)
+
+    def transcripts_missing_lexical(self) -> List[str]:
+        """
+        Indexed transcripts with chunks but none of them in the BM25 index.
+        """
+        lexical_slots = set(self.lexical.doc_id_slots(CHUNK_INDEX_BITS).tolist())
+        return [tid for tid, t in self.transcripts.items() if t["chunkCount"] and t["slot"] not in lexical_slots]
+
+    def remove_transcript(self, transcript_id: str):
+        """
+        Remove all of a transcript's chunk embeddings, if it is indexed.
+        """
+        self.remove_transcripts([transcript_id])
+
+    def remove_transcripts(self, transcript_ids: List[str]):
+        """
+        Remove all chunk embeddings of the given transcripts that are indexed.
+        """
+        slots = []
+        for transcript_id in transcript_ids:
+            transcript = self.transcripts.pop(transcript_id, None)
+            if transcript is not None:
+                del self._slots[transcript["slot"]]
+                slots.append(transcript["slot"])
+        if not slots:
+            return
+        for slot in slots:
+            self.lexical.remove_range(*slot_range(slot))
+        self._transcripts_changed()
+        self._ensure_writable()
+        if self._pending_ids:
+            keep = [~np.isin(ids >> CHUNK_INDEX_BITS, slots) for ids in self._pending_ids]
+            self._pending_ids = [ids[k] for ids, k in zip(self._pending_ids, keep)]
+            self._pending_embeddings = [e[k] for e, k in zip(self._pending_embeddings, keep)]
+        if self.config["type"] == "hnsw":
+            # HNSW graphs don't support deletion, so rebuild from the vectors we keep
+            self._rebuild_without(slots)
+        else:
+            for slot in slots:
+                self.index.remove_ids(slot_id_range(slot))
+
+    def _rebuild_without(self, slots: List[int]):
+        ids = faiss.vector_to_array(self.index.id_map)
+        embeddings = self.index.index.reconstruct_n(0, self.index.ntotal)
+        keep = ~np.isin(ids >> CHUNK_INDEX_BITS, slots)
+        self.index = build_faiss_index(self.dimension, self.config)
+        self.index.add_with_ids(embeddings[keep], ids[keep])
+
+    def has_pending(self) -> bool:
+        return bool(self._pending_ids)
+
+    def train_pending(self):
+        """
+        Train the index on a sample of the vectors added so far, then add them.
+        """
+        if not self._pending_ids:
+            return
+        ids = np.concatenate(self._pending_ids)
+        embeddings = np.concatenate(self._pending_embeddings)
+        # k-means needs at least one point per centroid (256 PQ centroids per sub-quantizer)
+        min_vectors = max(self.config["nlist"], 256 if self.config["type"] == "ivf_pq" else 0)
+        if len(embeddings) < min_vectors:
+            raise ValueError(
+                f"Need at least {min_vectors} vectors to train a {self.config['type']} index, "
+                f"only have {len(embeddings)}; lower IVF_NLIST or use a flat index")
+        sample_size = min(len(embeddings), self.config["train_sample_size"])
+        sample = embeddings[np.random.default_rng(0).choice(len(embeddings), sample_size, replace=False)]
+        print(f"Training {self.config['type']} index on {sample_size} of {len(embeddings)} vectors...")
+        self._ensure_writable()
+        self.index.train(sample)
+        self.index.add_with_ids(embeddings, ids)
+        self._pending_ids, self._pending_embeddings = [], []
+
+    def slot_selection(self, transcript_filter: Optional[TranscriptFilter]) -> Optional[SlotSelection]:
+        """
+        The transcripts a filter restricts a search to (or, with only exclusions, the
+        ones it leaves out), or None if it doesn't restrict it at all.
+        """
+        if not transcript_filter:
+            return None
+        if self._slot_lookup is None:
+            table = self.table()
+            tag_slots: Dict[str, List[int]] = {}
+            for slot, tags in zip(table.slots[:, 0].tolist(), table.tags):
+                for tag in tags:
+                    tag_slots.setdefault(tag, []).append(slot)
+            self._slot_lookup = (dict(zip(table.transcript_ids, table.slots[:, 0].tolist())), tag_slots)
+        slot_of, tag_slots = self._slot_lookup
+
+        def slots(transcript_ids: Optional[List[str]], tags: Optional[List[str]]) -> set:
+            return {slot_of[tid] for tid in transcript_ids or [] if tid in slot_of} | \
+                {slot for tag in tags or [] for slot in tag_slots.get(tag, [])}
+
+        included_ids, included_tags = transcript_filter.get("transcript_ids"), transcript_filter.get("tags")
+        excluded = slots(transcript_filter.get("exclude_transcript_ids"), transcript_filter.get("exclude_tags"))
+        if included_ids is not None or included_tags is not None:
+            selected, exclude = slots(included_ids, included_tags) - excluded, False
+        elif excluded:
+            selected, exclude = excluded, True
+        else:
+            return None
+        selected_slots = np.array(sorted(selected), dtype=np.int64)
+        chunk_counts = dict(self.table().slots.tolist())
+        return {
+            "slots": selected_slots,
+            "chunk_counts": np.array([chunk_counts[slot] for slot in selected_slots.tolist()], dtype=np.int64),
+            "exclude": exclude}
+
+    def chunk_ids(self, vector_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Map FAISS IDs back to the transcript service's "{transcript_id}-{chunk_index}"
+        chunk IDs, as two arrays: transcript IDs (None for unknown or missing
+        results) and chunk indexes.
+        """
+        if self._slot_ids is None:
+            self._slot_ids = self.table().slot_ids()
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        slots = vector_ids >> CHUNK_INDEX_BITS
+        known = (vector_ids >= 0) & (slots < len(self._slot_ids))
+        transcript_ids = np.full(vector_ids.shape, None, dtype=object)
+        transcript_ids[known] = self._slot_ids[slots[known]]
+        return transcript_ids, vector_ids & CHUNK_INDEX_MASK
+
+    def chunks_version(self, transcript_id: str) -> str:
+        """
+        The chunks version of a transcript in the index, which search results carry
+        so callers can tell when a chunk ID's text has changed.
+        """
+        if self._versions is None:
+            table = self.table()
+            self._versions = dict(zip(table.transcript_ids, table.chunks_versions))
+        return self._versions[transcript_id]
+
+    def chunk_id(self, vector_id: int) -> Optional[str]:
+        """
+        Map a FAISS ID back to the transcript service's chunk ID.
+        """
+        transcript_ids, chunk_indexes = self.chunk_ids(np.array([vector_id]))
+        if transcript_ids[0] is None:
+            return None
+        return f"{transcript_ids[0]}-{chunk_indexes[0]}"
+
+    def search(
+            self,
+            query_embedding: List[float],
+            top_k: int = 5,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            transcript_filter: Optional[TranscriptFilter] = None):
         """
         Search for nearest neighbors in the FAISS index.
         :param query_embedding: Query embedding vector.
         :param top_k: Number of nearest neighbors to return.
+        :param nprobe: IVF clusters to visit, overriding the index default.
+        :param ef_search: HNSW beam width, overriding the index default.
+        :param transcript_filter: Transcripts to restrict the search to.
         :return: List of tuples (id, distance).
         """
         query_np = np.array([query_embedding], dtype="float32")
-        distances, indices = self.index.search(query_np, top_k)
-        results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx < len(self.ids):  # Valid index
-                results.append({"id": self.ids[idx], "distance": float(dist)})
-        return results
+        return self.search_batch(
+            query_np, [top_k], nprobe=nprobe, ef_search=ef_search, transcript_filter=transcript_filter)[0]
+
+    def search_batch(
+            self,
+            query_embeddings: np.ndarray,
+            top_ks: List[int],
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            transcript_filter: Optional[TranscriptFilter] = None):
+        """
+        Search for the nearest neighbors of many queries with a single FAISS call.
+        :param query_embeddings: (number of queries, dimension) matrix.
+        :param top_ks: Neighbors to return, one per query or a single value for all.
+        :param transcript_filter: Transcripts to restrict the search to. Only their
+            vectors are scored, but IVF and HNSW indexes visit as many clusters /
+            nodes as unfiltered, so may find fewer than top_k for a narrow filter.
+        :return: One list of {id, distance, chunks_version} per query.
+        """
+        query_np = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if len(top_ks) == 1:
+            top_ks = top_ks * len(query_np)
+        if len(top_ks) != len(query_np):
+            raise ValueError(f"Got {len(top_ks)} top_k values for {len(query_np)} queries")
+        if len(query_np) == 0:
+            return []
+        selection = self.slot_selection(transcript_filter)
+        if selection is not None and not selection["exclude"] and not len(selection["slots"]):
+            return [[] for _ in query_np]
+        selector = slots_selector(selection) if selection is not None else None
+        params = search_parameters(self.config, nprobe=nprobe, ef_search=ef_search, selector=selector)
+        distances, indices = self.index.search(query_np, max(top_ks), params=params)
+        transcript_ids, chunk_indexes = self.chunk_ids(indices)
+        all_results = []
+        for top_k, query_distances, query_tids, query_chunks in zip(
+                top_ks, distances.tolist(), transcript_ids, chunk_indexes.tolist()):
+            all_results.append([
+                {"id": f"{tid}-{chunk}", "distance": dist, "chunks_version": self.chunks_version(tid)}
+                for dist, tid, chunk in zip(query_distances[:top_k], query_tids[:top_k], query_chunks[:top_k])
+                if tid is not None  # Valid index
+            ])
+        return all_results
+
+    def search_hybrid_batch(
+            self,
+            query_texts: List[str],
+            query_embeddings: Optional[np.ndarray],
+            top_ks: List[int],
+            candidates: int = 50,
+            rrf_k: int = 60,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            transcript_filter: Optional[TranscriptFilter] = None):
+        """
+        Search by BM25 over the chunk texts and by vector similarity, and fuse the
+        two rankings with reciprocal rank fusion.
+        :param query_embeddings: The queries' embeddings, or None to rank by BM25 only.
+        :param candidates: Chunks taken from each ranking before fusing.
+        :param transcript_filter: Transcripts to restrict both searches to.
+        :return: One list of {id, score, distance, bm25_score, chunks_version} per query, best first;
+            distance or bm25_score is None if the chunk wasn't in that ranking.
+        """
+        if len(top_ks) == 1:
+            top_ks = top_ks * len(query_texts)
+        if len(top_ks) != len(query_texts):
+            raise ValueError(f"Got {len(top_ks)} top_k values for {len(query_texts)} queries")
+        if query_embeddings is not None and len(query_embeddings) != len(query_texts):
+            raise ValueError(f"Got {len(query_embeddings)} embeddings for {len(query_texts)} queries")
+        if not query_texts:
+            return []
+        depth = max(candidates, max(top_ks))
+        selection = self.slot_selection(transcript_filter)
+        if selection is not None and not selection["exclude"] and not len(selection["slots"]):
+            return [[] for _ in query_texts]
+        keep = None
+        if selection is not None:
+            selected_slots, exclude = selection["slots"], selection["exclude"]
+
+            def keep(ids: np.ndarray) -> np.ndarray:
+                return np.isin(ids >> CHUNK_INDEX_BITS, selected_slots, invert=exclude)
+        # Vector ID -> distance / BM25 score, best first
+        vector_hits: List[Dict[int, float]] = [{} for _ in query_texts]
+        if query_embeddings is not None:
+            query_np = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+            selector = slots_selector(selection) if selection is not None else None
+            params = search_parameters(self.config, nprobe=nprobe, ef_search=ef_search, selector=selector)
+            distances, indices = self.index.search(query_np, depth, params=params)
+            for hits, query_indices, query_distances in zip(vector_hits, indices.tolist(), distances.tolist()):
+                hits.update((i, d) for i, d in zip(query_indices, query_distances) if i >= 0)
+        all_results = []
+        for query_text, top_k, vectors in zip(query_texts, top_ks, vector_hits):
+            lexical_ids, lexical_scores = self.lexical.search(query_text, depth, keep=keep)
+            lexical = dict(zip(lexical_ids.tolist(), lexical_scores.tolist()))
+            fused = reciprocal_rank_fusion([list(vectors), list(lexical)], rrf_k)
+            best = sorted(fused, key=lambda vector_id: -fused[vector_id])[:top_k]
+            transcript_ids, chunk_indexes = self.chunk_ids(np.array(best, dtype=np.int64))
+            all_results.append([
+                {
+                    "id": f"{tid}-{chunk}",
+                    "score": fused[vector_id],
+                    "distance": vectors.get(vector_id),
+                    "bm25_score": lexical.get(vector_id),
+                    "chunks_version": self.chunks_version(tid),
+                }
+                for vector_id, tid, chunk in zip(best, transcript_ids, chunk_indexes.tolist())
+                if tid is not None
+            ])
+        return all_results
@@ -0,0 +1,273 @@
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+
+
+TERMS_FILE = "bm25_terms.txt"
+OFFSETS_FILE = "bm25_offsets.i64"
+POSTINGS_FILE = "bm25_postings.i64"
+POSTING_STATS_FILE = "bm25_posting_stats.u16"
+DOCS_FILE = "bm25_docs.i64"
+DOC_LENGTHS_FILE = "bm25_doc_lengths.u16"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN = re.compile(r"\w+")
+# Lucene's English stop words; they'd be the longest postings lists and score ~0
+STOPWORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such that the their then there these "
+    "they this to was will with".split())
+# Term frequencies and document lengths are stored as uint16
+MAX_COUNT = np.iinfo(np.uint16).max
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = 60) -> Dict[Hashable, float]:
+    """
+    Fuse rankings (best first) by giving each item the sum of 1 / (k + rank) over
+    the rankings it's in, ranks starting at 1.
+    """
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1 / (k + rank)
+    return fused
+
+
+def read_array(path: str, dtype: str, columns: int = 1) -> np.ndarray:
+    nb_rows = os.path.getsize(path) // (np.dtype(dtype).itemsize * columns)
+    shape = (nb_rows, columns) if columns > 1 else (nb_rows,)
+    # np.memmap can't map an empty file
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape) if nb_rows else np.empty(shape, dtype=dtype)
+
+
+class BM25Index:
+    """
+    BM25 inverted index over chunk texts, keyed by the same int64 IDs as the chunks'
+    vectors. Postings are stored as flat arrays (CSR): the postings of term t are
+    `postings[offsets[t]:offsets[t + 1]]`, with each one's term frequency and
+    document length alongside in `posting_stats`, so scoring a query term is a few
+    vectorized operations over one slice.
+
+    Like vectors added before an IVF index is trained, added and removed documents
+    are pending until `commit()`, which merges them into new arrays in one sort. The
+    committed arrays are never modified, so copies share them and a loaded index can
+    memory-map them.
+    """
+    def __init__(
+            self,
+            terms: Optional[List[str]] = None,
+            offsets: Optional[np.ndarray] = None,
+            postings: Optional[np.ndarray] = None,
+            posting_stats: Optional[np.ndarray] = None,
+            doc_ids: Optional[np.ndarray] = None,
+            doc_lengths: Optional[np.ndarray] = None):
+        self.terms: List[str] = terms if terms is not None else []
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype="<i8")
+        self.postings = postings if postings is not None else np.empty(0, dtype="<i8")
+        self.posting_stats = posting_stats if posting_stats is not None else np.empty((0, 2), dtype="<u2")
+        self.doc_ids = doc_ids if doc_ids is not None else np.empty(0, dtype="<i8")  # Sorted
+        self.doc_lengths = doc_lengths if doc_lengths is not None else np.empty(0, dtype="<u2")
+        self._term_index: Optional[Dict[str, int]] = None
+        self._avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+        # Per added batch of documents: their postings' term IDs, doc IDs and term
+        # frequencies, then the documents' IDs and lengths
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        self._removed_ranges: List[Tuple[int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def term_index(self) -> Dict[str, int]:
+        if self._term_index is None:
+            self._term_index = {term: i for i, term in enumerate(self.terms)}
+        return self._term_index
+
+    def copy(self) -> "BM25Index":
+        copy = BM25Index(
+            list(self.terms), self.offsets, self.postings, self.posting_stats, self.doc_ids, self.doc_lengths)
+        copy._pending = list(self._pending)
+        copy._removed_ranges = list(self._removed_ranges)
+        return copy
+
+    def add(self, doc_ids: np.ndarray, texts: List[str]):
+        """
+        Add documents. IDs must be new: remove existing documents' ranges first.
+        """
+        term_index = self.term_index
+        term_ids: List[int] = []
+        posting_doc_ids: List[int] = []
+        tfs: List[int] = []
+        lengths: List[int] = []
+        for doc_id, text in zip(doc_ids.tolist(), texts):
+            tokens = tokenize(text)
+            for term, tf in Counter(tokens).items():
+                term_id = term_index.get(term)
+                if term_id is None:
+                    term_id = term_index[term] = len(self.terms)
+                    self.terms.append(term)
+                term_ids.append(term_id)
+                posting_doc_ids.append(doc_id)
+                tfs.append(tf)
+            lengths.append(len(tokens))
+        self._pending.append((
+            np.array(term_ids, dtype=np.int64),
+            np.array(posting_doc_ids, dtype=np.int64),
+            np.minimum(np.array(tfs, dtype=np.int64), MAX_COUNT).astype(np.uint16),
+            np.asarray(doc_ids, dtype=np.int64),
+            np.minimum(np.array(lengths, dtype=np.int64), MAX_COUNT).astype(np.uint16)))
+
+    def remove_range(self, start: int, end: int):
+        """
+        Remove the documents with IDs in [start, end), including pending ones.
+        """
+        self._removed_ranges.append((start, end))
+        pending = []
+        for terms, posting_docs, tfs, docs, lengths in self._pending:
+            keep_posting = (posting_docs < start) | (posting_docs >= end)
+            keep_doc = (docs < start) | (docs >= end)
+            pending.append((
+                terms[keep_posting], posting_docs[keep_posting], tfs[keep_posting], docs[keep_doc], lengths[keep_doc]))
+        self._pending = pending
+
+    def has_pending(self) -> bool:
+        return bool(self._pending or self._removed_ranges)
+
+    def doc_id_slots(self, slot_bits: int) -> np.ndarray:
+        """
+        The distinct `doc_id >> slot_bits` of the committed documents.
+        """
+        return np.unique(self.doc_ids >> slot_bits)
+
+    def commit(self):
+        """
+        Merge the pending additions and removals into new posting arrays, dropping
+        terms no document uses any more.
+        """
+        if not self.has_pending():
+            return
+        # Expand the committed postings back to (term, doc, stats) rows
+        term_ids = [np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int64), np.diff(self.offsets))]
+        doc_ids = [np.asarray(self.postings)]
+        tfs = [np.asarray(self.posting_stats[:, 0])]
+        all_docs = [np.asarray(self.doc_ids)]
+        all_lengths = [np.asarray(self.doc_lengths)]
+        if self._removed_ranges:
+            keep_posting = np.ones(len(doc_ids[0]), dtype=bool)
+            keep_doc = np.ones(len(all_docs[0]), dtype=bool)
+            for start, end in self._removed_ranges:
+                keep_posting &= (doc_ids[0] < start) | (doc_ids[0] >= end)
+                keep_doc &= (all_docs[0] < start) | (all_docs[0] >= end)
+            term_ids[0], doc_ids[0], tfs[0] = term_ids[0][keep_posting], doc_ids[0][keep_posting], tfs[0][keep_posting]
+            all_docs[0], all_lengths[0] = all_docs[0][keep_doc], all_lengths[0][keep_doc]
+        for pending_terms, pending_posting_docs, pending_tfs, pending_docs, pending_lengths in self._pending:
+            term_ids.append(pending_terms)
+            doc_ids.append(pending_posting_docs)
+            tfs.append(pending_tfs)
+            all_docs.append(pending_docs)
+            all_lengths.append(pending_lengths)
+        self._pending, self._removed_ranges = [], []
+
+        term_ids_all = np.concatenate(term_ids)
+        doc_ids_all = np.concatenate(doc_ids)
+        tfs_all = np.concatenate(tfs)
+        docs_all = np.concatenate(all_docs)
+        lengths_all = np.concatenate(all_lengths)
+        doc_order = np.argsort(docs_all, kind="stable")
+        self.doc_ids, self.doc_lengths = docs_all[doc_order], lengths_all[doc_order]
+
+        used_terms, term_ids_all = np.unique(term_ids_all, return_inverse=True)
+        self.terms = [self.terms[t] for t in used_terms.tolist()]
+        self._term_index = None
+        order = np.lexsort((doc_ids_all, term_ids_all))
+        self.postings = doc_ids_all[order]
+        posting_lengths = self.doc_lengths[np.searchsorted(self.doc_ids, self.postings)]
+        self.posting_stats = np.stack([tfs_all[order], posting_lengths], axis=1)
+        self.offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids_all, minlength=len(self.terms)), out=self.offsets[1:])
+        self._avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+
+    def search(
+            self,
+            query: str,
+            top_k: int,
+            keep: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param keep: Restricts the search to some documents: maps an array of document
+            IDs to a mask of the ones to keep. Term statistics stay those of the
+            whole index.
+        :return: The IDs of the `top_k` best-scoring documents and their BM25 scores,
+            best first.
+        """
+        term_index = self.term_index
+        term_ids = [term_index[t] for t in set(tokenize(query)) if t in term_index]
+        nb_docs = len(self.doc_ids)
+        if not term_ids or nb_docs == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs, scores = [], []
+        for term_id in term_ids:
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            stats = self.posting_stats[start:end].astype(np.float32)
+            tf, length = stats[:, 0], stats[:, 1]
+            df = end - start
+            idf = np.log1p((nb_docs - df + 0.5) / (df + 0.5))
+            term_docs = self.postings[start:end]
+            if keep is not None:
+                kept = keep(np.asarray(term_docs))
+                term_docs, tf, length = term_docs[kept], tf[kept], length[kept]
+            docs.append(term_docs)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self._avg_doc_length)
+            scores.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        if len(term_ids) == 1:
+            doc_ids, doc_scores = np.asarray(docs[0]), scores[0]
+        else:
+            doc_ids, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            doc_scores = np.bincount(inverse, weights=np.concatenate(scores)).astype(np.float32)
+        if len(doc_ids) > top_k:
+            best = np.argpartition(-doc_scores, top_k - 1)[:top_k]
+            doc_ids, doc_scores = doc_ids[best], doc_scores[best]
+        order = np.argsort(-doc_scores, kind="stable")
+        return doc_ids[order], doc_scores[order]
+
+    def save(self, directory: str):
+        if self.has_pending():
+            raise ValueError("BM25 index has uncommitted changes")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, TERMS_FILE), "w") as f:
+            f.writelines(f"{term}\n" for term in self.terms)
+        for name, array, dtype in [
+                (OFFSETS_FILE, self.offsets, "<i8"),
+                (POSTINGS_FILE, self.postings, "<i8"),
+                (POSTING_STATS_FILE, self.posting_stats, "<u2"),
+                (DOCS_FILE, self.doc_ids, "<i8"),
+                (DOC_LENGTHS_FILE, self.doc_lengths, "<u2")]:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["BM25Index"]:
+        """
+        Load an index saved in `directory`, memory-mapping its arrays, or None if
+        there isn't one.
+        """
+        if not os.path.exists(os.path.join(directory, TERMS_FILE)):
+            return None
+        with open(os.path.join(directory, TERMS_FILE), "r") as f:
+            terms = [line.rstrip("\n") for line in f]
+        index = cls(
+            terms,
+            read_array(os.path.join(directory, OFFSETS_FILE), "<i8"),
+            read_array(os.path.join(directory, POSTINGS_FILE), "<i8"),
+            read_array(os.path.join(directory, POSTING_STATS_FILE), "<u2", columns=2),
+            read_array(os.path.join(directory, DOCS_FILE), "<i8"),
+            read_array(os.path.join(directory, DOC_LENGTHS_FILE), "<u2"))
+        if len(index.offsets) != len(terms) + 1 or index.offsets[-1] != len(index.postings):
+            raise ValueError(f"BM25 index in {directory} is inconsistent")
+        return index
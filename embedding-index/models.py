@@ -1,19 +1,71 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, conint
+from typing import List, Literal, Optional, Union
+
+TopK = conint(ge=1)
 
 class AddEmbeddingsRequest(BaseModel):
     ids: List[str]  # Unique IDs for embeddings
     embeddings: List[List[float]]  # List of embedding vectors
 
+# Restricts a search to some transcripts: those listed in transcript_ids or tagged with
+# any of tags (all if neither is given), minus the excluded ones
+class SearchFilter(BaseModel):
+    transcript_ids: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    exclude_transcript_ids: Optional[List[str]] = None
+    exclude_tags: Optional[List[str]] = None
+
 class SearchRequest(BaseModel):
     query_embedding: List[float]  # Query vector
-    top_k: int = 5  # Number of nearest neighbors to return
+    top_k: TopK = 5  # Number of nearest neighbors to return
+    nprobe: Optional[int] = None  # IVF indexes: clusters to visit (default: IVF_NPROBE)
+    ef_search: Optional[int] = None  # HNSW indexes: search beam width (default: HNSW_EF_SEARCH)
+    filter: Optional[SearchFilter] = None
+
+class SearchBatchRequest(BaseModel):
+    query_embeddings: List[List[float]]  # One query vector per search
+    top_k: Union[TopK, List[TopK]] = 5  # Neighbors to return, for all queries or per query
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    filter: Optional[SearchFilter] = None  # Applies to every query
 
 # Define the structure of each result
 class SearchResult(BaseModel):
     id: str  # ID of the nearest neighbor
     distance: float  # Distance (or similarity score)
+    # Of the chunk's transcript; changes when the transcript's chunks (so their texts) do
+    chunks_version: Optional[str] = None
 
 # Define the response model
 class SearchResponse(BaseModel):
     results: List[SearchResult]  # List of typed results
+
+class SearchBatchResponse(BaseModel):
+    results: List[List[SearchResult]]  # Results for each query, in request order
+
+class HybridSearchBatchRequest(BaseModel):
+    queries: List[str]  # Query texts; embedded by this service unless mode is "lexical"
+    query_embeddings: Optional[List[List[float]]] = None  # Embeddings of the queries, if already made
+    top_k: Union[TopK, List[TopK]] = 5
+    mode: Literal["hybrid", "lexical"] = "hybrid"
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    filter: Optional[SearchFilter] = None
+
+class HybridSearchResult(BaseModel):
+    id: str
+    score: float  # Reciprocal rank fusion score
+    distance: Optional[float] = None  # Vector distance, if found by vector search
+    bm25_score: Optional[float] = None  # If found by BM25
+    chunks_version: Optional[str] = None
+
+class HybridSearchBatchResponse(BaseModel):
+    results: List[List[HybridSearchResult]]
+
+class SyncResponse(BaseModel):
+    added: int  # Transcripts embedded for the first time
+    updated: int  # Transcripts re-embedded because their chunks changed
+    removed: int  # Transcripts no longer served by the transcript service
+    lexical_backfilled: int = 0  # Indexed transcripts added to the BM25 index
+    retagged: int = 0  # Transcripts whose tags changed (but not their chunks)
+    vector_count: int  # Vectors in the index after the sync
@@ -1,8 +1,12 @@
 # NB: running the app with this file as opposed to "uvicorn app:app ..." since uvicorn obscures
 # uncaught exceptions thrown before server starts up
+import os
 
 from app import app
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers each serve the same memory-mapped index snapshot; one of them syncs it and
+    # the others hot-swap in the snapshots it writes
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("app:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers)
@@ -0,0 +1,149 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+class PendingTranscript:
+    """
+    A fetched transcript whose chunk embeddings are still coming back.
+    """
+    def __init__(self, script_id: str, chunks_version: str, chunk_texts: List[str]):
+        self.script_id = script_id
+        self.chunks_version = chunks_version
+        self.chunk_texts = chunk_texts
+        self.embeddings: Optional[np.ndarray] = None
+        self.remaining = len(chunk_texts)
+
+
+# (transcript, index of its first chunk in the batch, number of its chunks in the batch)
+BatchSegment = Tuple[PendingTranscript, int, int]
+
+
+class SeedingProgress:
+    def __init__(self, nb_transcripts: int, report_interval: float):
+        self.nb_transcripts = nb_transcripts
+        self.report_interval = report_interval
+        self.started_at = time.monotonic()
+        self.last_report = self.started_at
+        self.chunks_fetched = 0
+        self.chunks_embedded = 0
+        self.transcripts_done = 0
+
+    def chunks_per_sec(self) -> float:
+        return self.chunks_embedded / max(time.monotonic() - self.started_at, 1e-9)
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        print(f"Seeding: {self.transcripts_done}/{self.nb_transcripts} transcripts, "
+              f"{self.chunks_embedded}/{self.chunks_fetched} fetched chunks embedded "
+              f"({self.chunks_per_sec():.1f} chunks/sec)")
+
+
+def embed_transcripts(
+        script_ids: Iterable[str],
+        fetch_script: Callable[[str], Any],
+        embed_texts: Callable[[List[str]], np.ndarray],
+        on_transcript_embedded: Callable[[str, str, np.ndarray, List[str]], None],
+        dimension: int,
+        batch_size: int = 256,
+        prefetch: int = 4,
+        requests_in_flight: int = 2,
+        report_interval: float = 5.0) -> SeedingProgress:
+    """
+    Fetch and embed transcripts as a bounded pipeline: up to `prefetch` transcripts are
+    fetched concurrently, their chunks are packed into `batch_size` embedding requests
+    regardless of transcript boundaries, and up to `requests_in_flight` of those run at
+    once. `on_transcript_embedded(script_id, chunks_version, embeddings, chunk_texts)`
+    is called on the calling thread as soon as all of a transcript's chunks are embedded.
+    :param fetch_script: Returns a transcript with `chunks` (each with `text`) and `chunks_version`.
+    :param embed_texts: Returns one embedding row per text.
+    """
+    script_ids = list(script_ids)
+    progress = SeedingProgress(len(script_ids), report_interval)
+
+    def finish(transcript: PendingTranscript):
+        embeddings = transcript.embeddings
+        if embeddings is None:
+            embeddings = np.zeros((0, dimension), dtype=np.float32)
+        on_transcript_embedded(transcript.script_id, transcript.chunks_version, embeddings, transcript.chunk_texts)
+        progress.transcripts_done += 1
+
+    def handle_batch(segments: List[BatchSegment], future: "Future[np.ndarray]"):
+        embeddings = future.result()
+        row = 0
+        for transcript, start, count in segments:
+            if transcript.embeddings is None:
+                transcript.embeddings = np.empty(
+                    (transcript.remaining, embeddings.shape[1]), dtype=np.float32)
+            transcript.embeddings[start:start + count] = embeddings[row:row + count]
+            row += count
+            transcript.remaining -= count
+            if transcript.remaining == 0:
+                finish(transcript)
+        progress.chunks_embedded += row
+        progress.report()
+
+    with ThreadPoolExecutor(prefetch, thread_name_prefix="seed-fetch") as fetch_pool, \
+            ThreadPoolExecutor(requests_in_flight, thread_name_prefix="seed-embed") as embed_pool:
+        in_flight: Dict["Future[np.ndarray]", List[BatchSegment]] = {}
+
+        def wait_for_batches(max_in_flight: int):
+            while len(in_flight) > max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handle_batch(in_flight.pop(future), future)
+
+        batch_texts: List[str] = []
+        batch_segments: List[BatchSegment] = []
+
+        def submit_batch():
+            nonlocal batch_texts, batch_segments
+            if not batch_texts:
+                return
+            wait_for_batches(requests_in_flight - 1)
+            in_flight[embed_pool.submit(embed_texts, batch_texts)] = batch_segments
+            batch_texts, batch_segments = [], []
+
+        remaining_ids = iter(script_ids)
+        fetches: Deque["Future[Any]"] = deque()
+
+        def top_up_fetches():
+            while len(fetches) < prefetch:
+                script_id = next(remaining_ids, None)
+                if script_id is None:
+                    return
+                fetches.append(fetch_pool.submit(fetch_script, script_id))
+
+        try:
+            top_up_fetches()
+            while fetches:
+                script = fetches.popleft().result()
+                top_up_fetches()
+                chunk_texts = [c.text for c in script.chunks]
+                progress.chunks_fetched += len(chunk_texts)
+                transcript = PendingTranscript(script.id, script.chunks_version, chunk_texts)
+                if not chunk_texts:
+                    finish(transcript)
+                    continue
+                start = 0
+                while start < len(chunk_texts):
+                    count = min(batch_size - len(batch_texts), len(chunk_texts) - start)
+                    batch_texts.extend(chunk_texts[start:start + count])
+                    batch_segments.append((transcript, start, count))
+                    start += count
+                    if len(batch_texts) == batch_size:
+                        submit_batch()
+            submit_batch()
+            wait_for_batches(0)
+        except BaseException:
+            for future in list(fetches) + list(in_flight):
+                future.cancel()
+            raise
+
+    progress.report(force=True)
+    return progress
@@ -0,0 +1,207 @@
+"""
+Scatter-gather front for an embedding index split into shards. Each shard is an
+ordinary embedding-index instance (its own process or node) started with
+INDEX_SHARD=<i>/<N>, which only indexes the transcripts whose IDs hash to it. This
+serves the same search, sync and index-info API as a single instance: searches go to
+every shard in parallel and their results are heap-merged into the overall top k.
+
+    INDEX_SHARDS=2 INDEX_SHARD_0_URL=http://shard-0:8000 INDEX_SHARD_1_URL=http://shard-1:8000 \
+        uvicorn shard_router:app --port 8000
+
+Each shard is an upstream for service_http, so INDEX_SHARD_0_READ_TIMEOUT etc. apply.
+"""
+import asyncio
+import os
+from typing import Any, List, Optional
+import httpx
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+
+from embedding_transport import BINARY_EMBEDDING_MEDIA_TYPES
+from models import HybridSearchBatchRequest, HybridSearchBatchResponse, SearchBatchRequest, SearchBatchResponse, \
+    SearchFilter, SearchRequest, SearchResponse, SyncResponse
+from sharding import merge_hybrid, merge_nearest
+import service_http
+import tracing
+
+
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "1"))
+SHARD_UPSTREAMS = [f"INDEX_SHARD_{i}" for i in range(INDEX_SHARDS)]
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+app = FastAPI(
+    title="Index embedding service (sharded)",
+    description="Scatter-gather search over the shards of the embedding index")
+tracing.instrument(app, "embedding-index-router")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await service_http.close_async_clients()
+
+
+def error_detail(response: httpx.Response) -> Any:
+    """
+    The "detail" of a FastAPI error response, or the body as text if it isn't one
+    (e.g. a proxy's error page).
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text
+    return body.get("detail", response.text) if isinstance(body, dict) else response.text
+
+
+async def scatter(method: str, path: str, **kwargs: Any) -> List[Any]:
+    """
+    Make the same request to every shard at once.
+    :return: Each shard's JSON response, in shard order.
+    """
+    try:
+        with tracing.span("scatter"):
+            responses = await asyncio.gather(
+                *(service_http.request(shard, method, path, **kwargs) for shard in SHARD_UPSTREAMS))
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code < 500:
+            # A bad request is bad for every shard; pass the shard's reason on
+            raise HTTPException(status_code=e.response.status_code, detail=error_detail(e.response))
+        raise HTTPException(status_code=502, detail=f"Error from an index shard: {str(e)}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Error from an index shard: {str(e)}")
+    return [r.json() for r in responses]
+
+
+def search_params(
+        top_k: Any,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        search_filter: Optional[SearchFilter]) -> dict:
+    """
+    Query parameters for a shard's /search:batch-binary.
+    """
+    params = {"top_k": top_k, "nprobe": nprobe, "ef_search": ef_search}
+    if search_filter is not None:
+        params.update(
+            transcript_id=search_filter.transcript_ids, tag=search_filter.tags,
+            exclude_transcript_id=search_filter.exclude_transcript_ids, exclude_tag=search_filter.exclude_tags)
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def merge_batches(shard_batches: List[List[List[dict]]], top_ks: List[int]) -> List[List[dict]]:
+    if len(top_ks) == 1:
+        top_ks = top_ks * len(shard_batches[0])
+    return [merge_nearest([batch[i] for batch in shard_batches], top_k) for i, top_k in enumerate(top_ks)]
+
+
+@app.get("/ping", response_model=str)
+def ping_pong():
+    return "pong"
+
+
+@app.post("/search", response_model=SearchResponse)
+async def search_embeddings(request: SearchRequest):
+    shard_responses = await scatter("POST", "/search", json=request.dict())
+    return {"results": merge_nearest([r["results"] for r in shard_responses], request.top_k)}
+
+
+@app.post("/search:batch", response_model=SearchBatchResponse)
+async def search_embeddings_batch(request: SearchBatchRequest):
+    top_k = request.top_k if isinstance(request.top_k, list) else [request.top_k]
+    shard_responses = await scatter("POST", "/search:batch", json=request.dict())
+    return {"results": merge_batches([r["results"] for r in shard_responses], top_k)}
+
+
+@app.post(
+    "/search:batch-binary",
+    response_model=SearchBatchResponse,
+    openapi_extra={"requestBody": {"content": {t: {} for t in BINARY_EMBEDDING_MEDIA_TYPES.values()}}})
+async def search_embeddings_batch_binary(
+        request: Request,
+        x_embedding_shape: str = Header(...),
+        top_k: List[int] = Query([5]),
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None):
+    """
+    The embeddings matrix and the query parameters (filter included) are passed on
+    to the shards as they are.
+    """
+    if any(k < 1 for k in top_k):
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    shard_responses = await scatter(
+        "POST", "/search:batch-binary", params=list(request.query_params.multi_items()), content=await request.body(),
+        headers={"Content-Type": request.headers.get("Content-Type", ""), "X-Embedding-Shape": x_embedding_shape})
+    return {"results": merge_batches([r["results"] for r in shard_responses], top_k)}
+
+
+@app.post("/search:hybrid", response_model=HybridSearchBatchResponse)
+async def search_hybrid(request: HybridSearchBatchRequest):
+    """
+    Each shard's BM25 candidates and (unless mode is "lexical") vector candidates
+    are merged across shards before fusing, so results match those of one index
+    holding every shard. The queries are embedded once, here.
+    """
+    top_ks = request.top_k if isinstance(request.top_k, list) else [request.top_k]
+    if len(top_ks) == 1:
+        top_ks = top_ks * len(request.queries)
+    if len(top_ks) != len(request.queries):
+        raise HTTPException(status_code=400, detail=f"Got {len(top_ks)} top_k values for {len(request.queries)} queries")
+    if not request.queries:
+        return {"results": []}
+    candidates = max(HYBRID_CANDIDATES, max(top_ks))
+    query_embeddings = None
+    if request.mode != "lexical" and request.query_embeddings is not None:
+        try:
+            query_embeddings = np.array(request.query_embeddings, dtype="<f4").reshape(len(request.queries), -1)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Bad query embeddings: {str(e)}")
+    lexical_request = {
+        "queries": request.queries, "top_k": candidates, "mode": "lexical",
+        "filter": request.filter.dict() if request.filter is not None else None}
+    if request.mode == "lexical":
+        lexical_responses = await scatter("POST", "/search:hybrid", json=lexical_request)
+        vector_batches = [[[] for _ in request.queries] for _ in SHARD_UPSTREAMS]
+    else:
+        media_type = BINARY_EMBEDDING_MEDIA_TYPES["float32"]
+        if query_embeddings is not None:
+            body, shape = query_embeddings.tobytes(), f"{query_embeddings.shape[0]},{query_embeddings.shape[1]}"
+        else:
+            with tracing.span("embed"):
+                embeddings_resp = await service_http.request(
+                    "EMBEDDING_GEN_SERVICE", "POST", "/generate-embeddings",
+                    json={"sentences": request.queries}, headers={"Accept": media_type})
+            body, shape = embeddings_resp.content, embeddings_resp.headers["X-Embedding-Shape"]
+        vector_search = scatter(
+            "POST", "/search:batch-binary",
+            params=search_params(candidates, request.nprobe, request.ef_search, request.filter),
+            content=body, headers={"Content-Type": media_type, "X-Embedding-Shape": shape})
+        lexical_responses, vector_responses = await asyncio.gather(
+            scatter("POST", "/search:hybrid", json=lexical_request), vector_search)
+        vector_batches = [r["results"] for r in vector_responses]
+    lexical_batches = [r["results"] for r in lexical_responses]
+    return {"results": [
+        merge_hybrid(
+            [batch[i] for batch in vector_batches], [batch[i] for batch in lexical_batches],
+            top_k, candidates, RRF_K)
+        for i, top_k in enumerate(top_ks)]}
+
+
+@app.post("/sync", response_model=SyncResponse)
+async def sync_embeddings():
+    """
+    Sync every shard, in parallel.
+    """
+    shard_responses = await scatter("POST", "/sync", timeout=None)
+    return {field: sum(r[field] for r in shard_responses) for field in SyncResponse.__fields__}
+
+
+@app.get("/index-info", response_model=dict)
+async def index_info():
+    shard_infos = await scatter("GET", "/index-info")
+    return {
+        "status": "healthy" if all(i["status"] == "healthy" for i in shard_infos) else "unhealthy",
+        "vector_count": sum(i.get("vector_count", 0) for i in shard_infos),
+        "transcript_count": sum(i.get("transcript_count", 0) for i in shard_infos),
+        "shards": shard_infos,
+    }
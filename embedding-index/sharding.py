@@ -0,0 +1,66 @@
+import hashlib
+import heapq
+import itertools
+from typing import Dict, List, Optional, TypedDict
+
+from lexical_index import reciprocal_rank_fusion
+
+
+class ShardSpec(TypedDict):
+    index: int
+    count: int
+
+
+def parse_shard_spec(spec: Optional[str]) -> Optional[ShardSpec]:
+    """
+    Parse INDEX_SHARD, e.g. "0/4" for the first of four shards.
+    """
+    if not spec:
+        return None
+    index, count = (int(part) for part in spec.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Bad shard {spec!r}: expected <index>/<count> with 0 <= index < count")
+    return {"index": index, "count": count}
+
+
+def shard_of(transcript_id: str, nb_shards: int) -> int:
+    # Not hash(), which is salted per process
+    digest = hashlib.md5(transcript_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") % nb_shards
+
+
+def owns(shard: Optional[ShardSpec], transcript_id: str) -> bool:
+    return shard is None or shard_of(transcript_id, shard["count"]) == shard["index"]
+
+
+def merge_nearest(shard_results: List[List[dict]], top_k: int) -> List[dict]:
+    """
+    Merge shards' search results for one query into the overall top_k. Each shard's
+    results are sorted by distance, so a heap merge of them is too.
+    """
+    return list(itertools.islice(heapq.merge(*shard_results, key=lambda r: r["distance"]), top_k))
+
+
+def merge_hybrid(
+        vector_results: List[List[dict]],
+        lexical_results: List[List[dict]],
+        top_k: int,
+        candidates: int,
+        rrf_k: int) -> List[dict]:
+    """
+    Fuse shards' vector and BM25 results for one query the way one index would: merge
+    each kind across shards into one ranking of `candidates`, then fuse the two with
+    reciprocal rank fusion. (BM25 scores use each shard's own term statistics, which
+    for shards of one corpus are close.)
+    """
+    vector = merge_nearest(vector_results, candidates)
+    lexical = list(itertools.islice(
+        heapq.merge(*lexical_results, key=lambda r: -r["bm25_score"]), candidates))
+    fused = reciprocal_rank_fusion([[r["id"] for r in vector], [r["id"] for r in lexical]], rrf_k)
+    distances: Dict[str, float] = {r["id"]: r["distance"] for r in vector}
+    bm25_scores: Dict[str, float] = {r["id"]: r["bm25_score"] for r in lexical}
+    versions: Dict[str, str] = {r["id"]: r.get("chunks_version") for r in vector + lexical}
+    return [
+        {"id": chunk_id, "score": fused[chunk_id], "distance": distances.get(chunk_id),
+         "bm25_score": bm25_scores.get(chunk_id), "chunks_version": versions.get(chunk_id)}
+        for chunk_id in sorted(fused, key=lambda chunk_id: -fused[chunk_id])[:top_k]]
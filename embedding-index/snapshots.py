@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, TypedDict
+import faiss
+
+from faiss_utils import DEFAULT_INDEX_CONFIG, FAISSIndex, IndexConfig
+from lexical_index import BM25Index
+from transcript_table import TranscriptTable
+
+
+# Layout under the index directory:
+#   snapshots/<version>/index.faiss, transcripts.tsv, transcript_slots.i32, bm25_*, manifest.json
+#   CURRENT - name of the snapshot being served
+# A snapshot is written to a temporary directory, renamed into snapshots/ once
+# complete, and only then made current by atomically replacing CURRENT, so a crash
+# at any point leaves the previous snapshot in place.
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_INDEX_FILE = "index.faiss"
+SNAPSHOT_MANIFEST_FILE = "manifest.json"
+
+
+class FileChecksum(TypedDict):
+    size: int
+    sha256: str
+
+
+class SnapshotManifest(TypedDict):
+    version: str
+    createdAt: str
+    indexConfig: IndexConfig
+    vectorCount: int
+    transcriptCount: int
+    lexicalDocumentCount: int
+    files: Dict[str, FileChecksum]
+
+
+class Snapshot(TypedDict):
+    manifest: SnapshotManifest
+    index: faiss.Index
+    table: TranscriptTable
+    lexical: Optional[BM25Index]  # None for snapshots from before there was one
+    indexPath: str
+
+
+def file_checksum(path: str) -> FileChecksum:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"size": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+
+def fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def current_version(index_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(index_dir: str, index: FAISSIndex, keep: int = 2) -> str:
+    """
+    Write the index and its transcript table as a new snapshot, switch CURRENT to it,
+    and delete all but the `keep` newest snapshots.
+    :return: The new snapshot's version.
+    """
+    snapshots_dir = os.path.join(index_dir, SNAPSHOTS_DIR)
+    os.makedirs(snapshots_dir, exist_ok=True)
+    # Versions sort by creation time
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    tmp_dir = os.path.join(snapshots_dir, f".{version}.{os.getpid()}.tmp")
+    os.makedirs(tmp_dir)
+    print(f"Writing index snapshot {version}: {index.index.ntotal} vectors, {index.transcript_count()} transcripts")
+    faiss.write_index(index.index, os.path.join(tmp_dir, SNAPSHOT_INDEX_FILE))
+    index.table().save(tmp_dir)
+    index.lexical.save(tmp_dir)
+    files = {name: file_checksum(os.path.join(tmp_dir, name)) for name in sorted(os.listdir(tmp_dir))}
+    manifest: SnapshotManifest = {
+        "version": version,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "indexConfig": index.config,
+        "vectorCount": index.index.ntotal,
+        "transcriptCount": index.transcript_count(),
+        "lexicalDocumentCount": len(index.lexical),
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, SNAPSHOT_MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    for name in os.listdir(tmp_dir):
+        fsync_path(os.path.join(tmp_dir, name))
+    os.rename(tmp_dir, os.path.join(snapshots_dir, version))
+    fsync_path(snapshots_dir)
+
+    current_tmp = os.path.join(index_dir, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_tmp, os.path.join(index_dir, CURRENT_FILE))
+    fsync_path(index_dir)
+    print(f"Index snapshot {version} is now current.")
+    prune_snapshots(index_dir, keep)
+    return version
+
+
+def prune_snapshots(index_dir: str, keep: int):
+    """
+    Delete all but the `keep` newest snapshots (never the current one). Workers still
+    serving an older, memory-mapped snapshot keep their mapping after it's deleted.
+    """
+    snapshots_dir = os.path.join(index_dir, SNAPSHOTS_DIR)
+    current = current_version(index_dir)
+    versions: List[str] = sorted(v for v in os.listdir(snapshots_dir) if not v.startswith("."))
+    for version in versions[:max(len(versions) - keep, 0)]:
+        if version != current:
+            print(f"Deleting old index snapshot {version}")
+            shutil.rmtree(os.path.join(snapshots_dir, version), ignore_errors=True)
+
+
+def load_snapshot(index_dir: str, mmap: bool = True, verify_checksums: bool = False) -> Optional[Snapshot]:
+    """
+    Load the current snapshot, if there is one. With `mmap` the index's vectors are
+    memory-mapped rather than read, so loading takes milliseconds and processes
+    serving the same snapshot share its pages.
+    """
+    version = current_version(index_dir)
+    if version is None:
+        print(f"No current index snapshot in {index_dir}.")
+        return None
+    snapshot_dir = os.path.join(index_dir, SNAPSHOTS_DIR, version)
+    print(f"Loading index snapshot {version}...")
+    with open(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST_FILE), "r") as f:
+        manifest: SnapshotManifest = json.load(f)
+    manifest.setdefault("indexConfig", DEFAULT_INDEX_CONFIG)
+    for name, expected in manifest["files"].items():
+        path = os.path.join(snapshot_dir, name)
+        # Sizes are cheap to check every time; hashing a large index isn't
+        actual = file_checksum(path) if verify_checksums else {"size": os.path.getsize(path), "sha256": expected["sha256"]}
+        if actual != expected:
+            raise ValueError(f"Index snapshot {version} is corrupt: {name} doesn't match its manifest")
+    index_path = os.path.join(snapshot_dir, SNAPSHOT_INDEX_FILE)
+    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+    table = TranscriptTable.load(snapshot_dir)
+    if table is None:
+        raise ValueError(f"Index snapshot {version} is missing its transcript table")
+    lexical = BM25Index.load(snapshot_dir)
+    print(f"Index snapshot {version} loaded: {index.ntotal} vectors, {len(table)} transcripts, "
+          f"{len(lexical) if lexical is not None else 'no'} BM25 documents.")
+    return {"manifest": manifest, "index": index, "table": table, "lexical": lexical, "indexPath": index_path}
@@ -0,0 +1,260 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+# Read by shard_router on import
+os.environ.setdefault("INDEX_SHARDS", "2")
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import HTMLResponse
+from fastapi.testclient import TestClient
+
+from faiss_utils import FAISSIndex, make_vector_ids
+from lexical_index import BM25Index
+from sharding import merge_hybrid, merge_nearest, owns, parse_shard_spec
+from snapshots import CURRENT_FILE, SNAPSHOTS_DIR, current_version, load_snapshot, write_snapshot
+from transcript_table import TRANSCRIPTS_FILE, TranscriptTable
+import service_http
+import shard_router
+
+
+DIMENSION = 8
+
+
+def make_index(transcripts: dict) -> FAISSIndex:
+    """
+    A flat index of transcripts given as {transcript_id: [chunk text, ...]}.
+    """
+    index = FAISSIndex(dimension=DIMENSION)
+    for transcript_id, texts in transcripts.items():
+        rng = np.random.default_rng(len(transcript_id))
+        index.add_transcript(
+            transcript_id, f"{transcript_id}.v1", rng.standard_normal((len(texts), DIMENSION)), texts, ["tag"])
+    index.lexical.commit()
+    return index
+
+
+class TestTranscriptTable(unittest.TestCase):
+    def setUp(self):
+        self.transcripts = {
+            "a": {"slot": 2, "chunksVersion": "a.v1", "chunkCount": 3, "tags": ["physics", "odd, tag\t"]},
+            "b": {"slot": 0, "chunksVersion": "b.v2", "chunkCount": 1, "tags": []},
+        }
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            TranscriptTable.from_transcripts(self.transcripts).save(directory)
+            table = TranscriptTable.load(directory)
+            self.assertIsInstance(table.slots, np.memmap)
+            self.assertEqual(table.to_transcripts(), self.transcripts)
+            self.assertEqual(table.slot_ids().tolist(), ["b", None, "a"])
+
+    def test_loads_tables_saved_before_tags(self):
+        with tempfile.TemporaryDirectory() as directory:
+            TranscriptTable.from_transcripts(self.transcripts).save(directory)
+            with open(os.path.join(directory, TRANSCRIPTS_FILE), "w") as f:
+                f.write("a\ta.v1\nb\tb.v2\n")
+            self.assertEqual([t["tags"] for t in TranscriptTable.load(directory).to_transcripts().values()], [[], []])
+
+    def test_empty_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(TranscriptTable.load(directory))
+            TranscriptTable.from_transcripts({}).save(directory)
+            table = TranscriptTable.load(directory)
+            self.assertEqual(len(table), 0)
+            self.assertEqual(len(table.slot_ids()), 0)
+
+    def test_mismatched_files_are_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            TranscriptTable.from_transcripts(self.transcripts).save(directory)
+            with open(os.path.join(directory, TRANSCRIPTS_FILE), "a") as f:
+                f.write("c\tc.v1\t[]\n")
+            with self.assertRaises(ValueError):
+                TranscriptTable.load(directory)
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_write_swaps_current_and_prunes(self):
+        first = write_snapshot(self.index_dir, make_index({"a": ["heat flows"]}), keep=2)
+        second = write_snapshot(self.index_dir, make_index({"a": ["heat flows"], "b": ["entropy rises"]}), keep=2)
+        third = write_snapshot(self.index_dir, make_index({"b": ["entropy rises"]}), keep=2)
+        self.assertEqual(current_version(self.index_dir), third)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.index_dir, SNAPSHOTS_DIR))), [second, third])
+        self.assertNotEqual(first, second)
+
+        snapshot = load_snapshot(self.index_dir)
+        self.assertEqual(snapshot["manifest"]["version"], third)
+        self.assertEqual(snapshot["table"].transcript_ids, ["b"])
+        self.assertEqual(snapshot["index"].ntotal, 1)
+        self.assertEqual(len(snapshot["lexical"]), 1)
+
+    def test_crash_before_current_is_replaced_keeps_previous_snapshot(self):
+        version = write_snapshot(self.index_dir, make_index({"a": ["heat flows"]}))
+        snapshots_dir = os.path.join(self.index_dir, SNAPSHOTS_DIR)
+        # A write that died half-way, and one that got as far as renaming its directory
+        os.makedirs(os.path.join(snapshots_dir, ".20990101T000000000000Z.1.tmp"))
+        shutil.copytree(os.path.join(snapshots_dir, version), os.path.join(snapshots_dir, "20990101T000000000000Z"))
+        with open(os.path.join(self.index_dir, f"{CURRENT_FILE}.1.tmp"), "w") as f:
+            f.write("20990101T000000000000Z")
+
+        snapshot = load_snapshot(self.index_dir)
+        self.assertEqual(snapshot["manifest"]["version"], version)
+        self.assertEqual(snapshot["table"].transcript_ids, ["a"])
+
+    def test_truncated_file_is_rejected(self):
+        version = write_snapshot(self.index_dir, make_index({"a": ["heat flows"]}))
+        with open(os.path.join(self.index_dir, SNAPSHOTS_DIR, version, "transcript_slots.i32"), "r+b") as f:
+            f.truncate(4)
+        with self.assertRaises(ValueError):
+            load_snapshot(self.index_dir)
+
+    def test_no_snapshot(self):
+        self.assertIsNone(current_version(self.index_dir))
+        self.assertIsNone(load_snapshot(self.index_dir))
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add(make_vector_ids(0, 2), ["heat engine efficiency", "the entropy of a heat bath"])
+        self.index.add(make_vector_ids(1, 1), ["photon energy and wavelength"])
+
+    def test_added_documents_are_pending_until_commit(self):
+        self.assertTrue(self.index.has_pending())
+        self.assertEqual(len(self.index.search("heat", 5)[0]), 0)
+        self.index.commit()
+        doc_ids, scores = self.index.search("heat engine", 5)
+        self.assertEqual(doc_ids.tolist(), make_vector_ids(0, 2).tolist())
+        self.assertGreater(scores[0], scores[1])
+
+    def test_remove_range_drops_documents_and_unused_terms(self):
+        self.index.commit()
+        first, end = make_vector_ids(1, 1)[0], make_vector_ids(2, 1)[0]
+        self.index.remove_range(int(first), int(end))
+        self.assertEqual(len(self.index.search("photon", 5)[0]), 1)
+        self.index.commit()
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn("photon", self.index.terms)
+        self.assertEqual(len(self.index.search("photon", 5)[0]), 0)
+
+    def test_remove_range_drops_pending_documents(self):
+        self.index.remove_range(*map(int, (make_vector_ids(0, 1)[0], make_vector_ids(1, 1)[0])))
+        self.index.commit()
+        self.assertEqual(self.index.search("heat", 5)[0].tolist(), [])
+
+    def test_copy_is_independent(self):
+        self.index.commit()
+        copy = self.index.copy()
+        copy.add(make_vector_ids(2, 1), ["heat death"])
+        copy.commit()
+        self.assertEqual(len(copy), 4)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(len(self.index.search("death", 5)[0]), 0)
+
+    def test_save_and_load(self):
+        self.index.commit()
+        with tempfile.TemporaryDirectory() as directory:
+            self.index.save(directory)
+            loaded = BM25Index.load(directory)
+            for query in ["heat", "entropy bath", "photon energy"]:
+                self.assertEqual(loaded.search(query, 5)[0].tolist(), self.index.search(query, 5)[0].tolist())
+
+    def test_save_refuses_pending_changes(self):
+        with tempfile.TemporaryDirectory() as directory, self.assertRaises(ValueError):
+            self.index.save(directory)
+
+
+class TestSharding(unittest.TestCase):
+    def test_parse_shard_spec(self):
+        self.assertEqual(parse_shard_spec("1/4"), {"index": 1, "count": 4})
+        self.assertIsNone(parse_shard_spec(""))
+        with self.assertRaises(ValueError):
+            parse_shard_spec("4/4")
+
+    def test_every_transcript_has_one_shard(self):
+        shards = [parse_shard_spec(f"{i}/3") for i in range(3)]
+        for transcript_id in [f"transcript{i}" for i in range(100)]:
+            self.assertEqual(sum(owns(shard, transcript_id) for shard in shards), 1)
+
+    def test_merge_nearest(self):
+        merged = merge_nearest([
+            [{"id": "a-0", "distance": 0.1}, {"id": "a-1", "distance": 0.5}],
+            [{"id": "b-0", "distance": 0.2}, {"id": "b-1", "distance": 0.3}]], 3)
+        self.assertEqual([r["id"] for r in merged], ["a-0", "b-0", "b-1"])
+
+    def test_merge_hybrid(self):
+        merged = merge_hybrid(
+            [[{"id": "a-0", "distance": 0.1, "chunks_version": "a.v1"}],
+             [{"id": "b-0", "distance": 0.2, "chunks_version": "b.v1"}]],
+            [[{"id": "b-0", "bm25_score": 3.0, "chunks_version": "b.v1"}],
+             [{"id": "c-0", "bm25_score": 1.0, "chunks_version": "c.v1"}]],
+            top_k=2, candidates=10, rrf_k=60)
+        # b-0 is in both rankings
+        self.assertEqual([r["id"] for r in merged], ["b-0", "a-0"])
+        self.assertEqual(merged[0]["distance"], 0.2)
+        self.assertEqual(merged[0]["bm25_score"], 3.0)
+        self.assertEqual(merged[0]["chunks_version"], "b.v1")
+        self.assertIsNone(merged[1]["bm25_score"])
+
+
+def fake_shard(results: list, error: bool = False) -> FastAPI:
+    shard = FastAPI()
+
+    @shard.post("/search:batch")
+    def search_batch(request: dict):
+        if error:
+            raise HTTPException(status_code=400, detail="top_k too big")
+        top_ks = request["top_k"] if isinstance(request["top_k"], list) else [request["top_k"]]
+        return {"results": [results[:k] for k in top_ks * (len(request["query_embeddings"]) // len(top_ks))]}
+    return shard
+
+
+class TestShardRouter(unittest.TestCase):
+    def route_to(self, shards: list):
+        def async_client(name: str) -> httpx.AsyncClient:
+            shard = shards[int(name.rsplit("_", 1)[1])]
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=shard), base_url="http://shard")
+        self.original_async_client = service_http.async_client
+        service_http.async_client = async_client
+        self.addCleanup(setattr, service_http, "async_client", self.original_async_client)
+        return TestClient(shard_router.app)
+
+    def test_search_batch_merges_shards(self):
+        client = self.route_to([
+            fake_shard([{"id": "a-0", "distance": 0.1}, {"id": "a-1", "distance": 0.4}]),
+            fake_shard([{"id": "b-0", "distance": 0.2}, {"id": "b-1", "distance": 0.3}])])
+        response = client.post("/search:batch", json={"query_embeddings": [[0.0] * DIMENSION] * 2, "top_k": [3, 1]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [[r["id"] for r in results] for results in response.json()["results"]], [["a-0", "b-0", "b-1"], ["a-0"]])
+
+    def test_shard_bad_request_is_passed_on(self):
+        client = self.route_to([fake_shard([], error=True), fake_shard([])])
+        response = client.post("/search:batch", json={"query_embeddings": [[0.0] * DIMENSION], "top_k": 3})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "top_k too big")
+
+    def test_non_json_shard_error_is_passed_on_as_text(self):
+        proxy = FastAPI()
+
+        @proxy.post("/search:batch")
+        def error_page():
+            return HTMLResponse("<html>Request Entity Too Large</html>", status_code=413)
+
+        client = self.route_to([proxy, fake_shard([])])
+        response = client.post("/search:batch", json={"query_embeddings": [[0.0] * DIMENSION], "top_k": 3})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["detail"], "<html>Request Entity Too Large</html>")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+from typing import Dict, List, Optional, TypedDict
+import numpy as np
+
+
+TRANSCRIPTS_FILE = "transcripts.tsv"
+SLOTS_FILE = "transcript_slots.i32"
+
+
+class IndexedTranscript(TypedDict):
+    slot: int
+    chunksVersion: str
+    chunkCount: int
+    tags: List[str]
+
+
+class TranscriptTable:
+    """
+    Compact form of the transcripts an index holds, as saved next to it:
+    `transcripts.tsv` has one "{transcript_id}\\t{chunks_version}\\t{JSON list of tags}"
+    line per transcript (tables saved before tags have no third column) and
+    `transcript_slots.i32` the matching (slot, chunk count) rows as little-endian
+    int32, read through a memory map.
+
+    Search only needs the transcript ID of each slot, so that is all `slot_ids()`
+    builds; the per-transcript dicts sync works with are only materialized by
+    `to_transcripts()`.
+    """
+    def __init__(
+            self,
+            transcript_ids: List[str],
+            chunks_versions: List[str],
+            slots: np.ndarray,
+            tags: Optional[List[List[str]]] = None):
+        self.transcript_ids = transcript_ids
+        self.chunks_versions = chunks_versions
+        self.slots = slots  # (number of transcripts, 2): slot, chunk count
+        self.tags = tags if tags is not None else [[] for _ in transcript_ids]
+
+    def __len__(self) -> int:
+        return len(self.transcript_ids)
+
+    @classmethod
+    def from_transcripts(cls, transcripts: Dict[str, IndexedTranscript]) -> "TranscriptTable":
+        slots = np.array([(t["slot"], t["chunkCount"]) for t in transcripts.values()], dtype="<i4")
+        # Manifests from before tags list transcripts without them
+        return cls(
+            list(transcripts), [t["chunksVersion"] for t in transcripts.values()], slots.reshape(-1, 2),
+            [t.get("tags", []) for t in transcripts.values()])
+
+    def to_transcripts(self) -> Dict[str, IndexedTranscript]:
+        return {
+            tid: {"slot": slot, "chunksVersion": version, "chunkCount": count, "tags": tags}
+            for tid, version, (slot, count), tags in zip(
+                self.transcript_ids, self.chunks_versions, self.slots.tolist(), self.tags)
+        }
+
+    def slot_ids(self) -> np.ndarray:
+        """
+        :return: Object array mapping each slot to its transcript ID (None for free slots).
+        """
+        slot_ids = np.full(int(self.slots[:, 0].max()) + 1 if len(self) else 0, None, dtype=object)
+        slot_ids[self.slots[:, 0]] = self.transcript_ids
+        return slot_ids
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, TRANSCRIPTS_FILE), "w") as f:
+            f.writelines(
+                f"{tid}\t{version}\t{json.dumps(tags)}\n"
+                for tid, version, tags in zip(self.transcript_ids, self.chunks_versions, self.tags))
+        with open(os.path.join(directory, SLOTS_FILE), "wb") as f:
+            f.write(np.ascontiguousarray(self.slots, dtype="<i4").tobytes())
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["TranscriptTable"]:
+        transcripts_path = os.path.join(directory, TRANSCRIPTS_FILE)
+        slots_path = os.path.join(directory, SLOTS_FILE)
+        if not (os.path.exists(transcripts_path) and os.path.exists(slots_path)):
+            return None
+        with open(transcripts_path, "r") as f:
+            rows = [line.rstrip("\n").split("\t", 2) for line in f]
+        nb_rows = os.path.getsize(slots_path) // 8
+        if nb_rows != len(rows):
+            raise ValueError(f"{slots_path} has {nb_rows} rows but {transcripts_path} has {len(rows)}")
+        # np.memmap can't map an empty file
+        slots = np.memmap(slots_path, dtype="<i4", mode="r", shape=(nb_rows, 2)) if nb_rows \
+            else np.empty((0, 2), dtype="<i4")
+        return cls(
+            [r[0] for r in rows], [r[1] for r in rows], slots,
+            [json.loads(r[2]) if len(r) > 2 else [] for r in rows])
@@ -1,41 +1,57 @@
-from fastapi import FastAPI, HTTPException
-from typing_extensions import List, TypedDict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing_extensions import AsyncIterator, List, NotRequired, TypedDict, Optional, Tuple
+import asyncio
 import json
 import base64
+import glob
 import os
 import binascii
 import logging
 
+from question_index import IndexedQuestion, NoteSources, NotesWatcher, QuestionIndex
+import tracing
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+NOTES_DIR = os.getenv("NOTES_DIR", "/notes/")
+# Files read at once by bulk requests
+NOTES_READ_THREADS = int(os.getenv("NOTES_READ_THREADS", "8"))
+read_executor = ThreadPoolExecutor(max_workers=NOTES_READ_THREADS, thread_name_prefix="notes-read")
+
+question_index = QuestionIndex(NOTES_DIR, os.getenv("NOTES_INDEX_PATH", "question_index/questions.sqlite3"))
+notes_watcher = NotesWatcher(
+    question_index,
+    # inotify events don't cross some bind mounts (e.g. from macOS); "poll" then
+    use_inotify=os.getenv("NOTES_WATCH_MODE", "inotify") == "inotify",
+    poll_interval=float(os.getenv("NOTES_POLL_INTERVAL", "2")),
+    rescan_interval=float(os.getenv("NOTES_RESCAN_INTERVAL", "60")))
+
+
 app = FastAPI(
     title="Notes service",
     description="Service for dealing with user's notes files. ATOW just for parsing questions out of notes files.")
+tracing.instrument(app, "notes-service", gauges=lambda: {"notes_question_index_seq": question_index.latest_seq()})
 
 
-def parse_single_star_lines(file_path: str) -> list[Tuple[int, str]]:
-    """
-    Parses a .txt file and returns lines where the first non-whitespace character
-    is a single '*' character. Skips lines where multiple contiguous '*' appear.
+@app.on_event("startup")
+def on_startup():
+    changed = question_index.scan()
+    print(f"Question index up to date ({changed} question(s) changed since it was last saved)")
+    notes_watcher.start()
 
-    Args:
-        file_path (str): The path to the .txt file.
 
-    Returns:
-        list[str]: A list of lines matching the criteria.
-    """
-    result = []
-    with open(file_path, "r") as file:
-        for i, line in enumerate(file):
-            stripped_line = line.lstrip()  # Remove leading whitespace
-            if stripped_line.startswith("*") and not stripped_line.startswith("**"):
-                result.append((i, line.strip()))
-    return result
+@app.on_event("shutdown")
+def on_shutdown():
+    notes_watcher.stop()
+
 
 class FileQuestion(TypedDict):
+    id: str  # Stays the same as lines are added around the question or it's reworded
     text: str
     line_index: int
 
@@ -43,6 +59,16 @@ class FileQuestion(TypedDict):
 class FileQuestionsResponse(TypedDict):
     file_path: str
     questions: List[FileQuestion]
+    # The transcripts the file's "#+SOURCES:" lines restrict its questions to, if any
+    sources: Optional[NoteSources]
+
+
+class ChangedQuestionsResponse(TypedDict):
+    # Pass as `since` to get the changes after these
+    cursor: int
+    # Whether there are more changes after `cursor` already
+    more: bool
+    changes: List[IndexedQuestion]
 
 
 @app.get("/ping")
@@ -50,20 +76,103 @@ def ping_pong():
     return "pong"
 
 
+class BulkQuestionsRequest(TypedDict):
+    # Relative to the notes directory; either or both
+    paths: NotRequired[List[str]]
+    glob: NotRequired[str]  # e.g. "physics/**/*.txt"
+
+
+def notes_path(rel_path: str) -> Optional[str]:
+    """
+    The path relative to the notes directory, or None if it's outside it.
+    """
+    full_path = os.path.realpath(os.path.join(NOTES_DIR, rel_path))
+    notes_dir = os.path.realpath(NOTES_DIR)
+    if os.path.commonpath([full_path, notes_dir]) != notes_dir:
+        return None
+    return os.path.relpath(full_path, notes_dir)
+
+
+def file_questions(rel_path: str) -> FileQuestionsResponse:
+    # Just a stat if the watcher has already picked up the latest save
+    with tracing.span("refresh"):
+        question_index.refresh_file(rel_path)
+    return {
+        "file_path": os.path.join(NOTES_DIR, rel_path),
+        "questions": [
+            {"id": q["id"], "text": q["text"], "line_index": q["line_index"]}
+            for q in question_index.file_questions(rel_path)],
+        "sources": question_index.file_sources(rel_path),
+    }
+
+
 @app.get("/questions")
 async def get_file_questions(file_path: str) -> FileQuestionsResponse:
     try:
         decoded_path = base64.b64decode(file_path).decode("utf-8")
-        full_path = os.path.join("/notes/", decoded_path)
+        rel_path = notes_path(decoded_path)
+        if rel_path is None:
+            raise HTTPException(status_code=400, detail=f"Path is outside the notes directory: {decoded_path}")
+        full_path = os.path.join(NOTES_DIR, rel_path)
         
-        if not os.path.exists(full_path):
+        if not os.path.isfile(full_path):
             logger.error(f"File don't exist: {full_path}")
             raise HTTPException(status_code=400, detail="File does not exist")
-        starred_lines = parse_single_star_lines(full_path)
-        return {
-            "file_path": full_path,
-            "questions": [{"text": l[1], "line_index": l[0]} for l in starred_lines]
-        }
+        return file_questions(rel_path)
     except (binascii.Error, UnicodeDecodeError) as e:
         logger.error(f"Failed to decode Base64 file path: {file_path}. Error: {e}")
         raise HTTPException(status_code=400, detail="Invalid Base64-encoded file path")
+
+
+@app.post("/questions:bulk")
+async def get_bulk_questions(body: BulkQuestionsRequest):
+    """
+    Questions for many files at once: the listed `paths` plus the files matching
+    `glob`. Files are read in parallel and streamed back as newline-delimited JSON,
+    one /questions response per file in the order they're read, or
+    {"file_path": ..., "error": ...} for a file that couldn't be.
+    """
+    requested = list(body.get("paths", []))
+    if "glob" in body:
+        requested += [
+            os.path.relpath(p, NOTES_DIR)
+            for p in glob.glob(os.path.join(NOTES_DIR, body["glob"]), recursive=True) if os.path.isfile(p)]
+    rel_paths = []
+    for requested_path in dict.fromkeys(requested):
+        rel_path = notes_path(requested_path)
+        if rel_path is None:
+            raise HTTPException(status_code=400, detail=f"Path is outside the notes directory: {requested_path}")
+        rel_paths.append(rel_path)
+
+    def read(rel_path: str) -> dict:
+        if not os.path.isfile(os.path.join(NOTES_DIR, rel_path)):
+            return {"file_path": os.path.join(NOTES_DIR, rel_path), "error": "File does not exist"}
+        try:
+            return file_questions(rel_path)
+        except Exception as e:
+            logger.error(f"Failed to read questions from {rel_path}: {e}")
+            return {"file_path": os.path.join(NOTES_DIR, rel_path), "error": str(e)}
+
+    async def lines() -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        for done in asyncio.as_completed([loop.run_in_executor(read_executor, read, p) for p in rel_paths]):
+            yield json.dumps(await done) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/questions/changed-since")
+def get_changed_questions(since: int = 0, limit: int = Query(1000, ge=1)) -> ChangedQuestionsResponse:
+    """
+    Questions added, edited, moved or deleted anywhere in the notes since change
+    `since`, oldest first. Deleted questions are returned once with change "deleted".
+    With since=0 this lists every question (and deletion) in the notes.
+    """
+    changes = question_index.changed_since(since, limit + 1)
+    more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        "cursor": changes[-1]["seq"] if changes else max(since, question_index.latest_seq()),
+        "more": more,
+        "changes": changes
+    }
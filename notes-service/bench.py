@@ -0,0 +1,135 @@
+"""
+Benchmarks for reading questions out of notes files, run against a synthetic notes
+tree (10k files by default, with a few large ones):
+
+    python bench.py [parse] [bulk] [--files N]
+
+`parse` reads every file with the old per-line lstrip/startswith loop and with
+the find-based scan now in parse_single_star_lines, one file after another.
+
+`bulk` gets every file's questions through the app (with starlette's TestClient,
+so without network latency, which would only widen the gap): one GET /questions
+per file against one POST /questions:bulk with a glob, each against a fresh
+question index (every file parsed) and an up-to-date one (every file just
+stat-ed).
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from question_index import parse_single_star_lines
+
+
+WORDS = "the a of to in is that it for on with as was by an be this which or from at energy model".split()
+
+
+def make_notes_tree(directory: str, nb_files: int, seed: int = 0):
+    """
+    `nb_files` notes files of 20-400 lines spread over 100 directories, about 5% of
+    their lines questions, plus one large file per 2,500.
+    """
+    rng = random.Random(seed)
+    for i in range(nb_files):
+        subdir = os.path.join(directory, f"topic{i % 100}")
+        os.makedirs(subdir, exist_ok=True)
+        nb_lines = 20_000 if i % 2500 == 0 else rng.randint(20, 400)
+        lines = []
+        for _ in range(nb_lines):
+            text = " ".join(rng.choices(WORDS, k=rng.randint(3, 15)))
+            roll = rng.random()
+            if roll < 0.05:
+                lines.append("  " * rng.randint(0, 2) + f"* {text}?")
+            elif roll < 0.08:
+                lines.append(f"** {text}")
+            else:
+                lines.append(text)
+        with open(os.path.join(subdir, f"notes{i}.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def parse_single_star_lines_loop(file_path: str) -> List[Tuple[int, str]]:
+    # The parser before the find-based scan
+    result = []
+    with open(file_path, "r") as file:
+        for i, line in enumerate(file):
+            stripped_line = line.lstrip()
+            if stripped_line.startswith("*") and not stripped_line.startswith("**"):
+                result.append((i, line.strip()))
+    return result
+
+
+def notes_files(directory: str) -> List[str]:
+    return sorted(os.path.join(root, name) for root, _, files in os.walk(directory) for name in files)
+
+
+def bench_parse(directory: str) -> List[Dict]:
+    paths = notes_files(directory)
+    rows = []
+    print("%-8s %10s %12s" % ("parser", "seconds", "questions"))
+    for name, parse in [("loop", parse_single_star_lines_loop), ("find", parse_single_star_lines)]:
+        start = time.perf_counter()
+        nb_questions = sum(len(parse(p)) for p in paths)
+        row = {"parser": name, "seconds": time.perf_counter() - start, "questions": nb_questions}
+        rows.append(row)
+        print("%(parser)-8s %(seconds)10.2f %(questions)12d" % row)
+    # Same questions, same line indexes
+    assert all(parse_single_star_lines_loop(p) == parse_single_star_lines(p) for p in paths[:200])
+    return rows
+
+
+def bench_bulk(directory: str) -> List[Dict]:
+    from fastapi.testclient import TestClient
+    paths = [os.path.relpath(p, directory) for p in notes_files(directory)]
+    rows = []
+    print("%-10s %-8s %10s %12s" % ("requests", "index", "seconds", "questions"))
+    for mode in ["per-file", "bulk"]:
+        index_dir = tempfile.mkdtemp()
+        os.environ["NOTES_DIR"] = directory
+        os.environ["NOTES_INDEX_PATH"] = os.path.join(index_dir, "questions.sqlite3")
+        sys.modules.pop("app", None)
+        import app
+        # Not entered as a context manager, so startup (the full scan) doesn't run
+        client = TestClient(app.app)
+        for index_state in ["cold", "warm"]:
+            start = time.perf_counter()
+            if mode == "per-file":
+                nb_questions = sum(
+                    len(client.get("/questions", params={"file_path": base64.b64encode(p.encode()).decode()})
+                        .json()["questions"])
+                    for p in paths)
+            else:
+                nb_questions = 0
+                with client.stream("POST", "/questions:bulk", json={"glob": "**/*.txt"}) as resp:
+                    for line in resp.iter_lines():
+                        if line:
+                            nb_questions += len(json.loads(line)["questions"])
+            row = {
+                "requests": mode, "index": index_state,
+                "seconds": time.perf_counter() - start, "questions": nb_questions}
+            rows.append(row)
+            print("%(requests)-10s %(index)-8s %(seconds)10.2f %(questions)12d" % row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=["parse", "bulk"])
+    parser.add_argument("--files", type=int, default=10_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as notes_dir:
+        start = time.perf_counter()
+        make_notes_tree(notes_dir, args.files)
+        print(f"Made {args.files} notes files in {time.perf_counter() - start:.1f}s")
+        for scenario in args.scenarios:
+            if scenario == "parse":
+                bench_parse(notes_dir)
+            elif scenario == "bulk":
+                bench_bulk(notes_dir)
+            else:
+                raise SystemExit(f"Unknown scenario: {scenario}")
@@ -0,0 +1,440 @@
+import difflib
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing_extensions import Dict, Iterator, List, Literal, Optional, Set, Tuple, TypedDict, Union
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Fall back to polling
+    FileSystemEventHandler = object
+    Observer = None
+
+
+# Files at least this big are memory-mapped rather than read into memory
+MMAP_THRESHOLD = int(os.getenv("NOTES_MMAP_THRESHOLD", str(1 << 20)))
+
+
+def parse_single_star_lines(file_path: str) -> list[Tuple[int, str]]:
+    """
+    Parses a .txt file and returns lines where the first non-whitespace character
+    is a single '*' character. Skips lines where multiple contiguous '*' appear.
+
+    Args:
+        file_path (str): The path to the .txt file.
+
+    Returns:
+        list[Tuple[int, str]]: The matching lines' indexes and stripped text.
+    """
+    with notes_file_data(file_path) as data:
+        return find_single_star_lines(data)
+
+
+def parse_notes_file(file_path: str) -> Tuple[List[Tuple[int, str]], Optional["NoteSources"]]:
+    """
+    Parse a notes file's questions and "#+SOURCES:" lines from one read of it.
+    """
+    with notes_file_data(file_path) as data:
+        return find_single_star_lines(data), find_sources(data)
+
+
+@contextmanager
+def notes_file_data(file_path: str) -> Iterator[Union[bytes, mmap.mmap]]:
+    """
+    A file's contents, memory-mapped if it's big.
+    """
+    with open(file_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        # mmap can't map an empty file
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size >= max(MMAP_THRESHOLD, 1) \
+            else file.read()
+    try:
+        yield data
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def find_single_star_lines(data: Union[bytes, mmap.mmap]) -> List[Tuple[int, str]]:
+    """
+    parse_single_star_lines on a file's contents. Rather than going line by line,
+    this jumps from one '*' to the next (with bytes.find, i.e. memchr) and only
+    looks at the lines they're on, so most of the file is never decoded. What's
+    before a '*' is decoded to be stripped, so Unicode whitespace (e.g. no-break or
+    full-width spaces) counts as indentation, as with str.lstrip().
+    """
+    result: List[Tuple[int, str]] = []
+    line_index, counted_to, pos = 0, 0, 0
+    while True:
+        star = data.find(b"*", pos)
+        if star < 0:
+            break
+        line_start = data.rfind(b"\n", 0, star) + 1
+        line_end = data.find(b"\n", star)
+        if line_end < 0:
+            line_end = len(data)
+        indent = data[line_start:star]
+        if not (indent if indent.isascii() else indent.decode("utf-8")).strip() and data[star + 1:star + 2] != b"*":
+            # mmap has no count(); slicing it copies, but only up to this line
+            line_index += (
+                data.count(b"\n", counted_to, line_start) if isinstance(data, bytes)
+                else data[counted_to:line_start].count(b"\n"))
+            counted_to = line_start
+            result.append((line_index, data[line_start:line_end].decode("utf-8").strip()))
+        pos = line_end + 1
+    return result
+
+
+class NoteSources(TypedDict):
+    # Which transcripts a notes file's questions are answered from, as the embedding
+    # index's search filter: the listed transcripts and those with any of the tags
+    # (all if neither is given), minus the excluded ones
+    transcript_ids: Optional[List[str]]
+    tags: Optional[List[str]]
+    exclude_transcript_ids: Optional[List[str]]
+    exclude_tags: Optional[List[str]]
+
+
+SOURCES_KEYWORD = "#+sources:"
+
+
+def parse_sources(file_path: str) -> Optional[NoteSources]:
+    with notes_file_data(file_path) as data:
+        return find_sources(data)
+
+
+def find_sources(data: Union[bytes, mmap.mmap]) -> Optional[NoteSources]:
+    """
+    Parses a notes file's "#+SOURCES:" lines (org-mode keyword syntax, any case,
+    anywhere in the file), e.g.
+
+        #+SOURCES: tag:thermodynamics PLSjqHtyw3E -tag:intro -transcript:dQw4w9WgXcQ
+
+    Each word is a transcript ID, or a tag with "tag:"; a leading "-" excludes it.
+    Like find_single_star_lines, this only decodes the lines with a "#+" on them.
+
+    Returns:
+        The sources, or None if the file doesn't declare any.
+    """
+    words: List[str] = []
+    pos = 0
+    while True:
+        keyword = data.find(b"#+", pos)
+        if keyword < 0:
+            break
+        line_start = data.rfind(b"\n", 0, keyword) + 1
+        line_end = data.find(b"\n", keyword)
+        if line_end < 0:
+            line_end = len(data)
+        line = data[line_start:line_end].decode("utf-8").strip()
+        if line.lower().startswith(SOURCES_KEYWORD):
+            words += line[len(SOURCES_KEYWORD):].split()
+        pos = line_end + 1
+    if not words:
+        return None
+    fields: Dict[str, List[str]] = {}
+    for word in words:
+        exclude = word.startswith("-")
+        word = word.lstrip("-")
+        if word.startswith("tag:"):
+            field, value = ("exclude_tags" if exclude else "tags"), word[len("tag:"):]
+        else:
+            field = "exclude_transcript_ids" if exclude else "transcript_ids"
+            value = word[len("transcript:"):] if word.startswith("transcript:") else word
+        fields.setdefault(field, []).append(value)
+    return {
+        "transcript_ids": fields.get("transcript_ids"), "tags": fields.get("tags"),
+        "exclude_transcript_ids": fields.get("exclude_transcript_ids"), "exclude_tags": fields.get("exclude_tags")}
+
+
+ChangeKind = Literal["added", "edited", "moved", "deleted"]
+
+
+class IndexedQuestion(TypedDict):
+    id: str
+    file_path: str  # Relative to the notes directory
+    text: str
+    line_index: int
+    seq: int  # Position in the change log; bumped whenever the question changes
+    change: ChangeKind  # What its last change was
+
+
+def match_questions(old_texts: List[str], new_texts: List[str]) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Pair up a file's questions before and after an edit, so a question keeps its
+    identity when lines around it are added or removed, or when it's reworded in
+    place. Unchanged questions are matched by their text in order; within each run
+    of changed questions, old and new ones are paired by position and the rest were
+    deleted or added.
+    :return: (old index, new index) pairs, with None for an added or deleted question.
+    """
+    pairs: List[Tuple[Optional[int], Optional[int]]] = []
+    matcher = difflib.SequenceMatcher(a=old_texts, b=new_texts, autojunk=False)
+    for op, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+        if op == "equal":
+            pairs.extend(zip(range(a_start, a_end), range(b_start, b_end)))
+            continue
+        paired = min(a_end - a_start, b_end - b_start)
+        pairs.extend(zip(range(a_start, a_start + paired), range(b_start, b_start + paired)))
+        pairs.extend((a, None) for a in range(a_start + paired, a_end))
+        pairs.extend((None, b) for b in range(b_start + paired, b_end))
+    return pairs
+
+
+class QuestionIndex:
+    """
+    Persistent index of the questions in every file under the notes directory, in a
+    SQLite file. Each file is re-parsed only when its modification time or size
+    changes. Every change to a question (including its deletion, which leaves a
+    tombstone) gives it the next sequence number, so consumers can ask for what's
+    changed since the last sequence number they saw.
+    """
+    def __init__(self, notes_dir: str, path: str):
+        self.notes_dir = notes_dir
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            # Each file's update is its own transaction; don't fsync every one
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, sources TEXT)")
+            if "sources" not in [row[1] for row in self._db.execute("PRAGMA table_info(files)")]:
+                # Indexed before sources were: forget the files' stamps so they're re-read
+                self._db.execute("ALTER TABLE files ADD COLUMN sources TEXT")
+                self._db.execute("UPDATE files SET mtime_ns = NULL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                " id TEXT PRIMARY KEY, file_path TEXT, text TEXT, line_index INTEGER,"
+                " seq INTEGER, change TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS questions_by_seq ON questions (seq)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS questions_by_file ON questions (file_path, line_index)")
+
+    def latest_seq(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM questions").fetchone()[0]
+
+    def notes_files(self) -> Set[str]:
+        paths = set()
+        for root, dirs, files in os.walk(self.notes_dir):
+            # Skip hidden directories and files (.git, editor lock files, ...)
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if not name.startswith("."):
+                    paths.add(os.path.relpath(os.path.join(root, name), self.notes_dir))
+        return paths
+
+    def scan(self) -> int:
+        """
+        Bring the whole index up to date: re-parse new and modified files and drop
+        deleted ones.
+        :return: How many questions changed.
+        """
+        with self._lock:
+            indexed = {row[0] for row in self._db.execute("SELECT path FROM files")}
+        changed = 0
+        for rel_path in self.notes_files() | indexed:
+            changed += self.refresh_file(rel_path)
+        return changed
+
+    def refresh_file(self, rel_path: str) -> int:
+        """
+        Re-parse one file if it's changed since it was indexed.
+        :return: How many of its questions changed.
+        """
+        full_path = os.path.join(self.notes_dir, rel_path)
+        try:
+            stat = os.stat(full_path)
+            stamp: Optional[Tuple[int, int]] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        with self._lock:
+            row = self._db.execute("SELECT mtime_ns, size FROM files WHERE path = ?", (rel_path,)).fetchone()
+        if stamp == (tuple(row) if row else None):
+            return 0
+        parsed: List[Tuple[int, str]] = []
+        sources: Optional[NoteSources] = None
+        if stamp is not None:
+            try:
+                parsed, sources = parse_notes_file(full_path)
+            except (UnicodeDecodeError, IsADirectoryError):
+                # Not a notes file; index it as having no questions so it isn't re-read
+                parsed, sources = [], None
+            except FileNotFoundError:
+                stamp = None
+        return self._update_file(rel_path, stamp, parsed, sources)
+
+    def _update_file(
+            self,
+            rel_path: str,
+            stamp: Optional[Tuple[int, int]],
+            parsed: List[Tuple[int, str]],
+            sources: Optional[NoteSources] = None) -> int:
+        with self._lock, self._db:
+            old = self._db.execute(
+                "SELECT id, text, line_index FROM questions WHERE file_path = ? AND change != 'deleted'"
+                " ORDER BY line_index", (rel_path,)).fetchall()
+            seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM questions").fetchone()[0]
+            changed = 0
+            for old_i, new_i in match_questions([q[1] for q in old], [q[1] for q in parsed]):
+                if new_i is None:
+                    change: ChangeKind = "deleted"
+                    question_id, text, line_index = old[old_i]
+                elif old_i is None:
+                    change = "added"
+                    question_id = uuid.uuid4().hex
+                    line_index, text = parsed[new_i]
+                else:
+                    question_id, old_text, old_line_index = old[old_i]
+                    line_index, text = parsed[new_i]
+                    if text != old_text:
+                        change = "edited"
+                    elif line_index != old_line_index:
+                        change = "moved"
+                    else:
+                        continue
+                seq += 1
+                changed += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO questions (id, file_path, text, line_index, seq, change)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (question_id, rel_path, text, line_index, seq, change))
+            if stamp is None:
+                self._db.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO files (path, mtime_ns, size, sources) VALUES (?, ?, ?, ?)",
+                    (rel_path, *stamp, json.dumps(sources) if sources is not None else None))
+        return changed
+
+    def file_questions(self, rel_path: str) -> List[IndexedQuestion]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, file_path, text, line_index, seq, change FROM questions"
+                " WHERE file_path = ? AND change != 'deleted' ORDER BY line_index", (rel_path,)).fetchall()
+        return [self._question(row) for row in rows]
+
+    def file_sources(self, rel_path: str) -> Optional[NoteSources]:
+        with self._lock:
+            row = self._db.execute("SELECT sources FROM files WHERE path = ?", (rel_path,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def changed_since(self, seq: int, limit: int) -> List[IndexedQuestion]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, file_path, text, line_index, seq, change FROM questions"
+                " WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)).fetchall()
+        return [self._question(row) for row in rows]
+
+    @staticmethod
+    def _question(row: tuple) -> IndexedQuestion:
+        question_id, file_path, text, line_index, seq, change = row
+        return {
+            "id": question_id, "file_path": file_path, "text": text,
+            "line_index": line_index, "seq": seq, "change": change}
+
+
+class _DirtyPaths(FileSystemEventHandler):
+    def __init__(self, watcher: "NotesWatcher"):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            if event.event_type in ("moved", "deleted"):
+                # Every file under it moved too; rescan rather than list them
+                self.watcher.request_scan()
+            return
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path:
+                self.watcher.mark_dirty(os.path.relpath(path, self.watcher.index.notes_dir))
+
+
+class NotesWatcher:
+    """
+    Keeps a QuestionIndex up to date in a background thread. With watchdog installed
+    (and `use_inotify`), files are re-parsed shortly after the filesystem reports a
+    change to them, and the whole tree is rescanned every `rescan_interval` seconds
+    in case an event was missed (bind mounts from macOS don't deliver inotify
+    events). Otherwise the tree is polled every `poll_interval` seconds.
+    """
+    def __init__(
+            self,
+            index: QuestionIndex,
+            use_inotify: bool = True,
+            poll_interval: float = 2.0,
+            rescan_interval: float = 60.0,
+            debounce: float = 0.2):
+        self.index = index
+        self.use_inotify = use_inotify and Observer is not None
+        self.rescan_interval = rescan_interval if self.use_inotify else poll_interval
+        self.debounce = debounce
+        self._dirty: Set[str] = set()
+        self._scan_requested = False
+        self._dirty_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+
+    def mark_dirty(self, rel_path: str):
+        if rel_path.startswith(".") or "/." in rel_path:
+            return
+        with self._dirty_lock:
+            self._dirty.add(rel_path)
+        self._wake.set()
+
+    def request_scan(self):
+        with self._dirty_lock:
+            self._scan_requested = True
+        self._wake.set()
+
+    def start(self):
+        if self.use_inotify:
+            self._observer = Observer()
+            self._observer.schedule(_DirtyPaths(self), self.index.notes_dir, recursive=True)
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="notes-watcher", daemon=True)
+        self._thread.start()
+        print(f"Watching {self.index.notes_dir} for changes "
+              f"({'inotify' if self.use_inotify else f'polling every {self.rescan_interval}s'})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.rescan_interval)
+            if self._stop.is_set():
+                return
+            try:
+                if woken:
+                    # Editors save in several steps; let them finish
+                    self._stop.wait(self.debounce)
+                    self._wake.clear()
+                    with self._dirty_lock:
+                        dirty, self._dirty = self._dirty, set()
+                        scan, self._scan_requested = self._scan_requested, False
+                    if scan and self.index.scan():
+                        print("Question index updated by a rescan")
+                    for rel_path in dirty:
+                        changed = self.index.refresh_file(rel_path)
+                        if changed:
+                            print(f"Question index: {changed} question(s) changed in {rel_path}")
+                elif self.index.scan():
+                    print("Question index updated by a rescan")
+            except Exception as e:
+                print(f"Error updating the question index: {e}")
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+import question_index
+from question_index import parse_notes_file, parse_single_star_lines
+
+
+class TestParseNotesFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text: str) -> str:
+        file_path = os.path.join(self.directory.name, "notes.txt")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return file_path
+
+    def test_single_star_lines(self):
+        file_path = self.write("Intro * not a question\n* First?\n** Heading\n  * Indented?\n*\n")
+        self.assertEqual(parse_single_star_lines(file_path), [(1, "* First?"), (3, "* Indented?"), (4, "*")])
+
+    def test_unicode_whitespace_indents_questions(self):
+        """
+        Test that no-break and full-width spaces before the '*' count as indentation,
+        as they do for str.lstrip().
+        """
+        file_path = self.write("Notes\n\u00a0* After a no-break space?\n\u3000\u3000* After full-width spaces?\n\u00e9 * Not one\n")
+        self.assertEqual(
+            parse_single_star_lines(file_path),
+            [(1, "* After a no-break space?"), (2, "* After full-width spaces?")])
+
+    def test_memory_mapped_file_parses_the_same(self):
+        file_path = self.write("#+SOURCES: tag:physics abc -tag:intro\n * Why?\n" + "filler line\n" * 100 + "* How?\n")
+        read = parse_notes_file(file_path)
+        threshold = question_index.MMAP_THRESHOLD
+        question_index.MMAP_THRESHOLD = 1
+        try:
+            self.assertEqual(parse_notes_file(file_path), read)
+        finally:
+            question_index.MMAP_THRESHOLD = threshold
+        self.assertEqual(read[0], [(1, "* Why?"), (102, "* How?")])
+        self.assertEqual(read[1], {
+            "transcript_ids": ["abc"], "tags": ["physics"], "exclude_transcript_ids": None, "exclude_tags": ["intro"]})
+
+    def test_empty_file(self):
+        self.assertEqual(parse_notes_file(self.write("")), ([], None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing_extensions import Dict, List, Optional, TypedDict
+
+
+LOOKUP_BATCH_SIZE = 500
+
+
+class CachedAnswer(TypedDict):
+    question: str
+    chunks: List[dict]  # TranscriptChunk JSON, as used in the prompt
+    answer: str
+    createdAt: float
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def answer_key(
+        question: str,
+        chunk_ids: List[str],
+        chunks_versions: List[Optional[str]],
+        prompt_version: int,
+        model: str) -> str:
+    """
+    Hash of everything an answer depends on: the question, the chunks retrieved for
+    it (in order) and their transcripts' chunks versions - chunk IDs are positions
+    in a transcript, so an edited transcript reuses them for new text - the prompt
+    template and the model.
+    """
+    payload = json.dumps([normalize_question(question), chunk_ids, chunks_versions, prompt_version, model])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Persistent cache of LLM answers in a SQLite file, keyed by `answer_key`.
+    """
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, question TEXT, chunks TEXT, answer TEXT, created_at REAL)")
+        self.lookups = 0
+        self.hits = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, CachedAnswer]:
+        rows = []
+        with self._lock:
+            # In batches, to stay under SQLite's limit on query parameters
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + LOOKUP_BATCH_SIZE]
+                rows += self._db.execute(
+                    "SELECT key, question, chunks, answer, created_at FROM answers"
+                    f" WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+            self.lookups += len(keys)
+            self.hits += len(rows)
+        return {
+            key: {"question": question, "chunks": json.loads(chunks), "answer": answer, "createdAt": created_at}
+            for key, question, chunks, answer, created_at in rows
+        }
+
+    def put(self, key: str, question: str, chunks: List[dict], answer: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (key, question, chunks, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, question, json.dumps(chunks), answer, time.time()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            return {
+                "entries": entries,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            }
@@ -1,45 +1,40 @@
+import asyncio
 import base64
 from fastapi import FastAPI, HTTPException
-from typing_extensions import List, TypedDict, Optional, Tuple
+from fastapi.responses import StreamingResponse
+from typing_extensions import AsyncIterator, Callable, Dict, List, NotRequired, Tuple, TypedDict, Optional
 import json
 import os
+import traceback
 
-from ollama_client import prompt_ollama
-
-from notes_service_client import FileQuestionsResponse, FileQuestion
-import notes_service_client
-notes_client = notes_service_client.ApiClient(
-    configuration=notes_service_client.Configuration(host=os.getenv("NOTES_SERVICE_URL")))
-notes_api = notes_service_client.DefaultApi(notes_client)
-
-import embedding_index_service_client 
-embedding_index_client = embedding_index_service_client.ApiClient(
-    configuration=embedding_index_service_client.Configuration(host=os.getenv("EMBEDDING_INDEX_SERVICE_URL")))
-embedding_index_api = embedding_index_service_client.DefaultApi(embedding_index_client)
-
-import embedding_gen_service_client 
-embedding_gen_client = embedding_gen_service_client.ApiClient(
-    configuration=embedding_gen_service_client.Configuration(
-        host=os.getenv("EMBEDDING_GEN_SERVICE_URL")))
-embedding_gen_api = embedding_gen_service_client.DefaultApi(embedding_gen_client)
-
+from answer_cache import AnswerCache, answer_key
+from ollama_client import OLLAMA_MODEL, prompt_ollama, stream_ollama
+import service_http
+import tracing
 
+# Only for the response models; calls to the other services go through service_http
 from transcript_service_client import TranscriptChunk
-import transcript_service_client 
-transcript_config = transcript_service_client.Configuration(host=os.getenv("TRANSCRIPT_SERVICE_URL"))
-transcript_api_client = transcript_service_client.ApiClient(configuration=transcript_config)
-transcript_api = transcript_service_client.DefaultApi(transcript_api_client)
+
+# Must match BINARY_EMBEDDING_MEDIA_TYPES in embedding-gen-service/app.py
+FLOAT32_EMBEDDINGS_MEDIA_TYPE = "application/x-float32"
 
 
 
 class CreateQuestionRoundRequest(TypedDict):
     filePath: str
+    # Questions to answer afresh even if there's a cached answer for them
+    regenerate: NotRequired[List[str]]
+    # Include each answer's timing breakdown
+    timings: NotRequired[bool]
 
 
 class QaAttemptResponse(TypedDict):
     llmAnswer: str
     ragChunks: List[TranscriptChunk]
     questionText: str
+    cached: bool  # Served from the answer cache rather than generated
+    # Milliseconds per stage, if asked for; see RagQaAttempt
+    timings: NotRequired[Dict[str, float]]
     # questionLineIndex: int
 
 
@@ -48,12 +43,35 @@ class QuestionRoundResponse(TypedDict):
     qaAttempts: List[QaAttemptResponse]
 
 
+# "hybrid": BM25 and vector search fused, in one request to the embedding index
+# (which embeds the questions itself); "vector": vector search only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_TOP_K = 5
+
+# LLM calls in flight at once per question round
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+
+answer_cache = AnswerCache(os.getenv("ANSWER_CACHE_PATH", "answer_cache/answers.sqlite3"))
+
+
 app = FastAPI(
     title="Question answerer service",
     description="Service for attempting to elucidate questions user might have in their notes")
+tracing.instrument(
+    app, "question-answerer",
+    gauges=lambda: {f"answer_cache_{name}": value for name, value in answer_cache.stats().items()})
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await service_http.close_async_clients()
 
 
 
+# Bump when changing the prompt, so cached answers to the old one aren't served
+PROMPT_VERSION = 1
+
+
 def generate_rag_prompt(question: str, chunks: List[str]) -> str:
     context = "\n\n".join(chunks)
     prompt = (
@@ -67,25 +85,224 @@ def generate_rag_prompt(question: str, chunks: List[str]) -> str:
 
 class RagQaAttempt(TypedDict):
     question: str
-    chunks_used: List[TranscriptChunk]
+    chunks_used: List[dict]  # TranscriptChunk JSON
     answer: str
+    cached: bool
+    # Seconds per stage (other services' prefixed with theirs, e.g.
+    # "embedding-index.search", "ollama.eval"). Retrieval and chunk fetching are
+    # done once for the whole round, so their times are shared by its questions.
+    timings: Dict[str, float]
+
+
+def filter_params(sources: Optional[dict]) -> Dict[str, List[str]]:
+    """
+    A search filter as /search:batch-binary's query parameters.
+    """
+    names = {"transcript_ids": "transcript_id", "tags": "tag",
+             "exclude_transcript_ids": "exclude_transcript_id", "exclude_tags": "exclude_tag"}
+    return {names[field]: values for field, values in (sources or {}).items() if values is not None}
+
+
+async def find_nearest_chunks(questions: List[str], sources: Optional[dict] = None) -> List[List[dict]]:
+    """
+    Find the chunks to answer each question with, for all questions at once, as the
+    embedding index's search results (with "id" and "chunks_version"). In
+    hybrid mode that's one /search:hybrid request; otherwise the questions are
+    embedded in one request and searched for in one batched search, with the
+    embeddings passed from one service to the other as the raw float32 matrix,
+    without decoding them.
+    :param sources: The notes file's sources (the embedding index's search filter),
+        to only search the transcripts it's about.
+    """
+    if not questions:
+        return []
+    if RETRIEVAL_MODE == "hybrid":
+        search_resp = await service_http.request(
+            "EMBEDDING_INDEX_SERVICE", "POST", "/search:hybrid",
+            json={"queries": questions, "top_k": RETRIEVAL_TOP_K, "filter": sources})
+        return search_resp.json()["results"]
+    # Timed here, as the embedding generation service doesn't report its own timings
+    with tracing.span("embed"):
+        embeddings_resp = await service_http.request(
+            "EMBEDDING_GEN_SERVICE", "POST", "/generate-embeddings",
+            json={"sentences": questions}, headers={"Accept": FLOAT32_EMBEDDINGS_MEDIA_TYPE})
+    search_resp = await service_http.request(
+        "EMBEDDING_INDEX_SERVICE", "POST", "/search:batch-binary",
+        params={"top_k": RETRIEVAL_TOP_K, **filter_params(sources)},
+        content=embeddings_resp.content,
+        headers={
+            "Content-Type": FLOAT32_EMBEDDINGS_MEDIA_TYPE,
+            "X-Embedding-Shape": embeddings_resp.headers["X-Embedding-Shape"]})
+    return search_resp.json()["results"]
 
 
-def attempt_qa_with_rag(question: str) -> RagQaAttempt:
-    question_embedding = embedding_gen_api\
-            .generate_embeddings_generate_embeddings_post({"sentences":[question]}).embeddings[0]
-    # question_embedding = generate_embeddings([question])[0]
-    # nearest_neighbors = search_similar_chunks(question_embedding)["results"]
-    search_req = {"query_embedding": question_embedding}
-    nearest_neighbors = embedding_index_api.search_embeddings_search_post(search_req).results
-    nearest_neighbor_chunks = [transcript_api.fetch_chunk_by_id_chunks_id_get(c.id) for c in nearest_neighbors]
-    prompt = generate_rag_prompt(question, [c.text for c in nearest_neighbor_chunks])
-    ollama_resp = prompt_ollama(prompt)
+async def fetch_chunks(chunk_ids: List[str]) -> Dict[str, dict]:
+    """
+    Fetch chunks in a single round trip to the transcript service, keyed by chunk ID.
+    """
+    unique_ids = list(dict.fromkeys(chunk_ids))
+    if not unique_ids:
+        return {}
+    resp = await service_http.request("TRANSCRIPT_SERVICE", "POST", "/chunks:batch", json={"ids": unique_ids})
+    return {c["id"]: c for c in resp.json()["chunks"]}
+
+
+async def answer_with_chunks(
+        question: str,
+        chunks: List[dict],
+        on_token: Optional[Callable[[str], None]] = None) -> RagQaAttempt:
+    """
+    :param on_token: If given, the answer is streamed from Ollama and this is called
+        with each piece of it as it's generated.
+    """
+    with tracing.span("prompt_build"):
+        prompt = generate_rag_prompt(question, [c["text"] for c in chunks])
+    final: dict = {}
+    with tracing.span("generate"):
+        if on_token is None:
+            final = await prompt_ollama(prompt)
+            answer = final["response"]
+        else:
+            pieces = []
+            async for final in stream_ollama(prompt):
+                if final["response"]:
+                    pieces.append(final["response"])
+                    on_token(final["response"])
+            answer = "".join(pieces)
+    # Ollama's own breakdown of the generation, in nanoseconds (on the last chunk when streaming)
+    for stage in ["load", "prompt_eval", "eval"]:
+        if final.get(f"{stage}_duration") is not None:
+            tracing.record(stage, final[f"{stage}_duration"] / 1e9, service="ollama")
     return {
         "question": question,
-        "chunks_used": nearest_neighbor_chunks,
-        "answer": ollama_resp["response"]
+        "chunks_used": chunks,
+        "answer": answer,
+        "cached": False,
+        "timings": {}
+    }
+
+
+async def attempt_qa_with_rag(question: str) -> RagQaAttempt:
+    [event] = [e async for e in stream_qa_round_with_rag([question])]
+    if event["attempt"] is None:
+        raise RuntimeError(event["error"])
+    return event["attempt"]
+
+
+class RoundEvent(TypedDict):
+    questionIndex: int
+    token: Optional[str]  # Next piece of an answer still being generated
+    attempt: Optional[RagQaAttempt]  # The finished answer...
+    error: Optional[str]  # ...or why there isn't one
+
+
+async def stream_qa_round_with_rag(
+        questions: List[str],
+        stream_tokens: bool = False,
+        regenerate: Optional[List[str]] = None,
+        sources: Optional[dict] = None) -> AsyncIterator[RoundEvent]:
+    """
+    Answer a round of questions, yielding each answer as soon as it's done (so not
+    in question order), and with `stream_tokens` each piece of the answers as it's
+    generated. Retrieval is batched for the whole round. Questions whose retrieved
+    chunks, prompt and model match a cached answer are answered from the cache
+    straight away (unless listed in `regenerate`); up to OLLAMA_CONCURRENCY of the
+    rest are put to the LLM at once. A failed LLM call yields an error for its
+    question rather than ending the round. `sources` restricts retrieval to some
+    transcripts, as declared in the notes file.
+    """
+    # (Not yielding inside sub-traces, as the consumer could resume the generator in another context)
+    with tracing.sub_trace() as retrieval:
+        with tracing.span("retrieve"):
+            neighbors = await find_nearest_chunks(questions, sources)
+        neighbor_ids = [[c["id"] for c in hits] for hits in neighbors]
+        with tracing.span("answer_cache"):
+            keys = [
+                answer_key(q, ids, [c.get("chunks_version") for c in hits], PROMPT_VERSION, OLLAMA_MODEL)
+                for q, ids, hits in zip(questions, neighbor_ids, neighbors)]
+            regenerate_set = set(regenerate or [])
+            # SQLite calls block, so they're kept off the event loop
+            cached = await asyncio.to_thread(
+                answer_cache.get_many, [k for q, k in zip(questions, keys) if q not in regenerate_set])
+    to_answer = []
+    for index, (question, key) in enumerate(zip(questions, keys)):
+        hit = cached.get(key)
+        if hit is None:
+            to_answer.append(index)
+            continue
+        yield {
+            "questionIndex": index,
+            "token": None,
+            "attempt": {
+                "question": question, "chunks_used": hit["chunks"], "answer": hit["answer"], "cached": True,
+                "timings": retrieval.totals()},
+            "error": None}
+    if not to_answer:
+        return
+    with tracing.sub_trace() as fetching:
+        with tracing.span("fetch"):
+            chunks_by_id = await fetch_chunks([i for index in to_answer for i in neighbor_ids[index]])
+    round_timings = tracing.sum_totals(retrieval.totals(), fetching.totals())
+    semaphore = asyncio.Semaphore(OLLAMA_CONCURRENCY)
+    events: "asyncio.Queue[RoundEvent]" = asyncio.Queue()
+
+    def token_sender(index: int) -> Callable[[str], None]:
+        def send(token: str):
+            events.put_nowait({"questionIndex": index, "token": token, "attempt": None, "error": None})
+        return send
+
+    async def answer(index: int):
+        with tracing.sub_trace() as question_trace:
+            with tracing.span("llm_queue"):
+                await semaphore.acquire()
+            try:
+                chunks = [chunks_by_id[i] for i in neighbor_ids[index]]
+                attempt = await answer_with_chunks(
+                    questions[index], chunks, token_sender(index) if stream_tokens else None)
+                attempt["timings"] = tracing.sum_totals(round_timings, question_trace.totals())
+                await asyncio.to_thread(answer_cache.put, keys[index], questions[index], chunks, attempt["answer"])
+                events.put_nowait({"questionIndex": index, "token": None, "attempt": attempt, "error": None})
+            except Exception as e:
+                traceback.print_exc()
+                events.put_nowait({"questionIndex": index, "token": None, "attempt": None, "error": str(e)})
+            finally:
+                semaphore.release()
+
+    tasks = [asyncio.create_task(answer(i)) for i in to_answer]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await events.get()
+            if event["token"] is None:
+                remaining -= 1
+            yield event
+    finally:
+        # The client went away: don't start LLM calls nobody will read, and stop the
+        # ones generating (closing their connections stops Ollama)
+        for task in tasks:
+            task.cancel()
+
+
+async def get_file_questions(file_path: str) -> Tuple[List[str], Optional[dict]]:
+    """
+    :return: The file's questions and its sources, if it declares any.
+    """
+    encoded_path = base64.b64encode(file_path.encode("utf-8")).decode("utf-8")
+    questions_resp = await service_http.request("NOTES_SERVICE", "GET", "/questions", params={"file_path": encoded_path})
+    body = questions_resp.json()
+    return [q["text"] for q in body["questions"]], body.get("sources")
+
+
+def qa_attempt_response(attempt: RagQaAttempt, timings: bool = False) -> QaAttemptResponse:
+    response: QaAttemptResponse = {
+        "llmAnswer": attempt["answer"],
+        "ragChunks": attempt["chunks_used"],
+        "questionText": attempt["question"],
+        "cached": attempt["cached"]
     }
+    if timings:
+        response["timings"] = {stage: round(seconds * 1000, 2) for stage, seconds in attempt["timings"].items()}
+    return response
 
 
 @app.get("/ping")
@@ -93,21 +310,63 @@ def ping_pong():
     return "pong"
 
 
+@app.get("/answer-cache-stats", response_model=dict)
+def answer_cache_stats():
+    return answer_cache.stats()
+
+
 @app.post("/question-rounds", response_model=QuestionRoundResponse)
-def new_question_round(body: CreateQuestionRoundRequest):
+async def new_question_round(body: CreateQuestionRoundRequest):
     file_path = body["filePath"]
-    encoded_path = base64.b64encode(file_path.encode("utf-8")).decode("utf-8")
-    questions_resp: FileQuestionsResponse = notes_api.get_file_questions_questions_get(encoded_path)
-    questions: List[FileQuestion] = questions_resp.questions
-    qa_attempts = [attempt_qa_with_rag(q.text) for q in questions]
+    questions, sources = await get_file_questions(file_path)
+    answers = [a async for a in stream_qa_round_with_rag(questions, regenerate=body.get("regenerate"), sources=sources)]
+    failed = [a for a in answers if a["attempt"] is None]
+    if failed:
+        raise HTTPException(status_code=502, detail=f"Error answering question: {failed[0]['error']}")
+    answers.sort(key=lambda a: a["questionIndex"])
     return {
         "filePath": file_path,
         "qaAttempts": [
-            {
-                "llmAnswer": a["answer"],
-                "ragChunks": a["chunks_used"],
-                "questionText": a["question"]
-                }
-            for a in qa_attempts
-        ]
+            qa_attempt_response(a["attempt"], body.get("timings", False)) for a in answers if a["attempt"] is not None]
     }
+
+
+def ndjson_line(event: dict) -> str:
+    return json.dumps(event) + "\n"
+
+
+@app.post("/question-rounds:stream")
+async def stream_question_round(body: CreateQuestionRoundRequest, tokens: bool = True):
+    """
+    Like /question-rounds, but streams newline-delimited JSON events as the round
+    progresses: a "round" event listing the questions, "token" events with each
+    piece of an answer as the LLM generates it (unless `tokens` is false), a
+    "qaAttempt" (or "error") event per question once its answer is done, then a
+    "done" event.
+    """
+    file_path = body["filePath"]
+    questions, sources = await get_file_questions(file_path)
+
+    async def events() -> AsyncIterator[str]:
+        yield ndjson_line({"type": "round", "filePath": file_path, "questions": questions})
+        try:
+            async for answer in stream_qa_round_with_rag(
+                    questions, stream_tokens=tokens, regenerate=body.get("regenerate"), sources=sources):
+                if answer["token"] is not None:
+                    yield ndjson_line(
+                        {"type": "token", "questionIndex": answer["questionIndex"], "text": answer["token"]})
+                elif answer["attempt"] is None:
+                    yield ndjson_line(
+                        {"type": "error", "questionIndex": answer["questionIndex"], "detail": answer["error"]})
+                else:
+                    yield ndjson_line({
+                        "type": "qaAttempt",
+                        "questionIndex": answer["questionIndex"],
+                        "qaAttempt": qa_attempt_response(answer["attempt"], body.get("timings", False))})
+        except Exception as e:
+            # Headers are already sent, so report a failed retrieval in-band
+            traceback.print_exc()
+            yield ndjson_line({"type": "error", "questionIndex": None, "detail": str(e)})
+        yield ndjson_line({"type": "done"})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
@@ -1,9 +1,12 @@
+import json
 import os
-import requests
-from typing_extensions import List, TypedDict
+from typing_extensions import AsyncIterator, List, TypedDict
 
+import service_http
+
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "phi3")
 
-OLLAMA_URL = os.getenv("OLLAMA_SERVICE_URL")
 
 class OllamaResponse(TypedDict):
     model: str
@@ -20,12 +23,32 @@ class OllamaResponse(TypedDict):
     eval_duration: int
 
 
-def prompt_ollama(prompt: str) -> OllamaResponse:
+async def prompt_ollama(prompt: str) -> OllamaResponse:
     data = {
-        "model": "phi3",
+        "model": OLLAMA_MODEL,
         "prompt": prompt,
         "stream": False
     }
-    response = requests.post(f"{OLLAMA_URL}/api/generate", json=data)
-    response.raise_for_status()
+    response = await service_http.request("OLLAMA_SERVICE", "POST", "/api/generate", json=data)
     return response.json()
+
+
+async def stream_ollama(prompt: str) -> AsyncIterator[OllamaResponse]:
+    """
+    Prompt Ollama in streaming mode, yielding its response chunks as they're
+    generated: each has the next piece of the answer in "response", and the last
+    has "done" set along with the timing fields. Stopping early closes the
+    connection, which stops generation.
+    """
+    data = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": True
+    }
+    async with service_http.stream("OLLAMA_SERVICE", "POST", "/api/generate", json=data) as response:
+        async for line in response.aiter_lines():
+            if line:
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(f"Ollama error: {chunk['error']}")
+                yield chunk
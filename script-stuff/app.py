@@ -1,20 +1,28 @@
 from fastapi import FastAPI, HTTPException
-from typing_extensions import List, TypedDict, Optional, Tuple
+from typing_extensions import Dict, List, TypedDict, Optional, Tuple
+import bisect
 import json
 import os
 import nltk
 from nltk.tokenize import sent_tokenize
 # nltk.download('punkt_tab')
 
+from models import Transcript, TranscriptLine, TranscriptChunk, TranscriptDetailsRest, TranscriptSummaryRest, \
+    ChunkBatchRequest, ChunkBatchResponse
+from chunk_store import ChunkArtifact, ChunkStore, generate_chunk_id
+from corpus import TranscriptCorpus
+try:
+    import tracing
+except ImportError:  # shared/ isn't on the path, e.g. when running test.py
+    tracing = None
 
 
-SCRIPT_DB_FP = "/ai_transcripts/"
 
-def generate_chunk_id(transcript_id: str, chunk_index: int) -> str:
-    """
-    Generate a unique chunk ID from the transcript ID and chunk index.
-    """
-    return f"{transcript_id}-{chunk_index}"
+SCRIPT_DB_FP = os.getenv("TRANSCRIPTS_DIR", "/ai_transcripts/")
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "chunk_store/")
+
+# Bump whenever break_script_into_chunks changes its output, so persisted chunks get rebuilt
+CHUNKER_VERSION = 2
 
 
 def parse_chunk_id(chunk_id: str) -> Tuple[str, int]:
@@ -24,34 +32,6 @@ def parse_chunk_id(chunk_id: str) -> Tuple[str, int]:
     transcript_id, chunk_index = chunk_id.rsplit("-", 1)
     return transcript_id, int(chunk_index)
 
-# SNIPPET - typed dicts
-class TranscriptLine(TypedDict):
-    timeStamp: int
-    text: str
-
-
-class Transcript(TypedDict):
-    id: str
-    name: str
-    lines: List[TranscriptLine]
-
-
-class TranscriptChunk(TypedDict):
-    id: str
-    timeStamp: int
-    text: str
-
-
-class TranscriptDetailsRest(TypedDict):
-    id: str
-    name: str
-    chunks: List[TranscriptChunk]
-
-
-class TranscriptSummaryRest(TypedDict):
-    id: str
-    name: str
-
 
 def get_chunks_with_ids(script_id:str, almost_chunks: List[Tuple[int, str]]) -> List[TranscriptChunk]:
     return [
@@ -64,10 +44,14 @@ def get_chunks_with_ids(script_id:str, almost_chunks: List[Tuple[int, str]]) ->
     ]
 
 
-def get_scripts() -> List[Transcript]:
+def get_scripts(directory: str = SCRIPT_DB_FP) -> List[Transcript]:
+    """
+    Read and parse every transcript on disk. Uncached - request handlers should go
+    through `corpus` instead.
+    """
     rv = []
-    for file_name in os.listdir(SCRIPT_DB_FP):
-        file_path = os.path.join(SCRIPT_DB_FP, file_name)
+    for file_name in os.listdir(directory):
+        file_path = os.path.join(directory, file_name)
         if os.path.isfile(file_path):
             with open(file_path, "r") as f:
                 data = json.load(f)
@@ -77,79 +61,92 @@ def get_scripts() -> List[Transcript]:
     # return rv[:1]
 
 
+def join_script_lines(script: Transcript) -> str:
+    return " ".join([l["text"] for l in script["lines"]])
+
+
 def split_script_into_sentences(script: Transcript) -> list[str]:
-    text = " ".join([l["text"] for l in script["lines"]])
-    return sent_tokenize(text)
+    return sent_tokenize(join_script_lines(script))
 
 
 def break_script_into_chunks(script: Transcript) -> List[TranscriptChunk]:
-    sentences = split_script_into_sentences(script)
+    lines = script["lines"]
+    text = join_script_lines(script)
+    sentences = sent_tokenize(text)
     if len(sentences) == 1:
-        line_chunks = [(l["timeStamp"], l["text"]) for l in script["lines"]]
+        line_chunks = [(l["timeStamp"], l["text"]) for l in lines]
         return get_chunks_with_ids(script["id"], line_chunks)
 
-    # now break up into chunks, assigning the right timestamps
-    lines = script["lines"]
-
-    # Step 1: Create a concatenated string and track line indices
-    concatenated_text = ""
-    line_index_mapping = []  # List of (start_idx, end_idx, timestamp)
-
+    # Start offset of each line within the joined text (lines are joined by one space)
+    line_starts: List[int] = []
     current_idx = 0
     for line in lines:
-        start_idx = current_idx
-        concatenated_text += line["text"] + " "
-        end_idx = current_idx + len(line["text"])
-        line_index_mapping.append((start_idx, end_idx, line["timeStamp"]))
-        current_idx = end_idx + 1  # Account for the added space
+        line_starts.append(current_idx)
+        current_idx += len(line["text"]) + 1
 
-    # Step 3: Assign timestamps to each sentence
+    # Sentences come back in text order, so each one is searched for from the end of
+    # the previous one; this keeps the whole pass linear and gives repeated sentences
+    # their own position instead of the first occurrence's
     chunks: List[Tuple[int, str]] = []
+    cursor = 0
     for sentence in sentences:
-        # Find the start index of the sentence in the concatenated text
-        sentence_start_idx = concatenated_text.find(sentence)
-
-        if sentence_start_idx == None:
-            raise Exception("This shouldn't happen??")
+        sentence_start_idx = text.find(sentence, cursor)
+        if sentence_start_idx == -1:
+            # The tokenizer didn't return the sentence verbatim - attribute it to the
+            # line we're up to rather than dropping it
+            sentence_start_idx = cursor
+        else:
+            cursor = sentence_start_idx + len(sentence)
+        line_idx = bisect.bisect_right(line_starts, sentence_start_idx) - 1
+        chunks.append((lines[line_idx]["timeStamp"], sentence))
 
-        # Determine which line the sentence belongs to based on the index mapping
-        for start_idx, end_idx, timestamp in line_index_mapping:
-            if start_idx <= sentence_start_idx < end_idx:
-                chunks.append((timestamp, sentence))
-                break
+    return get_chunks_with_ids(script["id"], chunks)
 
 
-    return get_chunks_with_ids(script["id"], chunks)
+chunk_store = ChunkStore(CHUNK_STORE_DIR, chunker=break_script_into_chunks, chunker_version=CHUNKER_VERSION)
+corpus = TranscriptCorpus(SCRIPT_DB_FP, chunk_store=chunk_store)
 
 
 def get_script_by_id(video_id: str) -> Optional[Transcript]:
-    scripts = get_scripts()
-    return next((s for s in scripts if s["id"] == video_id), None)
+    return corpus.get_transcript(video_id)
 
 
 def get_chunk_by_id(chunk_id: str) -> Optional[TranscriptChunk]:
     transcript_id, chunk_index = parse_chunk_id(chunk_id)
-    script = get_script_by_id(transcript_id)
-    if script is None:
-        print("No such script found for chunk")
-        return None
-    chunks = break_script_into_chunks(script)
-    c_ts = [c["text"] for c in chunks]
-    # if len(c_ts) != len(list(set(c_ts))):
-    #     print("there are dupes in these chunks!!!!!!")
-    # else:
-    #     print("there are no dupes in these chunks!!!!!!")
-    chunk = chunks[chunk_index]
+    chunk = corpus.get_chunk(transcript_id, chunk_index)
+    if chunk is None:
+        print("No such script or chunk index found for chunk %s" % (chunk_id))
     return chunk
 
 
+def get_chunks_by_ids(chunk_ids: List[str]) -> Tuple[List[TranscriptChunk], List[str]]:
+    """
+    Look up many chunks at once, loading and chunking each transcript at most once.
+    Returns the chunks found, in request order, and the IDs that weren't found.
+    """
+    parsed_ids = [parse_chunk_id(chunk_id) for chunk_id in chunk_ids]
+    artifacts: Dict[str, Optional[ChunkArtifact]] = {
+        transcript_id: corpus.get_artifact(transcript_id)
+        for transcript_id in {transcript_id for transcript_id, _ in parsed_ids}
+    }
+    found: List[TranscriptChunk] = []
+    missing: List[str] = []
+    for chunk_id, (transcript_id, chunk_index) in zip(chunk_ids, parsed_ids):
+        artifact = artifacts[transcript_id]
+        if artifact is None or not 0 <= chunk_index < len(artifact):
+            missing.append(chunk_id)
+        else:
+            found.append(artifact[chunk_index])
+    return found, missing
+
+
 def peep_script_chunks(video_id: str):
     print("\n\n")
     script = get_script_by_id(video_id)
     if not script:
         print("no script")
         return
-    chunks = break_script_into_chunks(script)
+    chunks = corpus.get_chunks(video_id) or []
     print("script name: %s" % (script["name"]))
     print("nb chunks: %d" % (len(chunks)))
     print("first 5:")
@@ -159,6 +156,8 @@ def peep_script_chunks(video_id: str):
 
 
 app = FastAPI(title="Transcript Service", description="Service for managing video transcripts")
+if tracing is not None:
+    tracing.instrument(app, "transcript-service", gauges=lambda: {"transcripts": len(corpus.transcripts())})
 
 
 @app.get("/ping")
@@ -168,10 +167,14 @@ def ping_pong():
 @app.get("/scripts", response_model=List[TranscriptSummaryRest])
 def list_scripts():
     """
-    Returns a list of metadata (id and name) for all available scripts.
+    Returns a list of metadata (id, name, chunks version and tags) for all available scripts.
     """
-    scripts = get_scripts()
-    return [{"id": script["id"], "name": script["name"]} for script in scripts]
+    scripts = corpus.transcripts()
+    return [
+        {"id": script["id"], "name": script["name"], "chunksVersion": corpus.chunks_version(script["id"]),
+         "tags": script.get("tags", [])}
+        for script in scripts
+    ]
 
 
 @app.get("/scripts/{id}", response_model=TranscriptDetailsRest)
@@ -180,10 +183,10 @@ def fetch_script_by_id(id: str) -> TranscriptDetailsRest:
     Returns the full transcript for a given script ID.
     """
     script = get_script_by_id(id)
-    if script is None:
+    chunks = corpus.get_chunks(id)
+    if script is None or chunks is None:
         raise HTTPException(status_code=404, detail="Script not found")
-    chunks = break_script_into_chunks(script)
-    return {"id":script["id"], "name":script["name"], "chunks":chunks}
+    return {"id":script["id"], "name":script["name"], "chunksVersion": corpus.chunks_version(id), "chunks":chunks}
 
 
 @app.get("/chunks/{id}", response_model=TranscriptChunk)
@@ -194,6 +197,20 @@ def fetch_chunk_by_id(id: str) -> TranscriptChunk:
     return chunk
 
 
+@app.post("/chunks:batch", response_model=ChunkBatchResponse)
+def fetch_chunks_batch(body: ChunkBatchRequest) -> ChunkBatchResponse:
+    """
+    Returns the chunks for a list of chunk IDs, in the order they were requested.
+    """
+    try:
+        chunks, missing = get_chunks_by_ids(body["ids"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed chunk ID")
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Chunks not found: {', '.join(missing)}")
+    return {"chunks": chunks}
+
+
 if __name__ == "__main__":
     scripts = get_scripts()
     # print(scripts[0]["name"])
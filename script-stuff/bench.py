@@ -0,0 +1,142 @@
+"""
+Micro-benchmarks for the transcript service, run against a synthetic corpus:
+
+    python bench.py [chunk-lookup] [chunking] [--transcripts N] [--lines N]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing_extensions import Callable, Dict, List, Tuple
+
+from app import CHUNKER_VERSION, break_script_into_chunks, get_chunks_with_ids, get_scripts, \
+    split_script_into_sentences
+from chunk_store import ChunkStore
+from corpus import TranscriptCorpus
+from models import Transcript, TranscriptChunk
+
+
+WORDS = ("the model learns a representation of each token and the attention layer "
+         "mixes those representations across the sequence so that later layers can "
+         "answer questions about earlier parts of the video").split()
+
+
+def make_transcript(transcript_id: str, nb_lines: int, rng: random.Random) -> Transcript:
+    lines = []
+    for i in range(nb_lines):
+        words = rng.choices(WORDS, k=rng.randint(6, 14))
+        text = " ".join(words)
+        # Roughly every other line ends a sentence
+        if rng.random() < 0.5:
+            text = text.capitalize() + "."
+        lines.append({"timeStamp": i * 3, "text": text})
+    return {"id": transcript_id, "name": f"Synthetic transcript {transcript_id}", "lines": lines}
+
+
+def write_corpus(directory: str, nb_transcripts: int, nb_lines: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    ids = []
+    for i in range(nb_transcripts):
+        transcript_id = f"synthetic{i:05d}"
+        with open(os.path.join(directory, f"{transcript_id}.json"), "w") as f:
+            json.dump(make_transcript(transcript_id, nb_lines, rng), f)
+        ids.append(transcript_id)
+    return ids
+
+
+def uncached_get_chunk(directory: str, transcript_id: str, chunk_index: int) -> TranscriptChunk:
+    # The pre-corpus lookup path: read the whole directory, find the script, re-chunk it
+    scripts = get_scripts(directory)
+    script = next(s for s in scripts if s["id"] == transcript_id)
+    return break_script_into_chunks(script)[chunk_index]
+
+
+def quadratic_break_script_into_chunks(script: Transcript) -> List[TranscriptChunk]:
+    # break_script_into_chunks as of chunker version 1, kept as the chunking baseline
+    sentences = split_script_into_sentences(script)
+    if len(sentences) == 1:
+        line_chunks = [(l["timeStamp"], l["text"]) for l in script["lines"]]
+        return get_chunks_with_ids(script["id"], line_chunks)
+    concatenated_text = ""
+    line_index_mapping = []
+    current_idx = 0
+    for line in script["lines"]:
+        start_idx = current_idx
+        concatenated_text += line["text"] + " "
+        end_idx = current_idx + len(line["text"])
+        line_index_mapping.append((start_idx, end_idx, line["timeStamp"]))
+        current_idx = end_idx + 1
+    chunks: List[Tuple[int, str]] = []
+    for sentence in sentences:
+        sentence_start_idx = concatenated_text.find(sentence)
+        for start_idx, end_idx, timestamp in line_index_mapping:
+            if start_idx <= sentence_start_idx < end_idx:
+                chunks.append((timestamp, sentence))
+                break
+    return get_chunks_with_ids(script["id"], chunks)
+
+
+def time_calls(fn: Callable[[], object], nb_calls: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(nb_calls):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95)] * 1000,
+    }
+
+
+def bench_chunk_lookup(nb_transcripts: int, nb_lines: int) -> None:
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as store_directory:
+        ids = write_corpus(directory, nb_transcripts, nb_lines)
+        chunk_store = ChunkStore(store_directory, chunker=break_script_into_chunks, chunker_version=CHUNKER_VERSION)
+        corpus = TranscriptCorpus(directory, chunk_store=chunk_store)
+        nb_chunks = {i: len(corpus.get_chunks(i) or []) for i in ids}
+
+        def random_chunk():
+            transcript_id = rng.choice(ids)
+            return transcript_id, rng.randrange(nb_chunks[transcript_id])
+
+        print(f"corpus: {nb_transcripts} transcripts x {nb_lines} lines")
+        before = time_calls(lambda: uncached_get_chunk(directory, *random_chunk()), 20)
+        print("before (re-read + re-chunk):  %(mean_ms)9.3f ms mean, %(p50_ms)9.3f ms p50, "
+              "%(p95_ms)9.3f ms p95" % before)
+        after = time_calls(lambda: corpus.get_chunk(*random_chunk()), 2000)
+        print("after (resident corpus):      %(mean_ms)9.3f ms mean, %(p50_ms)9.3f ms p50, "
+              "%(p95_ms)9.3f ms p95" % after)
+        print("speedup: %.0fx" % (before["mean_ms"] / after["mean_ms"]))
+
+
+def bench_chunking() -> None:
+    rng = random.Random(2)
+    # A line every 3 seconds
+    for hours in (1, 3, 6):
+        script = make_transcript(f"{hours}h", hours * 1200, rng)
+        before = time_calls(lambda: quadratic_break_script_into_chunks(script), 3)
+        after = time_calls(lambda: break_script_into_chunks(script), 3)
+        print("%dh transcript (%d lines): before %9.1f ms, after %9.1f ms (%.1fx)" % (
+            hours, len(script["lines"]), before["mean_ms"], after["mean_ms"],
+            before["mean_ms"] / after["mean_ms"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=["chunk-lookup"])
+    parser.add_argument("--transcripts", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=400)
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario == "chunk-lookup":
+            bench_chunk_lookup(args.transcripts, args.lines)
+        elif scenario == "chunking":
+            bench_chunking()
+        else:
+            raise SystemExit(f"Unknown scenario: {scenario}")
@@ -0,0 +1,152 @@
+import glob
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing_extensions import Callable, List
+
+from models import Transcript, TranscriptChunk
+
+
+# Artifact layout (all little-endian):
+#   header:     magic (4s) | format version (H) | padding (2x) | chunk count (I) | padding (4x)
+#   timestamps: chunk count x int64
+#   offsets:    (chunk count + 1) x uint32, byte offsets into the text blob
+#   text blob:  the chunk texts, utf-8 encoded and concatenated
+ARTIFACT_MAGIC = b"SBCK"
+ARTIFACT_FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sH2xI4x")
+
+
+def generate_chunk_id(transcript_id: str, chunk_index: int) -> str:
+    """
+    Generate a unique chunk ID from the transcript ID and chunk index.
+    """
+    return f"{transcript_id}-{chunk_index}"
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class ChunkArtifact:
+    """
+    Read-only view over one transcript's persisted chunks. The file is read with a
+    single read; timestamps and offsets are zero-copy casts over that buffer and texts
+    are only decoded for the chunks that are actually looked up.
+    """
+
+    def __init__(self, transcript_id: str, file_path: str):
+        self.transcript_id = transcript_id
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self._buffer = memoryview(f.read())
+        magic, version, count = HEADER.unpack_from(self._buffer)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Not a chunk artifact (or unsupported version): {file_path}")
+        timestamps_end = HEADER.size + 8 * count
+        offsets_end = timestamps_end + 4 * (count + 1)
+        self._count = count
+        self._timestamps = self._column(HEADER.size, timestamps_end, "q")
+        self._offsets = self._column(timestamps_end, offsets_end, "I")
+        self._texts = self._buffer[offsets_end:]
+
+    def _column(self, start: int, end: int, typecode: str):
+        if sys.byteorder == "little":
+            return self._buffer[start:end].cast(typecode)
+        values = array(typecode, self._buffer[start:end].tobytes())
+        values.byteswap()
+        return values
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, chunk_index: int) -> TranscriptChunk:
+        if not 0 <= chunk_index < self._count:
+            raise IndexError(chunk_index)
+        start, end = self._offsets[chunk_index], self._offsets[chunk_index + 1]
+        return {
+            "id": generate_chunk_id(self.transcript_id, chunk_index),
+            "timeStamp": self._timestamps[chunk_index],
+            "text": str(self._texts[start:end], "utf-8"),
+        }
+
+    def to_list(self) -> List[TranscriptChunk]:
+        return [self[i] for i in range(self._count)]
+
+
+def write_artifact(file_path: str, chunks: List[TranscriptChunk]) -> None:
+    """
+    Write chunks to `file_path` atomically: readers see either the old file or the
+    complete new one.
+    """
+    encoded = [c["text"].encode("utf-8") for c in chunks]
+    offsets = array("I", [0])
+    for text in encoded:
+        offsets.append(offsets[-1] + len(text))
+    timestamps = array("q", [c["timeStamp"] for c in chunks])
+
+    directory = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_FORMAT_VERSION, len(chunks)))
+            f.write(_little_endian(timestamps).tobytes())
+            f.write(_little_endian(offsets).tobytes())
+            f.write(b"".join(encoded))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ChunkStore:
+    """
+    On-disk store of chunked transcripts, one artifact file per transcript version.
+
+    Artifacts are keyed by transcript ID, a hash of the transcript file's content and
+    the chunker version, so a transcript is chunked once per edit (or chunker change)
+    and every reader - /chunks, /scripts and index seeding - sees the same chunks.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            chunker: Callable[[Transcript], List[TranscriptChunk]],
+            chunker_version: int):
+        self.directory = directory
+        self.chunker = chunker
+        self.chunker_version = chunker_version
+
+    def chunks_version(self, content_hash: str) -> str:
+        return f"{content_hash}.v{self.chunker_version}"
+
+    def artifact_path(self, transcript_id: str, content_hash: str) -> str:
+        return os.path.join(
+            self.directory, f"{transcript_id}.{self.chunks_version(content_hash)}.chunks")
+
+    def get(self, transcript: Transcript, content_hash: str) -> ChunkArtifact:
+        """
+        Return the artifact for this version of the transcript, chunking and
+        persisting it first if it doesn't exist yet.
+        """
+        transcript_id = transcript["id"]
+        file_path = self.artifact_path(transcript_id, content_hash)
+        if not os.path.exists(file_path):
+            os.makedirs(self.directory, exist_ok=True)
+            write_artifact(file_path, self.chunker(transcript))
+            self._remove_stale(transcript_id, keep=file_path)
+        return ChunkArtifact(transcript_id, file_path)
+
+    def _remove_stale(self, transcript_id: str, keep: str) -> None:
+        pattern = os.path.join(glob.escape(self.directory), f"{glob.escape(transcript_id)}.*.chunks")
+        for file_path in glob.glob(pattern):
+            if file_path != keep:
+                try:
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    pass
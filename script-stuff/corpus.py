@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing_extensions import Dict, List, Optional
+
+from chunk_store import ChunkArtifact, ChunkStore
+from models import Transcript, TranscriptChunk
+
+
+class CorpusEntry:
+    def __init__(self, file_path: str, mtime_ns: int, content_hash: str, transcript: Transcript):
+        self.file_path = file_path
+        self.mtime_ns = mtime_ns
+        self.content_hash = content_hash
+        self.transcript = transcript
+        # Filled in on first chunk lookup
+        self.chunks: Optional[ChunkArtifact] = None
+
+
+class TranscriptCorpus:
+    """
+    Resident view of the transcripts directory.
+
+    Transcripts are parsed once and indexed by ID; their chunks are read from the
+    chunk store the first time one of them is asked for. An entry is re-read when its file's mtime changes; the
+    directory itself is re-listed when an unknown ID is requested or when the last
+    listing is older than `rescan_interval` seconds.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            chunk_store: ChunkStore,
+            rescan_interval: float = 5.0):
+        self.directory = directory
+        self.chunk_store = chunk_store
+        self.rescan_interval = rescan_interval
+        self._lock = threading.RLock()
+        self._by_path: Dict[str, CorpusEntry] = {}
+        self._by_id: Dict[str, CorpusEntry] = {}
+        self._last_scan: Optional[float] = None
+
+    def refresh(self) -> None:
+        """
+        Re-list the directory, (re)loading only files that are new or whose mtime
+        changed, and dropping entries whose file is gone.
+        """
+        with self._lock:
+            by_path: Dict[str, CorpusEntry] = {}
+            for dir_entry in os.scandir(self.directory):
+                if not dir_entry.is_file():
+                    continue
+                mtime_ns = dir_entry.stat().st_mtime_ns
+                entry = self._by_path.get(dir_entry.path)
+                if entry is None or entry.mtime_ns != mtime_ns:
+                    entry = self._load_file(dir_entry.path, mtime_ns)
+                by_path[dir_entry.path] = entry
+            self._by_path = by_path
+            self._by_id = {e.transcript["id"]: e for e in by_path.values()}
+            self._last_scan = time.monotonic()
+
+    def transcripts(self) -> List[Transcript]:
+        with self._lock:
+            if self._last_scan is None or time.monotonic() - self._last_scan > self.rescan_interval:
+                self.refresh()
+            return [e.transcript for e in self._by_id.values()]
+
+    def get_transcript(self, transcript_id: str) -> Optional[Transcript]:
+        entry = self._get_entry(transcript_id)
+        return entry.transcript if entry is not None else None
+
+    def chunks_version(self, transcript_id: str) -> Optional[str]:
+        entry = self._get_entry(transcript_id)
+        return self.chunk_store.chunks_version(entry.content_hash) if entry is not None else None
+
+    def get_artifact(self, transcript_id: str) -> Optional[ChunkArtifact]:
+        with self._lock:
+            entry = self._get_entry(transcript_id)
+            if entry is None:
+                return None
+            if entry.chunks is None:
+                entry.chunks = self.chunk_store.get(entry.transcript, entry.content_hash)
+            return entry.chunks
+
+    def get_chunks(self, transcript_id: str) -> Optional[List[TranscriptChunk]]:
+        artifact = self.get_artifact(transcript_id)
+        return artifact.to_list() if artifact is not None else None
+
+    def get_chunk(self, transcript_id: str, chunk_index: int) -> Optional[TranscriptChunk]:
+        artifact = self.get_artifact(transcript_id)
+        if artifact is None or not 0 <= chunk_index < len(artifact):
+            return None
+        return artifact[chunk_index]
+
+    def _get_entry(self, transcript_id: str) -> Optional[CorpusEntry]:
+        with self._lock:
+            entry = self._by_id.get(transcript_id)
+            if entry is None:
+                # Could be a file added since the last listing
+                self.refresh()
+                return self._by_id.get(transcript_id)
+            try:
+                mtime_ns = os.stat(entry.file_path).st_mtime_ns
+            except FileNotFoundError:
+                self.refresh()
+                return self._by_id.get(transcript_id)
+            if mtime_ns != entry.mtime_ns:
+                reloaded = self._load_file(entry.file_path, mtime_ns)
+                self._by_path[entry.file_path] = reloaded
+                del self._by_id[transcript_id]
+                self._by_id[reloaded.transcript["id"]] = reloaded
+                entry = self._by_id.get(transcript_id)
+            return entry
+
+    def _load_file(self, file_path: str, mtime_ns: int) -> CorpusEntry:
+        with open(file_path, "rb") as f:
+            raw = f.read()
+        transcript: Transcript = json.loads(raw)
+        # Tags don't affect the chunks, so hashing the rest in one canonical form means
+        # tagging, retagging or untagging a transcript doesn't change its chunks version
+        # (and the embedding index doesn't re-embed it)
+        hashed = json.dumps({k: v for k, v in transcript.items() if k != "tags"}, sort_keys=True)
+        content_hash = hashlib.sha256(hashed.encode("utf-8")).hexdigest()[:16]
+        return CorpusEntry(file_path, mtime_ns, content_hash, transcript)
@@ -0,0 +1,44 @@
+from typing_extensions import List, NotRequired, TypedDict
+
+
+# SNIPPET - typed dicts
+class TranscriptLine(TypedDict):
+    timeStamp: int
+    text: str
+
+
+class Transcript(TypedDict):
+    id: str
+    name: str
+    lines: List[TranscriptLine]
+    # e.g. the course or playlist it's from, for restricting searches to
+    tags: NotRequired[List[str]]
+
+
+class TranscriptChunk(TypedDict):
+    id: str
+    timeStamp: int
+    text: str
+
+
+class TranscriptDetailsRest(TypedDict):
+    id: str
+    name: str
+    # Identifies the chunking these chunks came from: "{content hash}.v{chunker version}"
+    chunksVersion: str
+    chunks: List[TranscriptChunk]
+
+
+class TranscriptSummaryRest(TypedDict):
+    id: str
+    name: str
+    chunksVersion: str
+    tags: List[str]
+
+
+class ChunkBatchRequest(TypedDict):
+    ids: List[str]
+
+
+class ChunkBatchResponse(TypedDict):
+    chunks: List[TranscriptChunk]
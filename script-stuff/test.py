@@ -1,6 +1,12 @@
+import json
+import os
+import tempfile
+import time
 import unittest
 from typing import List, TypedDict
 from app import break_script_into_chunks  # Import your function
+from chunk_store import ChunkStore
+from corpus import TranscriptCorpus
 
 # Define the required types
 class TranscriptLine(TypedDict):
@@ -98,6 +104,113 @@ class TestTranscriptChunking(unittest.TestCase):
         chunks = break_script_into_chunks(no_sentence_script)
         self.assertEqual(chunks, expected_chunks)
 
+    def test_repeated_sentences_keep_their_own_timestamps(self):
+        """
+        Test that a sentence said twice gets the timestamp of each occurrence, not
+        the first one's.
+        """
+        repeated_script = {
+            "id": "test_id_4",
+            "name": "Repeated Sentences",
+            "lines": [
+                {"timeStamp": 0, "text": "Let's recap. The first idea is simple."},
+                {"timeStamp": 40, "text": "The second idea builds on it."},
+                {"timeStamp": 90, "text": "Let's recap. Both ideas fit together."},
+            ],
+        }
+        expected_chunks = [
+            (0, "Let's recap."),
+            (0, "The first idea is simple."),
+            (40, "The second idea builds on it."),
+            (90, "Let's recap."),
+            (90, "Both ideas fit together."),
+        ]
+
+        chunks = break_script_into_chunks(repeated_script)
+        self.assertEqual([(c["timeStamp"], c["text"]) for c in chunks], expected_chunks)
+
+
+def make_multi_hour_script(hours: int) -> dict:
+    """
+    A line every 3 seconds; each sentence starts on an even line and ends on the
+    following odd one.
+    """
+    nb_sentences = hours * 600
+    lines = []
+    for i in range(nb_sentences):
+        lines.append({"timeStamp": 6 * i, "text": f"Sentence number {i} starts on this line"})
+        lines.append({"timeStamp": 6 * i + 3, "text": "and finishes on the next one."})
+    return {"id": f"multi_hour_{hours}", "name": f"{hours} Hour Transcript", "lines": lines}
+
+
+class TestMultiHourTranscriptChunking(unittest.TestCase):
+    def test_three_hour_transcript(self):
+        """
+        Test that every sentence of a long transcript gets the timestamp of the line
+        it starts on.
+        """
+        script = make_multi_hour_script(3)
+        chunks = break_script_into_chunks(script)
+
+        self.assertEqual(len(chunks), 1800)
+        for i, chunk in enumerate(chunks):
+            self.assertEqual(chunk["id"], f"multi_hour_3-{i}")
+            self.assertEqual(chunk["timeStamp"], 6 * i)
+            self.assertEqual(chunk["text"], f"Sentence number {i} starts on this line and finishes on the next one.")
+
+    def test_chunking_time_grows_linearly(self):
+        """
+        Benchmark 1h vs 8h transcripts: chunking 8x the text should take nowhere near
+        the 64x a quadratic alignment would.
+        """
+        def time_chunking(script):
+            start = time.perf_counter()
+            break_script_into_chunks(script)
+            return time.perf_counter() - start
+
+        short_script, long_script = make_multi_hour_script(1), make_multi_hour_script(8)
+        time_chunking(short_script)
+        short_time = min(time_chunking(short_script) for _ in range(3))
+        long_time = min(time_chunking(long_script) for _ in range(3))
+        print("chunking 1h: %.1f ms, 8h: %.1f ms" % (short_time * 1000, long_time * 1000))
+        self.assertLess(long_time, short_time * 24)
+
+
+class TestCorpusChunksVersion(unittest.TestCase):
+    def test_tags_dont_change_chunks_version(self):
+        """
+        Test that tagging, retagging and untagging a transcript keeps its chunks
+        version, while editing its lines changes it.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            transcripts_dir = os.path.join(directory, "transcripts")
+            os.makedirs(transcripts_dir)
+            corpus = TranscriptCorpus(
+                transcripts_dir, ChunkStore(os.path.join(directory, "chunks"), break_script_into_chunks, 1),
+                rescan_interval=0)
+            script = {
+                "id": "tagged_id", "name": "Tagged Transcript",
+                "lines": [{"timeStamp": 0, "text": "The only sentence."}]}
+
+            mtimes_ns = iter(range(10 ** 18, 2 * 10 ** 18, 10 ** 9))
+
+            def version_with(transcript: dict) -> str:
+                file_path = os.path.join(transcripts_dir, "tagged_id.json")
+                with open(file_path, "w") as f:
+                    json.dump(transcript, f)
+                # A rewrite within the filesystem's mtime resolution wouldn't be noticed
+                mtime_ns = next(mtimes_ns)
+                os.utime(file_path, ns=(mtime_ns, mtime_ns))
+                return corpus.chunks_version("tagged_id")
+
+            untagged = version_with(script)
+            self.assertEqual(version_with({**script, "tags": ["physics"]}), untagged)
+            self.assertEqual(version_with({**script, "tags": ["physics", "entropy"]}), untagged)
+            self.assertEqual(version_with({"tags": [], **script}), untagged)
+            self.assertEqual(version_with(script), untagged)
+            edited = {**script, "lines": [{"timeStamp": 0, "text": "Another sentence."}]}
+            self.assertNotEqual(version_with(edited), untagged)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,243 @@
+"""
+HTTP client layer shared by the services that call other services (mounted into
+their containers like the generated API clients): one keep-alive connection pool per
+upstream, for requests and for httpx (async), with per-upstream timeouts and retries.
+
+Upstreams are named by the prefix of their URL environment variable - e.g.
+"OLLAMA_SERVICE" for OLLAMA_SERVICE_URL - and can be tuned with
+OLLAMA_SERVICE_CONNECT_TIMEOUT, OLLAMA_SERVICE_READ_TIMEOUT, OLLAMA_SERVICE_RETRIES
+and OLLAMA_SERVICE_POOL_SIZE.
+
+Every cross-service call in this system is a side-effect-free query, so POSTs are
+retried on connection errors and RETRY_STATUSES like GETs - but not once they've
+reached the upstream: a POST that timed out reading the response may still be
+running there (e.g. an LLM generation or a large embedding batch on the one GPU),
+and sending it again would only queue more work. That goes for the requests
+sessions, the generated clients and the httpx `request` and `stream` alike. Calls
+carry the current trace (see tracing.py), and the stages the upstream reports in
+its Server-Timing header are added to it.
+"""
+import asyncio
+import contextlib
+import importlib.util
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, Tuple, TypedDict
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import tracing
+
+
+# The upstream is restarting or overloaded
+RETRY_STATUSES = (502, 503, 504)
+RETRY_BACKOFF_SECONDS = 0.2
+# Failures before the request was sent, so safe to retry whatever it is
+RETRY_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+DEFAULT_CONNECT_TIMEOUT = 3.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 16
+UPSTREAM_DEFAULTS: Dict[str, Dict[str, float]] = {
+    # Generating an answer takes a while
+    "OLLAMA_SERVICE": {"read_timeout": 300.0},
+    # So does embedding a large batch
+    "EMBEDDING_GEN_SERVICE": {"read_timeout": 120.0},
+}
+
+# HTTP/2 for the async clients (needs the h2 package). Our upstreams are uvicorn and
+# Ollama, which only speak HTTP/1.1 over plain HTTP, so it's off by default
+HTTP2 = os.getenv("SERVICE_HTTP2", "0") == "1" and importlib.util.find_spec("h2") is not None
+
+
+class UpstreamConfig(TypedDict):
+    name: str
+    url: str
+    connect_timeout: float
+    read_timeout: float
+    retries: int
+    pool_size: int
+
+
+def upstream_config(name: str) -> UpstreamConfig:
+    defaults = UPSTREAM_DEFAULTS.get(name, {})
+
+    def setting(key: str, default: float) -> float:
+        value = os.getenv(f"{name}_{key.upper()}")
+        return float(value) if value else defaults.get(key, default)
+
+    return {
+        "name": name,
+        "url": (os.getenv(f"{name}_URL") or "").rstrip("/"),
+        "connect_timeout": setting("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+        "read_timeout": setting("read_timeout", DEFAULT_READ_TIMEOUT),
+        "retries": int(setting("retries", DEFAULT_RETRIES)),
+        "pool_size": int(setting("pool_size", DEFAULT_POOL_SIZE)),
+    }
+
+
+class UpstreamRetry(Retry):
+    """
+    Retries any method on connection errors and RETRY_STATUSES, but only GETs on
+    read timeouts and other errors after the request was sent.
+    """
+    def increment(self, method=None, *args, **kwargs):
+        if method is not None and method.upper() != "GET" and self.read is not False:
+            return self.new(read=False, other=0).increment(method, *args, **kwargs)
+        return super().increment(method, *args, **kwargs)
+
+
+def urllib3_retry(config: UpstreamConfig) -> UpstreamRetry:
+    return UpstreamRetry(
+        total=config["retries"],
+        backoff_factor=RETRY_BACKOFF_SECONDS,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,  # POSTs too, within UpstreamRetry's limits
+        raise_on_status=False)
+
+
+class UpstreamSession(requests.Session):
+    """
+    requests session for one upstream: paths are relative to its URL, and its
+    timeouts apply unless a call passes its own.
+    """
+    def __init__(self, config: UpstreamConfig):
+        super().__init__()
+        self.config = config
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config["pool_size"], max_retries=urllib3_retry(config))
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith("/"):
+            url = self.config["url"] + url
+        kwargs.setdefault("timeout", (self.config["connect_timeout"], self.config["read_timeout"]))
+        kwargs["headers"] = tracing.outgoing_headers(kwargs.get("headers"))
+        response = super().request(method, url, *args, **kwargs)
+        tracing.record_server_timing(response.headers.get(tracing.SERVER_TIMING_HEADER), self.config["name"])
+        return response
+
+
+_lock = threading.Lock()
+_sessions: Dict[str, UpstreamSession] = {}
+# httpx clients belong to the event loop they were made on
+_async_clients: Dict[Tuple[str, asyncio.AbstractEventLoop], httpx.AsyncClient] = {}
+
+
+def session(name: str) -> UpstreamSession:
+    """
+    The shared, pooled requests session for an upstream.
+    """
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = UpstreamSession(upstream_config(name))
+        return _sessions[name]
+
+
+def async_client(name: str) -> httpx.AsyncClient:
+    """
+    The shared, pooled httpx client for an upstream, on the running event loop.
+    Paths are relative to the upstream's URL. Only connection failures are retried at
+    this level; use `request` or `stream` to also retry RETRY_STATUSES.
+    """
+    key = (name, asyncio.get_running_loop())
+    if key not in _async_clients:
+        config = upstream_config(name)
+        _async_clients[key] = httpx.AsyncClient(
+            base_url=config["url"],
+            timeout=httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"]),
+            limits=httpx.Limits(max_connections=config["pool_size"], max_keepalive_connections=config["pool_size"]),
+            transport=httpx.AsyncHTTPTransport(retries=config["retries"], http2=HTTP2))
+    return _async_clients[key]
+
+
+async def request(name: str, method: str, path: str, **kwargs: Any) -> httpx.Response:
+    """
+    Make a request to an upstream, retrying connection errors and RETRY_STATUSES
+    with backoff, and raise for an error status. Other transport errors (read
+    timeouts, dropped connections) are only retried for GETs.
+    """
+    client = async_client(name)
+    retries = upstream_config(name)["retries"]
+    kwargs["headers"] = tracing.outgoing_headers(kwargs.get("headers"))
+    for attempt in range(retries + 1):
+        try:
+            response = await client.request(method, path, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                response.raise_for_status()
+                tracing.record_server_timing(response.headers.get(tracing.SERVER_TIMING_HEADER), name)
+                return response
+        except httpx.TransportError as e:
+            if attempt == retries or not retryable_error(method, e):
+                raise
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+    raise AssertionError("unreachable")
+
+
+@contextlib.asynccontextmanager
+async def stream(name: str, method: str, path: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+    """
+    Like `request`, but for reading the response body as it arrives: retries happen
+    before the response is handed over, never once its body is being read.
+    """
+    client = async_client(name)
+    retries = upstream_config(name)["retries"]
+    kwargs["headers"] = tracing.outgoing_headers(kwargs.get("headers"))
+    for attempt in range(retries + 1):
+        try:
+            response = await client.send(client.build_request(method, path, **kwargs), stream=True)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                break
+            await response.aclose()
+        except httpx.TransportError as e:
+            if attempt == retries or not retryable_error(method, e):
+                raise
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+    try:
+        if response.is_error:
+            # For the error's detail
+            await response.aread()
+            response.raise_for_status()
+        tracing.record_server_timing(response.headers.get(tracing.SERVER_TIMING_HEADER), name)
+        yield response
+    finally:
+        await response.aclose()
+
+
+def retryable_error(method: str, error: httpx.TransportError) -> bool:
+    # A POST that got through may still be running upstream
+    return method.upper() == "GET" or isinstance(error, RETRY_CONNECT_ERRORS)
+
+
+async def close_async_clients():
+    """
+    Close the running event loop's clients, e.g. on app shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _async_clients if k[1] is loop]:
+        await _async_clients.pop(key).aclose()
+
+
+def openapi_api(client_module: Any, name: str) -> Any:
+    """
+    A generated OpenAPI client's DefaultApi for an upstream, with the upstream's pool
+    size and retries, passing on the current trace. (The generated clients take
+    timeouts per call only.)
+    """
+    config = upstream_config(name)
+    configuration = client_module.Configuration(host=config["url"])
+    configuration.retries = urllib3_retry(config)
+    configuration.connection_pool_maxsize = config["pool_size"]
+    api_client = client_module.ApiClient(configuration=configuration)
+    call_api = api_client.call_api
+
+    def call_api_traced(method, url, header_params=None, *args, **kwargs):
+        response = call_api(method, url, tracing.outgoing_headers(header_params), *args, **kwargs)
+        tracing.record_server_timing(response.getheader(tracing.SERVER_TIMING_HEADER), name)
+        return response
+
+    api_client.call_api = call_api_traced
+    return client_module.DefaultApi(api_client)
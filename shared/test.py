@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import requests
+
+import service_http
+import tracing
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """
+    Answers after `delay` seconds, or with `status` straight away, counting requests.
+    """
+    delay = 0.0
+    status = 200
+    count = 0
+
+    def respond(self):
+        type(self).count += 1
+        if self.headers.get("Content-Length"):
+            self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.delay)
+        self.send_response(self.status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUpstreamSessionRetries(unittest.TestCase):
+    def setUp(self):
+        SlowHandler.delay, SlowHandler.status, SlowHandler.count = 0.0, 200, 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        os.environ["TEST_UPSTREAM_URL"] = f"http://127.0.0.1:{self.server.server_port}"
+        os.environ["TEST_UPSTREAM_READ_TIMEOUT"] = "0.2"
+        os.environ["TEST_UPSTREAM_RETRIES"] = "2"
+        self.session = service_http.UpstreamSession(service_http.upstream_config("TEST_UPSTREAM"))
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_post_read_timeout_is_not_retried(self):
+        SlowHandler.delay = 0.5
+        with self.assertRaises(requests.ReadTimeout):
+            self.session.post("/generate-embeddings", json={"sentences": ["a"]})
+        self.assertEqual(SlowHandler.count, 1)
+
+    def test_get_read_timeout_is_retried(self):
+        SlowHandler.delay = 0.5
+        with self.assertRaises(requests.ConnectionError):
+            self.session.get("/ping")
+        self.assertEqual(SlowHandler.count, 3)
+
+    def test_post_retry_status_is_retried(self):
+        SlowHandler.status = 503
+        response = self.session.post("/generate-embeddings", json={"sentences": ["a"]})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(SlowHandler.count, 3)
+
+
+class TestAsyncStream(unittest.TestCase):
+    def stream_lines(self, handler) -> list:
+        async def run():
+            os.environ["TEST_STREAM_URL"] = "http://upstream"
+            loop = asyncio.get_running_loop()
+            service_http._async_clients[("TEST_STREAM", loop)] = httpx.AsyncClient(
+                base_url="http://upstream", transport=httpx.MockTransport(handler))
+            try:
+                with tracing.trace("test"):
+                    async with service_http.stream("TEST_STREAM", "POST", "/api/generate", json={}) as response:
+                        return [line async for line in response.aiter_lines()]
+            finally:
+                await service_http.close_async_clients()
+        return asyncio.run(run())
+
+    def test_retries_status_then_streams_with_traceparent(self):
+        requests_seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests_seen.append(request)
+            if len(requests_seen) == 1:
+                return httpx.Response(503)
+            return httpx.Response(200, content=b'{"response": "a"}\n{"done": true}\n')
+
+        self.assertEqual(self.stream_lines(handler), ['{"response": "a"}', '{"done": true}'])
+        self.assertEqual(len(requests_seen), 2)
+        self.assertTrue(all(tracing.TRACEPARENT_HEADER in r.headers for r in requests_seen))
+
+    def test_post_read_timeout_is_not_retried(self):
+        requests_seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests_seen.append(request)
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        with self.assertRaises(httpx.ReadTimeout):
+            self.stream_lines(handler)
+        self.assertEqual(len(requests_seen), 1)
+
+    def test_error_status_raises_with_body(self):
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(404, json={"error": "model not found"})
+
+        with self.assertRaises(httpx.HTTPStatusError) as raised:
+            self.stream_lines(handler)
+        self.assertIn("model not found", raised.exception.response.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
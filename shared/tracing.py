@@ -0,0 +1,292 @@
+"""
+Request tracing and Prometheus-style metrics shared by the services (mounted into
+their containers like service_http), with nothing extra to run:
+
+- Every request is handled in a trace. Its ID comes from the caller's W3C
+  `traceparent` header (or is made up), and service_http passes it on to every
+  service called while handling the request, so one trace ID follows a question
+  round through all of them. Responses carry it back in `traceparent`.
+- `span("search")` times a stage of handling a request. Spans are added to the
+  trace, to a stage-duration histogram and to the response's `Server-Timing` header
+  (those finished before it's sent), which service_http reads back into the
+  caller's trace - so the question answerer's trace includes the embedding index's
+  embed and search stages.
+- `instrument(app, "service-name")` sets this up for an app and adds GET /metrics:
+  request and stage durations in the Prometheus text format, per process.
+
+Requests slower than TRACE_LOG_SLOWER_THAN seconds are printed with their spans.
+"""
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypedDict
+
+
+TRACEPARENT_HEADER = "traceparent"
+SERVER_TIMING_HEADER = "server-timing"
+TRACE_LOG_SLOWER_THAN = float(os.getenv("TRACE_LOG_SLOWER_THAN", "5"))
+
+# Seconds; from a cache hit up to a long LLM answer
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Span(TypedDict):
+    name: str
+    service: str  # Service that timed it
+    seconds: float
+
+
+class Trace:
+    """
+    The spans timed while handling one request (or, for a sub-trace, part of one).
+    """
+    def __init__(self, trace_id: str, service: str, parent: Optional["Trace"] = None):
+        self.trace_id = trace_id
+        self.service = service
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.spans: List[Span] = []
+
+    def record(self, name: str, seconds: float, service: Optional[str] = None):
+        span: Span = {"name": name, "service": service or self.service, "seconds": seconds}
+        trace: Optional[Trace] = self
+        while trace is not None:
+            trace.spans.append(span)
+            trace = trace.parent
+
+    def totals(self) -> Dict[str, float]:
+        """
+        Seconds spent per stage; other services' stages are prefixed with their name.
+        """
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            key = span["name"] if span["service"] == self.service else f"{span['service']}.{span['name']}"
+            totals[key] = totals.get(key, 0.0) + span["seconds"]
+        return totals
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[str]:
+    """
+    :return: The trace ID of a W3C traceparent header, if it's a valid one.
+    """
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or parts[1] == "0" * 32:
+        return None
+    try:
+        int(parts[1], 16)
+    except ValueError:
+        return None
+    return parts[1].lower()
+
+
+@contextmanager
+def trace(service: str, traceparent: Optional[str] = None) -> Iterator[Trace]:
+    """
+    Handle something (e.g. a request) in a new trace, continuing the caller's if a
+    traceparent is given.
+    """
+    current = Trace(parse_traceparent(traceparent) or secrets.token_hex(16), service)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def sub_trace() -> Iterator[Trace]:
+    """
+    Collect the spans of part of the current request - e.g. one of several
+    concurrent tasks - on their own, as well as in the request's trace.
+    """
+    parent = _current_trace.get()
+    current = Trace(parent.trace_id if parent else secrets.token_hex(16), parent.service if parent else "", parent)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+def sum_totals(*totals: Dict[str, float]) -> Dict[str, float]:
+    summed: Dict[str, float] = {}
+    for stage_totals in totals:
+        for stage, seconds in stage_totals.items():
+            summed[stage] = summed.get(stage, 0.0) + seconds
+    return summed
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Label values -> (cumulative count per bucket, sum, count)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            counts, total, count = self._series.get(label_values) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[label_values] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = ",".join(f'{k}="{escape_label(v)}"' for k, v in zip(self.label_names, label_values))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, to the end of its response body",
+    ("service", "method", "route", "status"))
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds", "Time spent in a stage of handling requests", ("service", "stage"))
+
+
+def record(name: str, seconds: float, service: Optional[str] = None):
+    """
+    Add a stage timed some other way (e.g. reported by Ollama) to the current trace.
+    """
+    current = _current_trace.get()
+    if current is not None:
+        current.record(name, seconds, service)
+        STAGE_SECONDS.observe(seconds, service or current.service, name)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Time a stage of handling the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def outgoing_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    `headers` plus the current trace's traceparent, for a call to another service.
+    """
+    headers = dict(headers or {})
+    current = _current_trace.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent()
+    return headers
+
+
+def server_timing(spans: List[Span]) -> str:
+    # Durations in milliseconds, as the spec has it; the service that timed each goes in desc
+    return ", ".join(f'{s["name"]};dur={s["seconds"] * 1000:.2f};desc="{s["service"]}"' for s in spans)
+
+
+def record_server_timing(header: Optional[str], service: str):
+    """
+    Add the stages another service reported in its Server-Timing header to the
+    current trace.
+    """
+    current = _current_trace.get()
+    if not header or current is None:
+        return
+    for metric in header.split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        values = dict(p.split("=", 1) for p in params if "=" in p)
+        try:
+            seconds = float(values.get("dur", "")) / 1000
+        except ValueError:
+            continue
+        if name:
+            current.record(name, seconds, values.get("desc", service).strip('"'))
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that runs each request in a trace and times it to the end of
+    its response body, so streamed responses are timed in full.
+    """
+    def __init__(self, app: Any, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(TRACEPARENT_HEADER.encode("latin-1"), b"").decode("latin-1")
+        status = 500
+        start = time.perf_counter()
+        with trace(self.service, traceparent) as current:
+            async def send_with_trace(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    response_headers = list(message.get("headers", []))
+                    response_headers.append((TRACEPARENT_HEADER.encode("latin-1"), current.traceparent().encode()))
+                    if current.spans:
+                        timing = server_timing(current.spans).encode()
+                        response_headers.append((SERVER_TIMING_HEADER.encode("latin-1"), timing))
+                    message = {**message, "headers": response_headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                seconds = time.perf_counter() - start
+                route = scope.get("route")
+                route_path = getattr(route, "path", None) or "unmatched"
+                REQUEST_SECONDS.observe(seconds, self.service, scope["method"], route_path, str(status))
+                if seconds >= TRACE_LOG_SLOWER_THAN:
+                    stages = ", ".join(f"{k} {v:.3f}s" for k, v in current.totals().items())
+                    print(f"Slow request {scope['method']} {scope['path']} ({status}) took {seconds:.3f}s, "
+                          f"trace {current.trace_id}: {stages or 'no stages timed'}")
+
+
+def render_metrics(gauges: Optional[Callable[[], Dict[str, float]]] = None) -> str:
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render()
+    for name, value in (gauges() if gauges is not None else {}).items():
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def instrument(app: Any, service: str, gauges: Optional[Callable[[], Dict[str, float]]] = None):
+    """
+    Trace and time an app's requests, and serve its metrics at GET /metrics.
+    :param gauges: Returns further metrics to report as they are now, by name.
+    """
+    from fastapi.responses import PlainTextResponse
+    app.add_middleware(TracingMiddleware, service=service)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")